@@ -0,0 +1,88 @@
+import wx
+from ObjectListView import ColumnDefn
+
+import song_diff
+import utils
+
+
+class DiffRowView(object):
+
+    def __init__(self, song, section, change, details):
+        self.song = song
+        self.section = section
+        self.change = change
+        self.details = "; ".join(details)
+
+
+def diff_rows(song_diffs):
+    rows = []
+
+    for diff in song_diffs:
+        song = song_diff.format_song(diff)
+
+        # Songs that were added or removed, or only renamed, get a row of
+        # their own; otherwise each section that changed does
+        if len(diff.sections) == 0 or len(diff.details) > 0:
+            rows.append(DiffRowView(song, "--", diff.change, diff.details))
+
+        for section_diff in diff.sections:
+            rows.append(DiffRowView(
+                song, song_diff.format_section(section_diff.kind,
+                                               section_diff.index),
+                section_diff.change, section_diff.details))
+
+    return rows
+
+
+class DiffWindow(wx.Frame):
+
+    def __init__(self, parent, title, song_diffs):
+        wx.Frame.__init__(
+            self, parent, wx.ID_ANY, "Compare - %s" % (title),
+            size=(800, 450))
+
+        self.title = title
+        self.song_diffs = song_diffs
+
+        panel = wx.Panel(self)
+
+        self.diff_list = utils.new_obj_list_view(panel)
+        self.diff_list.SetEmptyListMsg("No differences")
+
+        song_col = ColumnDefn("Song", "left", 160, "song")
+        section_col = ColumnDefn("Section", "left", 100, "section")
+        change_col = ColumnDefn("Change", "left", 70, "change")
+        details_col = ColumnDefn("Details", "left", 400, "details",
+                                 isSpaceFilling=True)
+
+        self.diff_list.SetColumns(
+            [song_col, section_col, change_col, details_col])
+
+        self.diff_list.SetObjects(diff_rows(song_diffs))
+
+        export_button = wx.Button(panel, wx.ID_ANY, "Export as Text ...")
+        self.Bind(wx.EVT_BUTTON, self.export, export_button)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        button_sizer.AddStretchSpacer()
+        button_sizer.Add(export_button)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.diff_list, 1, wx.ALL | wx.EXPAND, border=5)
+        sizer.Add(button_sizer, 0, wx.ALL | wx.EXPAND, border=5)
+        panel.SetSizer(sizer)
+
+        self.Layout()
+        self.Show()
+
+    def export(self, event=None):
+        def ok_handler(dlg, path):
+            try:
+                with open(path, 'w') as fp:
+                    fp.write(self.title + '\n\n')
+                    fp.write(song_diff.format_diff(self.song_diffs) + '\n')
+            except (IOError, OSError), e:
+                utils.show_error_dialog("Export failed", str(e), self, e)
+
+        utils.file_dialog("Export differences", "*.txt", wx.SAVE, ok_handler,
+                          default_file="differences.txt")
@@ -0,0 +1,49 @@
+import wx
+from ObjectListView import ColumnDefn
+
+import utils
+
+
+class DuplicateGroupView(object):
+
+    def __init__(self, content_index, kind, locations):
+        self.kind = kind
+        self.count = len(locations)
+        self.first_occurrence = content_index.format_location(locations[0])
+        self.other_locations = ", ".join(
+            content_index.format_location(location)
+            for location in locations[1:])
+
+
+class DuplicatesWindow(wx.Frame):
+
+    def __init__(self, parent, content_index):
+        wx.Frame.__init__(
+            self, parent, wx.ID_ANY, "Duplicates", size=(700, 400))
+
+        panel = wx.Panel(self)
+
+        self.duplicates_list = utils.new_obj_list_view(panel)
+        self.duplicates_list.SetEmptyListMsg("No duplicates found")
+
+        kind_col = ColumnDefn("Kind", "left", 80, "kind")
+        count_col = ColumnDefn("Copies", "center", 60, "count")
+        first_col = ColumnDefn("First Occurrence", "left", 180,
+                               "first_occurrence")
+        others_col = ColumnDefn("Also In", "left", 300, "other_locations",
+                                isSpaceFilling=True)
+
+        self.duplicates_list.SetColumns(
+            [kind_col, count_col, first_col, others_col])
+
+        self.duplicates_list.SetObjects([
+            DuplicateGroupView(content_index, kind, locations)
+            for (kind, digest, locations) in
+            content_index.duplicate_groups()])
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.duplicates_list, 1, wx.ALL | wx.EXPAND, border=5)
+        panel.SetSizer(sizer)
+
+        self.Layout()
+        self.Show()
@@ -1,27 +1,37 @@
 import wx
 
+import utils
 from ViewField import ViewField
 
 
 class ImageSetViewField(ViewField):
 
     def __init__(self, parent, attr_fn, images):
+        # images maps each possible value of attr_fn to the name of an
+        # embedded image; bitmaps come from the shared cache in utils
         if isinstance(images, list):
             first_image = images[0]
         elif isinstance(images, dict):
             first_image = images[images.keys()[0]]
 
-        empty_img = wx.BitmapFromImage(wx.EmptyImage(
-            first_image.GetWidth(), first_image.GetHeight()))
+        first_bitmap = utils.make_bitmap(first_image)
+
+        empty_img = wx.EmptyBitmap(
+            first_bitmap.GetWidth(), first_bitmap.GetHeight())
 
         ViewField.__init__(
             self, parent, wx.StaticBitmap(parent, wx.ID_ANY, empty_img))
         self.images = images
         self.attr_fn = attr_fn
+        self.current_image = None
 
     def update(self, data):
         instr = data
 
-        self.field.SetBitmap(wx.BitmapFromImage(
-            self.images[self.attr_fn(instr)]))
+        image_name = self.images[self.attr_fn(instr)]
+
+        if image_name != self.current_image:
+            self.field.SetBitmap(utils.make_bitmap(image_name))
+            self.current_image = image_name
+
         super(ImageSetViewField, self).update(data)
@@ -2,6 +2,7 @@ import wx
 from ObjectListView import ColumnDefn, ObjectListView
 
 import channels
+import history
 
 import utils
 
@@ -11,13 +12,23 @@ from WaveInstrumentPanel import WaveInstrumentPanel
 from KitInstrumentPanel import KitInstrumentPanel
 from NoiseInstrumentPanel import NoiseInstrumentPanel
 
+INSTR_PANEL_CLASSES = {
+    None: NoInstrumentSelectedPanel,
+    "pulse": PulseInstrumentPanel,
+    "wave": WaveInstrumentPanel,
+    "kit": KitInstrumentPanel,
+    "noise": NoiseInstrumentPanel
+}
+
 
 class InstrumentPane(wx.Panel):
 
-    def __init__(self, parent, project, index):
+    def __init__(self, parent, project, index, reference_index):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
         self.project = project
+        self.index = index
+        self.reference_index = reference_index
 
         self.instr_list = utils.new_obj_list_view(
             self, edit_mode=ObjectListView.CELLEDIT_DOUBLECLICK)
@@ -35,7 +46,14 @@ class InstrumentPane(wx.Panel):
         song_modified_channel = channels.SONG_MODIFIED(index)
 
         def name_setter(instrument, new_name):
+            edit = history.SongEdit(
+                self.project, index, "Rename Instrument %02x" % (
+                    instrument.index),
+                history.instrument_sections(instrument.index))
+
             instrument.name = new_name.upper()[:5]
+
+            history.record(edit)
             song_modified_channel.publish(self.project)
 
         id_col = ColumnDefn("#", "center", 30, lambda x: "%02x" %
@@ -47,17 +65,17 @@ class InstrumentPane(wx.Panel):
 
         type_col = ColumnDefn("Type", "left", 50, "type", isSpaceFilling=True,
                               isEditable=False)
-        self.instr_list.SetColumns([id_col, name_col, type_col])
+        used_by_col = ColumnDefn(
+            "Used By", "left", 100,
+            lambda x: reference_index.format_users_of("instrument", x.index),
+            isSpaceFilling=True, isEditable=False)
+        self.instr_list.SetColumns([id_col, name_col, type_col, used_by_col])
 
         self.update_instr_list()
 
-        self.instr_panels = {
-            None: NoInstrumentSelectedPanel(self),
-            "pulse": PulseInstrumentPanel(self),
-            "wave": WaveInstrumentPanel(self),
-            "kit": KitInstrumentPanel(self),
-            "noise": NoiseInstrumentPanel(self)
-        }
+        # Panels for each instrument type are built the first time an
+        # instrument of that type is selected, and then kept around
+        self.instr_panels = {}
 
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.handle_instr_changed,
                   self.instr_list)
@@ -67,14 +85,16 @@ class InstrumentPane(wx.Panel):
         channel.subscribe(self.handle_instr_changed)
         channel.subscribe(self.update_instr_list)
 
-        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        channels.REFERENCES_CHANGED(project).subscribe(
+            self.handle_references_changed)
+        channels.SECTIONS_CHANGED(project).subscribe(
+            self.handle_sections_changed)
 
-        sizer.Add(self.instr_list, 0, wx.ALL | wx.EXPAND, border=5)
+        self.sizer = wx.BoxSizer(wx.HORIZONTAL)
 
-        for panel in self.instr_panels.values():
-            sizer.Add(panel, 1, wx.EXPAND)
+        self.sizer.Add(self.instr_list, 0, wx.ALL | wx.EXPAND, border=5)
 
-        self.SetSizer(sizer)
+        self.SetSizer(self.sizer)
 
         self.show_instr_panel(None)
 
@@ -84,21 +104,44 @@ class InstrumentPane(wx.Panel):
     def refresh(self):
         self.update_instr_list()
 
+    def handle_sections_changed(self, data=None):
+        if data is None:
+            return
+
+        self.update_instr_list()
+
+        if self.selected_instrument is not None:
+            self.show_instr_panel(
+                self.project.song.instruments[self.selected_instrument])
+
+    def handle_references_changed(self, data=None):
+        self.instr_list.RefreshObjects(self.instr_list.GetObjects())
+
     def show_instr_panel(self, instrument):
         instr_type = None
 
         if instrument is not None:
             instr_type = instrument.type
 
-        for (key, val) in self.instr_panels.items():
-            if key == instr_type:
-                val.Show()
-                val.change_instrument(instrument)
-            else:
-                val.Hide()
+        selected_panel = self.get_instr_panel(instr_type)
+
+        for panel in self.instr_panels.values():
+            if panel is not selected_panel:
+                panel.Hide()
+
+        selected_panel.Show()
+        selected_panel.change_instrument(instrument)
 
         self.Layout()
 
+    def get_instr_panel(self, instr_type):
+        if instr_type not in self.instr_panels:
+            panel = INSTR_PANEL_CLASSES[instr_type](self)
+            self.sizer.Add(panel, 1, wx.EXPAND)
+            self.instr_panels[instr_type] = panel
+
+        return self.instr_panels[instr_type]
+
     def handle_instr_changed(self, data=None):
         if data is None:
             return
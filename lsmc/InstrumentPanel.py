@@ -2,6 +2,8 @@ import wx
 
 import channels
 import utils
+import dedup
+import history
 
 from StaticTextViewField import StaticTextViewField
 from ViewField import ViewField
@@ -58,14 +60,18 @@ class InstrumentPanel(wx.Panel):
     def add_footer_gui(self):
         import_button = wx.Button(self, wx.ID_ANY, label="Import ...")
         export_button = wx.Button(self, wx.ID_ANY, label="Export ...")
+        copies_button = wx.Button(self, wx.ID_ANY, label="Find Copies ...")
 
         self.Bind(wx.EVT_BUTTON, self.import_instrument, import_button)
         self.Bind(wx.EVT_BUTTON, self.export_instrument, export_button)
+        self.Bind(wx.EVT_BUTTON, self.find_copies, copies_button)
 
         bottom_buttons_sizer = wx.BoxSizer(wx.HORIZONTAL)
         bottom_buttons_sizer.Add(import_button, 1, wx.EXPAND | wx.ALL)
         bottom_buttons_sizer.AddSpacer(10)
         bottom_buttons_sizer.Add(export_button, 1, wx.EXPAND | wx.ALL)
+        bottom_buttons_sizer.AddSpacer(10)
+        bottom_buttons_sizer.Add(copies_button, 1, wx.EXPAND | wx.ALL)
 
         self.sizer.AddSpacer(15)
         self.sizer.Add(bottom_buttons_sizer, .2, wx.EXPAND | wx.ALL)
@@ -95,13 +101,22 @@ class InstrumentPanel(wx.Panel):
 
     def import_instrument(self, event):
         def ok_handler(dlg, path):
+            index = self.instrument.index
+
+            edit = history.SongEdit(
+                self.GetParent().project, self.GetParent().index,
+                "Import Instrument %02x" % (index),
+                history.instrument_import_sections(index))
+
             try:
-                index = self.instrument.index
                 self.instrument.song.instruments.import_from_file(index, path)
                 self.instrument = self.instrument.song.instruments[index]
                 self.instr_imported_channel.publish(self.instrument)
             except Exception, e:
                 utils.show_error_dialog('Import Failed', str(e), self)
+            finally:
+                # A failed import may still have changed part of the song
+                history.record(edit)
 
         utils.file_dialog(
             "Load instrument", "*.lsdinst", wx.OPEN, ok_handler)
@@ -119,6 +134,30 @@ class InstrumentPanel(wx.Panel):
             "Save instrument as ...", "*.lsdinst", wx.SAVE, ok_handler,
             default_file=default_file)
 
+    def find_copies(self, event):
+        content_index = dedup.current_index()
+
+        if content_index is None:
+            wx.MessageBox(
+                "Use 'Find Duplicates ...' in the main window to scan the "
+                ".sav first.", "No Scan Available",
+                wx.OK | wx.ICON_INFORMATION, self)
+            return
+
+        digest = dedup.instrument_digest(
+            self.instrument.song.song_data, self.instrument.index)
+        locations = content_index.locations("instrument", digest)
+
+        if len(locations) == 0:
+            message = "This instrument wasn't found in the last scan."
+        else:
+            message = "This instrument appears in:\n\n" + "\n".join(
+                content_index.format_location(location)
+                for location in locations)
+
+        wx.MessageBox(message, "Instrument %02x" % (self.instrument.index),
+                      wx.OK | wx.ICON_INFORMATION, self)
+
     def field_changed(self):
         """
         We want to call self.Layout() only when all fields have been updated to
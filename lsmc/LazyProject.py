@@ -0,0 +1,75 @@
+from pylsdj.savfile import NUM_FILES
+
+
+class LazyProject(object):
+    """
+    Stands in for a pylsdj Project that lives in a .sav file. The song's name,
+    version and size all come from the .sav's header block; the song itself is
+    only decompressed and parsed the first time something needs it.
+    """
+
+    def __init__(self, sav_obj, index, size_blks):
+        self.index = index
+
+        self._sav_obj = sav_obj
+        self._size_blks = size_blks
+        self._project = None
+
+    @property
+    def loaded(self):
+        return self._project is not None
+
+    @property
+    def project(self):
+        if self._project is None:
+            self._project = self._sav_obj.projects[self.index]
+
+        return self._project
+
+    @property
+    def name(self):
+        if self.loaded:
+            return self._project.name
+
+        return self._sav_obj.header_block.filenames[self.index]
+
+    @property
+    def version(self):
+        if self.loaded:
+            return self._project.version
+
+        return self._sav_obj.header_block.file_versions[self.index]
+
+    @property
+    def size_blks(self):
+        if self.loaded:
+            return self._project.size_blks
+
+        return self._size_blks
+
+    def __getattr__(self, attr):
+        # Only reached for attributes that aren't defined above, i.e. anything
+        # that actually needs the song's data
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+
+        return getattr(self.project, attr)
+
+
+def lazy_project_list(sav_obj):
+    block_counts = [0] * NUM_FILES
+
+    for file_number in sav_obj.header_block.block_alloc_table:
+        if file_number < NUM_FILES:
+            block_counts[file_number] += 1
+
+    project_list = []
+
+    for index in xrange(NUM_FILES):
+        if block_counts[index] == 0:
+            project_list.append((index, None))
+        else:
+            project_list.append(
+                (index, LazyProject(sav_obj, index, block_counts[index])))
+
+    return project_list
@@ -0,0 +1,192 @@
+import wx
+from ObjectListView import ColumnDefn
+
+import utils
+import background
+import event_handlers
+import library
+
+
+class LibraryWindow(wx.Frame):
+
+    def __init__(self, main_window):
+        wx.Frame.__init__(
+            self, main_window, wx.ID_ANY, "Library", size=(700, 500))
+
+        self.main_window = main_window
+        self.library = library.Library()
+
+        panel = wx.Panel(self)
+
+        self.search_field = wx.SearchCtrl(panel, wx.ID_ANY)
+        self.search_field.ShowCancelButton(True)
+        self.search_field.Bind(wx.EVT_TEXT, self.handle_search)
+        self.search_field.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN,
+                               self.handle_search_cancelled)
+
+        self.duplicates_only = wx.CheckBox(panel, wx.ID_ANY,
+                                           "Duplicates Only")
+        self.Bind(wx.EVT_CHECKBOX, self.handle_search, self.duplicates_only)
+
+        search_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        search_sizer.Add(self.search_field, 1, wx.EXPAND)
+        search_sizer.AddSpacer(10)
+        search_sizer.Add(self.duplicates_only, 0, wx.ALIGN_CENTER_VERTICAL)
+
+        self.songs_list = utils.new_obj_list_view(panel)
+        self.songs_list.SetEmptyListMsg("No songs found")
+
+        def format_slot(slot):
+            if slot is None:
+                return "--"
+
+            return "%02d" % (slot + 1)
+
+        name_col = ColumnDefn("Name", "left", 100, "name")
+        version_col = ColumnDefn("Version", "center", 60, "version",
+                                 stringConverter="%02x")
+        size_col = ColumnDefn("Blocks", "center", 60, "size_blks")
+        slot_col = ColumnDefn("Song", "center", 50, "slot",
+                              stringConverter=format_slot)
+        file_col = ColumnDefn("File", "left", 300, "file_path",
+                              isSpaceFilling=True)
+
+        self.songs_list.SetColumns(
+            [name_col, version_col, size_col, slot_col, file_col])
+
+        self.songs_list.Bind(wx.EVT_LIST_ITEM_SELECTED,
+                             self.handle_selection_changed)
+        self.songs_list.Bind(wx.EVT_LIST_ITEM_DESELECTED,
+                             self.handle_selection_changed)
+        self.songs_list.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.open_song_file)
+
+        add_folder_button = wx.Button(panel, wx.ID_ANY, "Add Folder ...")
+        self.rescan_button = wx.Button(panel, wx.ID_ANY, "Rescan")
+        self.open_button = wx.Button(panel, wx.ID_ANY, "Open .sav")
+        self.open_button.Disable()
+
+        self.Bind(wx.EVT_BUTTON, self.add_folder, add_folder_button)
+        self.Bind(wx.EVT_BUTTON, self.rescan, self.rescan_button)
+        self.Bind(wx.EVT_BUTTON, self.open_song_file, self.open_button)
+
+        self.status_label = wx.StaticText(panel, wx.ID_ANY, "")
+
+        buttons_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        buttons_sizer.Add(add_folder_button)
+        buttons_sizer.AddSpacer(10)
+        buttons_sizer.Add(self.rescan_button)
+        buttons_sizer.AddSpacer(10)
+        buttons_sizer.Add(self.open_button)
+        buttons_sizer.AddSpacer(10)
+        buttons_sizer.Add(self.status_label, 1, wx.ALIGN_CENTER_VERTICAL)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(search_sizer, 0, wx.ALL | wx.EXPAND, border=5)
+        sizer.Add(self.songs_list, 1, wx.ALL | wx.EXPAND, border=5)
+        sizer.Add(buttons_sizer, 0, wx.ALL | wx.EXPAND, border=5)
+        panel.SetSizer(sizer)
+
+        self.Bind(wx.EVT_CLOSE, self.handle_close)
+
+        self.refresh_songs()
+
+        self.Layout()
+        self.Show()
+
+    def refresh_songs(self):
+        search_text = self.search_field.GetValue().strip()
+
+        if self.duplicates_only.GetValue():
+            songs = self.library.duplicates()
+
+            if len(search_text) > 0:
+                songs = [song for song in songs
+                         if search_text.lower() in song.name.lower()]
+        elif len(search_text) > 0:
+            songs = self.library.find_songs(search_text)
+        else:
+            songs = self.library.all_songs()
+
+        self.songs_list.SetObjects(songs)
+
+        self.status_label.SetLabel("%d song(s) in %d folder(s)" % (
+            len(songs), len(self.library.roots())))
+
+        self.handle_selection_changed()
+
+    def handle_search(self, event):
+        self.refresh_songs()
+
+    def handle_search_cancelled(self, event):
+        self.search_field.SetValue("")
+
+    def handle_selection_changed(self, event=None):
+        song = self.songs_list.GetSelectedObject()
+
+        self.open_button.Enable(song is not None and song.slot is not None)
+
+        if event is not None:
+            event.Skip()
+
+    def add_folder(self, event):
+        dlg = wx.DirDialog(self, "Choose a folder to add to the library",
+                           style=wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST)
+
+        if dlg.ShowModal() == wx.ID_OK:
+            path = dlg.GetPath()
+            self.library.add_root(path)
+            self.rescan(paths=[path])
+
+        dlg.Destroy()
+
+    def rescan(self, event=None, paths=None):
+        if paths is None:
+            paths = self.library.roots()
+
+        # SQLite connections can't be shared between threads, so the worker
+        # opens one of its own
+        db_path = self.library.db_path
+
+        def scan(task):
+            worker_library = library.Library(db_path)
+
+            try:
+                return worker_library.rescan(
+                    paths=paths, callback=task.report_progress)
+            finally:
+                worker_library.close()
+
+        def on_finished(*args):
+            self.rescan_button.Enable()
+            self.refresh_songs()
+
+        def on_error(e):
+            on_finished()
+            utils.show_error_dialog("Failed to scan library", str(e), self)
+
+        self.rescan_button.Disable()
+
+        background.BackgroundTask(
+            scan, on_success=on_finished, on_error=on_error,
+            on_cancel=on_finished,
+            progress_dialog=background.TaskProgressDialog(
+                "Scanning Library", "Looking for files", self)).start()
+
+    def open_song_file(self, event):
+        song = self.songs_list.GetSelectedObject()
+
+        if song is None or song.slot is None:
+            return
+
+        main_window = self.main_window
+
+        event_handlers.load_sav(
+            song.file_path, main_window.songs_window, main_window)
+
+    def handle_close(self, event):
+        self.library.close()
+        self.Destroy()
+
+
+def open_library_window(event, main_window):
+    LibraryWindow(main_window)
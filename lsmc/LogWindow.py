@@ -1,15 +1,235 @@
+import atexit
+import collections
+import itertools
+import os
 import sys
+import threading
+import time
 
 import wx
 
+import dirs
+import utils
+
+# Lines kept for the console window; anything older is only in the log file
+MAX_SCROLLBACK_LINES = 5000
+
+# Writes waiting to be picked up by the spill thread. If something writes
+# faster than they can be drained, the oldest ones are dropped.
+MAX_PENDING_WRITES = 100000
+
+# A line that never ends is cut off at this length
+MAX_LINE_LENGTH = 4096
+
+# How often (in seconds) pending writes are moved into the scrollback and the
+# log file, and how often (in ms) an open console window picks them up
+SPILL_INTERVAL = 0.1
+REFRESH_INTERVAL_MS = 200
+
+LOG_FILENAME = "console.log"
+MAX_LOG_FILE_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class RotatingLogFile(object):
+
+    def __init__(self, directory, filename=LOG_FILENAME,
+                 max_bytes=MAX_LOG_FILE_BYTES, backups=LOG_FILE_BACKUPS):
+        self.directory = directory
+        self.path = os.path.join(directory, filename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self._fp = None
+        self._size = 0
+
+    def _open(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        self._fp = open(self.path, 'a')
+
+        if os.path.exists(self.path):
+            self._size = os.path.getsize(self.path)
+        else:
+            self._size = 0
+
+    def _rotate(self):
+        self._fp.close()
+        self._fp = None
+
+        # console.log.2 -> console.log.3, console.log.1 -> console.log.2, ...
+        for i in xrange(self.backups - 1, 0, -1):
+            src = "%s.%d" % (self.path, i)
+
+            if os.path.exists(src):
+                utils.replace_file(src, "%s.%d" % (self.path, i + 1))
+
+        utils.replace_file(self.path, self.path + ".1")
+
+    def write(self, text):
+        if self._fp is not None and self._size > 0 and \
+           self._size + len(text) > self.max_bytes:
+            self._rotate()
+
+        if self._fp is None:
+            self._open()
+
+        self._fp.write(text)
+        self._fp.flush()
+        self._size += len(text)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def _as_unicode(text):
+    if isinstance(text, unicode):
+        return text
+
+    return str(text).decode('utf-8', 'replace')
+
+
+class ConsoleLog(object):
+    """
+    Collects everything written to stdout and stderr. Writers only append to
+    a queue; a spill thread splits what's queued into lines, keeps the most
+    recent MAX_SCROLLBACK_LINES of them for the console window and appends
+    all of them to a rotating log file.
+    """
+
+    def __init__(self, log_file=None):
+        self.log_file = log_file
+
+        # deque.append is atomic, so writers never wait on a lock
+        self._pending = collections.deque(maxlen=MAX_PENDING_WRITES)
+        self._partial = u''
+
+        self._lines_lock = threading.Lock()
+        self._lines = collections.deque(maxlen=MAX_SCROLLBACK_LINES)
+
+        # Number of lines ever added to the scrollback, used by readers to
+        # tell which lines they haven't seen yet
+        self._line_count = 0
+
+        self._spill_lock = threading.Lock()
+
+    def write(self, text):
+        self._pending.append(text)
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(SPILL_INTERVAL)
+            self.spill()
+
+    def spill(self):
+        with self._spill_lock:
+            chunks = []
+
+            while True:
+                try:
+                    chunks.append(_as_unicode(self._pending.popleft()))
+                except IndexError:
+                    break
+
+            if len(chunks) == 0:
+                return
+
+            lines = (self._partial + u''.join(chunks)).split(u'\n')
+            self._partial = lines.pop()
+
+            if len(self._partial) > MAX_LINE_LENGTH:
+                lines.append(self._partial)
+                self._partial = u''
+
+            if len(lines) == 0:
+                return
+
+            with self._lines_lock:
+                self._lines.extend(lines)
+                self._line_count += len(lines)
+
+            if self.log_file is not None:
+                text = u''.join(line + u'\n' for line in lines)
+
+                try:
+                    self.log_file.write(text.encode('utf-8'))
+                except (IOError, OSError), e:
+                    # Printing the error would just land back here
+                    sys.__stderr__.write(
+                        "Can't write console log to %s: %s\n" % (
+                            self.log_file.path, e))
+                    self.log_file = None
+
+    def close(self):
+        # Called at exit, so that whatever the spill thread hasn't got to yet
+        # (e.g. the traceback of a crash) still reaches the log file
+        self.spill()
+
+        if len(self._partial) > 0:
+            # The last line never got its newline
+            self.write(u'\n')
+            self.spill()
+
+        with self._spill_lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def lines_since(self, seen):
+        """
+        Returns (line_count, lines, replace). If lines a reader hasn't seen
+        have already fallen out of the scrollback, replace is True and lines
+        is the whole scrollback; otherwise lines are only the unseen ones.
+        """
+        with self._lines_lock:
+            unseen = self._line_count - seen
+
+            if unseen > len(self._lines):
+                return (self._line_count, list(self._lines), True)
+
+            return (self._line_count,
+                    list(itertools.islice(
+                        self._lines, len(self._lines) - unseen, None)),
+                    False)
+
 
 class RedirectText(object):
 
-    def __init__(self, aWxTextCtrl):
-        self.out = aWxTextCtrl
+    def __init__(self, console_log):
+        self.console_log = console_log
 
     def write(self, string):
-        wx.CallAfter(self.out.WriteText, string)
+        self.console_log.write(string)
+
+    def flush(self):
+        pass
+
+
+_console_log = None
+
+
+def install_console_log():
+    global _console_log
+
+    if _console_log is None:
+        _console_log = ConsoleLog(RotatingLogFile(dirs.LOG_DIR)).start()
+        atexit.register(_console_log.close)
+
+        redir = RedirectText(_console_log)
+        sys.stdout = redir
+        sys.stderr = redir
+
+    return _console_log
 
 
 class LogWindow(wx.Frame):
@@ -24,19 +244,63 @@ class LogWindow(wx.Frame):
 
         # Add a panel so it looks the correct on all platforms
         panel = wx.Panel(self, wx.ID_ANY)
-        log = wx.TextCtrl(
+        self.log = wx.TextCtrl(
             panel, wx.ID_ANY, size=(300, 100),
             style = wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
 
         # Add widgets to a sizer
         sizer = wx.BoxSizer(wx.VERTICAL)
-        sizer.Add(log, 1, wx.ALL | wx.EXPAND, 5)
+        sizer.Add(self.log, 1, wx.ALL | wx.EXPAND, 5)
         panel.SetSizer(sizer)
 
         # redirect text here
-        redir = RedirectText(log)
-        sys.stdout = redir
-        sys.stderr = redir
+        self.console_log = install_console_log()
+
+        # Lines of the console log already in the control, and how many of
+        # those the control is showing
+        self.seen = 0
+        self.shown = 0
+
+        self.refresh_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.refresh_log, self.refresh_timer)
+        self.Bind(wx.EVT_CLOSE, self.handle_close)
+
+        self.refresh_log()
+        self.refresh_timer.Start(REFRESH_INTERVAL_MS)
+
+    def refresh_log(self, event=None):
+        (self.seen, lines, replace) = self.console_log.lines_since(self.seen)
+
+        if len(lines) == 0 and not replace:
+            return
+
+        # The control is allowed to run to twice the scrollback before it's
+        # cut back down, so that trimming it is rare
+        if not replace and \
+           self.shown + len(lines) > 2 * MAX_SCROLLBACK_LINES:
+            (self.seen, lines, replace) = self.console_log.lines_since(0)
+            replace = True
+
+        text = u''.join(line + u'\n' for line in lines)
+
+        if replace:
+            self.log.Freeze()
+
+            try:
+                self.log.SetValue(text)
+                self.log.SetInsertionPointEnd()
+            finally:
+                self.log.Thaw()
+
+            self.shown = len(lines)
+        else:
+            self.log.AppendText(text)
+            self.shown += len(lines)
+
+    def handle_close(self, event):
+        self.refresh_timer.Stop()
+        self.console_log.spill()
+        event.Skip()
 
 
 def open_log_window(event, main_window):
@@ -0,0 +1,156 @@
+import wx
+from ObjectListView import ColumnDefn
+
+import channels
+import perf
+import utils
+
+
+def format_ms(seconds):
+    return "%.2f" % (seconds * 1000)
+
+
+class TimingView(object):
+
+    def __init__(self, histogram):
+        self.name = histogram.name
+        self.count = histogram.count
+        self.total = format_ms(histogram.total)
+        self.mean = format_ms(histogram.mean)
+        self.p50 = format_ms(histogram.percentile(0.5))
+        self.p95 = format_ms(histogram.percentile(0.95))
+        self.max = format_ms(histogram.max)
+
+
+class PerformanceWindow(wx.Frame):
+
+    def __init__(self, initial_position):
+        wx.Frame.__init__(
+            self, None, wx.ID_ANY, "Performance", size=(700, 400),
+            pos=initial_position)
+
+        panel = wx.Panel(self)
+
+        self.timings_list = utils.new_obj_list_view(panel)
+        self.timings_list.SetEmptyListMsg("Nothing timed yet")
+
+        name_col = ColumnDefn("Name", "left", 250, "name",
+                              isSpaceFilling=True)
+        count_col = ColumnDefn("Calls", "right", 60, "count")
+        total_col = ColumnDefn("Total (ms)", "right", 80, "total")
+        mean_col = ColumnDefn("Mean (ms)", "right", 70, "mean")
+        p50_col = ColumnDefn("p50 (ms)", "right", 70, "p50")
+        p95_col = ColumnDefn("p95 (ms)", "right", 70, "p95")
+        max_col = ColumnDefn("Max (ms)", "right", 70, "max")
+
+        self.timings_list.SetColumns(
+            [name_col, count_col, total_col, mean_col, p50_col, p95_col,
+             max_col])
+
+        self.handler_timing_box = wx.CheckBox(
+            panel, wx.ID_ANY, "Time each listener")
+        self.handler_timing_box.SetValue(channels.handler_timing())
+        self.coalescing_box = wx.CheckBox(
+            panel, wx.ID_ANY, "Coalesce publishes")
+        self.coalescing_box.SetValue(channels.coalescing())
+
+        self.Bind(wx.EVT_CHECKBOX, self.handle_handler_timing_toggled,
+                  self.handler_timing_box)
+        self.Bind(wx.EVT_CHECKBOX, self.handle_coalescing_toggled,
+                  self.coalescing_box)
+
+        options_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        options_sizer.Add(self.handler_timing_box)
+        options_sizer.Add(self.coalescing_box, flag=wx.LEFT, border=10)
+
+        refresh_button = wx.Button(panel, wx.ID_ANY, "Refresh")
+        reset_button = wx.Button(panel, wx.ID_ANY, "Reset")
+        channels_button = wx.Button(panel, wx.ID_ANY, "Channels ...")
+        subscriptions_button = wx.Button(panel, wx.ID_ANY, "Subscriptions ...")
+        export_button = wx.Button(panel, wx.ID_ANY, "Export JSON ...")
+
+        self.Bind(wx.EVT_BUTTON, self.refresh, refresh_button)
+        self.Bind(wx.EVT_BUTTON, self.reset, reset_button)
+        self.Bind(wx.EVT_BUTTON, self.show_channel_counts, channels_button)
+        self.Bind(wx.EVT_BUTTON, self.show_subscriptions, subscriptions_button)
+        self.Bind(wx.EVT_BUTTON, self.export, export_button)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        button_sizer.Add(refresh_button)
+        button_sizer.Add(reset_button, flag=wx.LEFT, border=5)
+        button_sizer.AddStretchSpacer()
+        button_sizer.Add(channels_button)
+        button_sizer.Add(subscriptions_button, flag=wx.LEFT, border=5)
+        button_sizer.Add(export_button, flag=wx.LEFT, border=5)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.timings_list, 1, wx.ALL | wx.EXPAND, border=5)
+        sizer.Add(options_sizer, 0, wx.ALL | wx.EXPAND, border=5)
+        sizer.Add(button_sizer, 0, wx.ALL | wx.EXPAND, border=5)
+        panel.SetSizer(sizer)
+
+        self.refresh()
+
+        self.Layout()
+        self.Show()
+
+    def refresh(self, event=None):
+        self.timings_list.SetObjects(
+            [TimingView(h) for h in perf.get_histograms() if h.count > 0])
+
+    def reset(self, event=None):
+        perf.reset()
+        channels.reset_counts()
+        self.refresh()
+
+    def handle_handler_timing_toggled(self, event):
+        # Listeners' timings show up as channels.<channel>.<listener>
+        channels.set_handler_timing(event.IsChecked())
+
+    def handle_coalescing_toggled(self, event):
+        # For comparing how many deliveries coalescing saves
+        channels.set_coalescing(event.IsChecked())
+
+    def show_channel_counts(self, event=None):
+        import wx.lib.dialogs
+
+        counts = channels.format_counts()
+
+        if len(counts) == 0:
+            counts = "Nothing published yet"
+
+        dlg = wx.lib.dialogs.ScrolledMessageDialog(
+            self, counts, "Messages by Topic", size=(600, 400))
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def show_subscriptions(self, event=None):
+        # Listeners that outlive their windows show up here as counts that
+        # keep growing as songs are opened and closed
+        import wx.lib.dialogs
+
+        dlg = wx.lib.dialogs.ScrolledMessageDialog(
+            self, channels.format_subscriptions(), "Live Subscriptions",
+            size=(600, 400))
+        dlg.ShowModal()
+        dlg.Destroy()
+
+    def export(self, event=None):
+        try:
+            path = perf.export_json()
+        except (IOError, OSError), e:
+            utils.show_error_dialog("Export failed", str(e), self, e)
+            return
+
+        wx.MessageBox("Timings written to %s" % (path), "Performance",
+                      wx.OK | wx.ICON_INFORMATION, self)
+
+
+def open_performance_window(event, main_window):
+    offsets = (40, 30)
+
+    main_window_pos = main_window.GetPosition()
+
+    PerformanceWindow(
+        (main_window_pos[0] + main_window.GetSize()[0] + offsets[0],
+         main_window_pos[1] + offsets[1]))
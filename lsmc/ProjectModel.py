@@ -2,9 +2,10 @@ from channels import SONG_MODIFIED
 import utils
 
 class ProjectModel(object):
-    def __init__(self, parent_view, index, project):
+    def __init__(self, parent_view, index, project, loading=False):
         self.index = index
         self.project = project
+        self.loading = loading
 
         self._parent_view = parent_view
         self._modified = False
@@ -18,7 +19,9 @@ class ProjectModel(object):
 
     @property
     def name(self):
-        if self.project is None:
+        if self.loading:
+            return 'Loading ...'
+        elif self.project is None:
             return '--'
         else:
             return self.project.name
@@ -30,6 +33,10 @@ class ProjectModel(object):
         else:
             return utils.printable_decimal_and_hex(self.project.version)
 
+    @property
+    def edited(self):
+        return self._modified
+
     @property
     def modified(self):
         if self._modified:
@@ -44,6 +51,19 @@ class ProjectModel(object):
         else:
             return utils.printable_decimal_and_hex(self.project.size_blks)
 
+    def mark_saved(self):
+        self._modified = False
+
+    def handle_loaded(self, project):
+        self.project = project
+        self.loading = False
+
+        self._parent_view.RefreshObjects([self])
+
+    def handle_added(self, project):
+        # The caller refreshes the list once every added song is in place
+        self.project = project
+
     def handle_modified(self, data=None):
         if data is None:
             return
@@ -54,9 +74,11 @@ class ProjectModel(object):
         # None event (frankly I don't remember why None events would exist in
         # the first place, but since we're catching `if data is None` on the
         # previous lines it must be happening _sometime_)
+        # Edits are published with the project that's shown here; comparing
+        # contents instead would parse both songs
         if data is False:
             self.project = None
-        elif project == self.project:
+        elif project is self.project:
             self._modified = True
         else:
             self.project = project
@@ -2,31 +2,56 @@ import wx
 import functools
 import event_handlers
 from ObjectListView import ColumnDefn
+from pylsdj.savfile import NUM_FILES
 
 from ProjectModel import ProjectModel
 
 import utils
-from SongWindow import SongWindow
+import dedup
+import history
 
 import channels
 
+# Rows of songs that were reloaded from disk are highlighted this long
+FLASH_DURATION_MS = 750
+FLASH_COLOUR = wx.Colour(255, 236, 140)
+
+
+class SongFileDropTarget(wx.FileDropTarget):
+
+    def __init__(self, projects_window):
+        wx.FileDropTarget.__init__(self)
+        self.projects_window = projects_window
+
+    def OnDropFiles(self, x, y, filenames):
+        return self.projects_window.handle_files_dropped(filenames)
+
+
 class ProjectsWindow(wx.Panel):
 
     def __init__(self, parent):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
         # List the projects in the currently loaded .sav
-        self.sav_project_list = utils.new_obj_list_view(self)
+        self.sav_project_list = utils.new_obj_list_view(
+            self, single_selection=False)
         self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.open_song,
                   self.sav_project_list)
 
         self.modified_since_load = False
+        self.loading = False
 
         self.sav_project_list.SetEmptyListMsg("No .sav loaded")
 
-        # Keep track of the projects to whose channels you're subscribing to
-        # avoid subscribing multiple times
-        self.subscribed_projects = {}
+        # Songs and folders of songs can be dropped on the list to import them
+        self.sav_project_list.SetDropTarget(SongFileDropTarget(self))
+        channels.SONGS_ADDED(None).subscribe(self.handle_songs_added)
+        channels.SAV_SAVED(None).subscribe(self.handle_sav_saved)
+
+        # Channels for slots are the same whatever .sav is loaded, so they
+        # only need subscribing to once
+        for index in xrange(NUM_FILES):
+            channels.SONG_MODIFIED(index).subscribe(self.handle_song_modified)
 
         def string_getter(x, attr):
             if x[1] is None:
@@ -73,6 +98,10 @@ class ProjectsWindow(wx.Panel):
             "Add Song from .srm ...", event_handlers.add_srm,
             start_disabled=True)
 
+        self.import_songs_button = self.new_button(
+            "Import Songs ...", event_handlers.import_songs,
+            start_disabled=True)
+
         self.export_song_button = self.new_button(
             "Export Selected as .lsdsng ...", event_handlers.save_song,
             start_disabled=True)
@@ -81,12 +110,27 @@ class ProjectsWindow(wx.Panel):
             "Export Selected as .srm ...", event_handlers.save_song_srm,
             start_disabled=True)
 
+        self.export_all_button = self.new_button(
+            "Export All as .lsdsng ...", event_handlers.export_all_songs,
+            start_disabled=True)
+
+        self.export_all_srm_button = self.new_button(
+            "Export All as .srm ...", event_handlers.export_all_songs_srm,
+            start_disabled=True)
+
         self.open_song_button = self.new_button(
             "Open Song ...", self.open_song, start_disabled=True,
             internal_handler=True)
 
         self.delete_song_button = self.new_button(
-            "Delete Song", event_handlers.delete_song, start_disabled=True)
+            "Delete Selected", event_handlers.delete_song, start_disabled=True)
+
+        self.find_duplicates_button = self.new_button(
+            "Find Duplicates ...", event_handlers.find_duplicates,
+            start_disabled=True)
+
+        self.compare_button = self.new_button(
+            "Compare ...", event_handlers.compare_songs, start_disabled=True)
 
         self.Bind(
             wx.EVT_LIST_ITEM_SELECTED, self.handle_song_selection_changed,
@@ -108,12 +152,19 @@ class ProjectsWindow(wx.Panel):
 
         add_side_button(self.add_song_button)
         add_side_button(self.add_srm_button)
+        add_side_button(self.import_songs_button)
         buttons_layout.AddSpacer(20)
 
         add_side_button(self.open_song_button)
         add_side_button(self.delete_song_button)
         add_side_button(self.export_song_button)
         add_side_button(self.export_song_srm_button)
+        add_side_button(self.export_all_button)
+        add_side_button(self.export_all_srm_button)
+        buttons_layout.AddSpacer(20)
+
+        add_side_button(self.find_duplicates_button)
+        add_side_button(self.compare_button)
 
         window_layout = wx.BoxSizer(wx.HORIZONTAL)
         window_layout.Add(self.sav_project_list, 1, wx.EXPAND | wx.ALL)
@@ -124,19 +175,67 @@ class ProjectsWindow(wx.Panel):
         self.SetSizer(window_layout)
 
     def handle_sav_loaded(self, sav_obj):
-        project_list = sav_obj.project_list
-
+        # The .sav is still being read in the background at this point, so
+        # start out with a placeholder row for every slot and fill them in as
+        # handle_project_loaded is called
         project_views = []
 
-        for (index, project) in sorted(project_list):
+        for index in xrange(NUM_FILES):
             project_views.append(
-                ProjectModel(self.sav_project_list, index, project))
+                ProjectModel(self.sav_project_list, index, None,
+                             loading=True))
 
-            channels.SONG_MODIFIED(index).subscribe(self.handle_song_modified)
+        self.set_project_views(project_views)
+
+        self.loading = True
+        self.modified_since_load = False
+        self.save_sav_button.Disable()
+        self.find_duplicates_button.Disable()
+        self.compare_button.Disable()
+        self.import_songs_button.Disable()
+        self.export_all_button.Disable()
+        self.export_all_srm_button.Disable()
+
+        # Any scan of the previous .sav's contents, and any edits to it, are
+        # now meaningless
+        dedup.set_current_index(None)
+        history.clear()
+        self.update_side_button_states()
+
+    def set_project_views(self, project_views):
+        # The models being replaced stop listening for changes to their slots
+        for project_view in self.sav_project_list.GetObjects():
+            channels.release(project_view)
 
         self.sav_project_list.SetObjects(project_views)
 
+    def handle_project_loaded(self, index, project):
+        self.sav_project_list.GetObjects()[index].handle_loaded(project)
+        self.update_side_button_states()
+
+    def handle_sav_load_finished(self):
+        self.loading = False
+        self.save_sav_button.Enable()
+        self.find_duplicates_button.Enable()
+        self.compare_button.Enable()
+        self.import_songs_button.Enable()
+        self.export_all_button.Enable()
+        self.export_all_srm_button.Enable()
+        self.update_side_button_states()
+
+    def handle_sav_cleared(self):
+        self.loading = False
         self.modified_since_load = False
+        self.set_project_views([])
+        self.save_sav_button.Disable()
+        self.find_duplicates_button.Disable()
+        self.compare_button.Disable()
+        self.import_songs_button.Disable()
+        self.export_all_button.Disable()
+        self.export_all_srm_button.Disable()
+        dedup.set_current_index(None)
+        history.clear()
+        self.update_side_button_states()
 
     def handle_song_modified(self, data=None):
         if data is None:
@@ -145,6 +244,75 @@ class ProjectsWindow(wx.Panel):
         self.modified_since_load = True
         self.update_side_button_states()
 
+    def handle_sav_saved(self, data=None):
+        # What's on disk now matches every song, so none of them has unsaved
+        # edits any more and the watcher may reload any of them
+        if data is None or data is not self.GetGrandParent().get_sav():
+            return
+
+        project_views = self.sav_project_list.GetObjects()
+
+        for project_view in project_views:
+            project_view.mark_saved()
+
+        self.sav_project_list.RefreshObjects(project_views)
+
+        self.modified_since_load = False
+        self.update_side_button_states()
+
+    def handle_songs_added(self, data=None):
+        if data is None:
+            return
+
+        project_views = self.sav_project_list.GetObjects()
+        added_views = []
+
+        for (index, project) in data:
+            project_views[index].handle_added(project)
+            added_views.append(project_views[index])
+
+        self.sav_project_list.RefreshObjects(added_views)
+
+        self.modified_since_load = True
+        self.update_side_button_states()
+
+    def edited_songs(self):
+        # Slots whose songs have unsaved edits
+        return set(project_view.index for project_view in
+                   self.sav_project_list.GetObjects() if project_view.edited)
+
+    def flash_songs(self, indices):
+        all_project_views = self.sav_project_list.GetObjects()
+
+        if len(all_project_views) != NUM_FILES:
+            return
+
+        project_views = [all_project_views[index] for index in indices]
+
+        for project_view in project_views:
+            row = self.sav_project_list.GetIndexOf(project_view)
+
+            if row != -1:
+                self.sav_project_list.SetItemBackgroundColour(
+                    row, FLASH_COLOUR)
+
+        def end_flash():
+            # The window may have closed in the meantime
+            if self:
+                self.sav_project_list.RefreshObjects(project_views)
+
+        wx.CallLater(FLASH_DURATION_MS, end_flash)
+
+    def handle_files_dropped(self, filenames):
+        main_window = self.GetGrandParent()
+
+        if main_window.get_sav() is None or self.loading:
+            return False
+
+        event_handlers.import_song_files(filenames, self, main_window)
+
+        return True
+
     def handle_save_song(self, event, projects_window, main_window):
         song_to_save = self.sav_project_list.GetSelectedObject().project
         event_handlers.save_song_dialog(song_to_save, "save_lsdsng", "lsdsng")
@@ -176,7 +344,8 @@ class ProjectsWindow(wx.Panel):
             self.open_song_button, self.delete_song_button]
         empty_song_buttons = [self.add_song_button, self.add_srm_button]
 
-        if len(selected_objects) > 0:
+        if len(selected_objects) > 0 and not any(
+                x.loading for x in selected_objects):
             if len(filter(lambda x: x.project is None, selected_objects)) > 0:
                 map(lambda x: x.Disable(), full_song_buttons)
                 map(lambda x: x.Enable(), empty_song_buttons)
@@ -187,6 +356,11 @@ class ProjectsWindow(wx.Panel):
             map(lambda x: x.Disable(), full_song_buttons)
             map(lambda x: x.Disable(), empty_song_buttons)
 
+        # Songs are opened, and empty slots filled, one at a time
+        if len(selected_objects) != 1:
+            self.open_song_button.Disable()
+            map(lambda x: x.Disable(), empty_song_buttons)
+
 
     def handle_song_selection_changed(self, event):
         self.update_side_button_states()
@@ -207,8 +381,13 @@ class ProjectsWindow(wx.Panel):
                     self, message, title, wx.YES_NO | wx.ICON_QUESTION)
 
                 if save_prompt.ShowModal() == wx.ID_YES:
-                    event_handlers.save_sav_dialog(
+                    save_task = event_handlers.save_sav_dialog(
                         self.GetGrandParent().sav_obj)
+
+                    # Saving happens in the background; don't let the window
+                    # go away underneath it
+                    if save_task is not None:
+                        save_task.wait()
         finally:
             self.Destroy()
 
@@ -223,4 +402,8 @@ class ProjectsWindow(wx.Panel):
         if proj is None:
             return
 
+        # Song windows pull in every pane and panel module, so they aren't
+        # imported until the first one is opened
+        from SongWindow import SongWindow
+
         SongWindow(self, proj, selected_objects[0].index)
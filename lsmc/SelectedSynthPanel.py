@@ -2,17 +2,15 @@ import wx
 
 import channels
 
-from utils import make_image
-
 from ImageSetViewField import ImageSetViewField
 from ReadOnlyTextViewField import ReadOnlyTextViewField
 from viewutils import instr_attr, one_digit_hex_format, two_digit_hex_format, \
     within
 
 WAVE_IMAGES = {
-    "sawtooth": make_image("synth_saw"),
-    "square": make_image("synth_square"),
-    "sine": make_image("synth_sine")
+    "sawtooth": "synth_saw",
+    "square": "synth_square",
+    "sine": "synth_sine"
 }
 
 
@@ -1,15 +1,51 @@
 import wx
 
+import history
+import perf
 import utils
 from InstrumentPane import InstrumentPane
 from SynthPane import SynthPane
 from TablePane import TablePane
+from refindex import ReferenceIndex
 
-from channels import INSTR_IMPORT, SONG_MODIFIED
+from channels import INSTR_IMPORT, SONG_MODIFIED, release
+
+
+class LazyPage(wx.Panel):
+
+    def __init__(self, parent, pane_factory):
+        wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
+
+        self.pane_factory = pane_factory
+        self.pane = None
+
+        self.SetSizer(wx.BoxSizer(wx.HORIZONTAL))
+
+    def build(self):
+        if self.pane is not None:
+            return False
+
+        self.pane = self.pane_factory(self)
+        self.GetSizer().Add(self.pane, 1, wx.EXPAND)
+        self.Layout()
+
+        return True
+
+    def refresh(self):
+        if self.pane is not None:
+            self.pane.refresh()
+
+    def reset(self):
+        # Throws the pane away, so that the next build() starts over
+        if self.pane is not None:
+            self.GetSizer().Clear()
+            self.pane.Destroy()
+            self.pane = None
 
 
 class SongWindow(wx.Frame):
 
+    @perf.timed("SongWindow.__init__")
     def __init__(self, parent, project, index):
         frame_size = (750, 550)
 
@@ -30,18 +66,43 @@ class SongWindow(wx.Frame):
         self.project = project
 
         self.instr_import_channel = INSTR_IMPORT(self.project)
-        self.instr_import_channel.subscribe(self.handle_song_modified)
+        self.instr_import_subscription = self.instr_import_channel.subscribe(
+            self.handle_instr_imported)
 
         self.song_modified_channel = SONG_MODIFIED(index)
         self.song_modified_channel.subscribe(self.handle_song_modified)
 
-        instrument_pane = InstrumentPane(self.notebook, project, index)
-        synth_pane = SynthPane(self.notebook, project)
-        table_pane = TablePane(self.notebook, project)
-
-        self.notebook.AddPage(instrument_pane, "Instruments")
-        self.notebook.AddPage(synth_pane, "Synths")
-        self.notebook.AddPage(table_pane, "Tables")
+        # Shared by all of the panes' "Used By" columns
+        self.reference_index = ReferenceIndex(project)
+
+        # Each page's pane is only built the first time it's shown, around
+        # whatever the window's project is by then
+        instrument_page = LazyPage(
+            self.notebook,
+            lambda parent: InstrumentPane(
+                parent, self.project, index, self.reference_index))
+        synth_page = LazyPage(
+            self.notebook,
+            lambda parent: SynthPane(
+                parent, self.project, self.reference_index))
+        table_page = LazyPage(
+            self.notebook,
+            lambda parent: TablePane(
+                parent, self.project, self.reference_index))
+
+        self.notebook.AddPage(instrument_page, "Instruments")
+        self.notebook.AddPage(synth_page, "Synths")
+        self.notebook.AddPage(table_page, "Tables")
+
+        instrument_page.build()
+
+        # Edits to any song can be undone from any song window
+        self.SetAcceleratorTable(wx.AcceleratorTable([
+            (wx.ACCEL_CTRL, ord('Z'), wx.ID_UNDO),
+            (wx.ACCEL_CTRL | wx.ACCEL_SHIFT, ord('Z'), wx.ID_REDO),
+            (wx.ACCEL_CTRL, ord('Y'), wx.ID_REDO)]))
+        self.Bind(wx.EVT_MENU, history.undo, id=wx.ID_UNDO)
+        self.Bind(wx.EVT_MENU, history.redo, id=wx.ID_REDO)
 
         self.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGING,
                   self.handle_notebook_page_changing, self.notebook)
@@ -55,12 +116,48 @@ class SongWindow(wx.Frame):
         self.Show()
 
     def handle_notebook_page_changing(self, event):
-        self.notebook.GetPage(event.GetSelection()).refresh()
+        page = self.notebook.GetPage(event.GetSelection())
 
-    def handle_song_modified(self, data=None):
+        # A freshly-built pane is already up to date
+        if not page.build():
+            page.refresh()
+
+    def set_project(self, project):
+        # The slot now holds a different song (e.g. the .sav was changed on
+        # disk), so every pane is rebuilt around it
+        release(self.reference_index)
+        self.instr_import_subscription.unsubscribe()
+
+        self.project = project
+        self.reference_index = ReferenceIndex(project)
+
+        self.instr_import_channel = INSTR_IMPORT(project)
+        self.instr_import_subscription = self.instr_import_channel.subscribe(
+            self.handle_instr_imported)
+
+        for i in xrange(self.notebook.GetPageCount()):
+            self.notebook.GetPage(i).reset()
+
+        self.notebook.GetCurrentPage().build()
+
+        self.SetTitle("Song - %s" % (project.name))
+
+    def handle_instr_imported(self, data=None):
         if data is not None:
-            title = self.GetTitle()
-            modified_str = ' - MODIFIED'
+            self.mark_modified()
+
+    def handle_song_modified(self, data=None):
+        if data is None:
+            return
+
+        if data is not False and data is not self.project:
+            self.set_project(data)
+        else:
+            self.mark_modified()
+
+    def mark_modified(self):
+        title = self.GetTitle()
+        modified_str = ' - MODIFIED'
 
-            if not title.endswith(modified_str):
-                self.SetTitle(title + modified_str)
+        if not title.endswith(modified_str):
+            self.SetTitle(title + modified_str)
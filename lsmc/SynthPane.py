@@ -10,10 +10,11 @@ import channels
 
 class SynthPane(wx.Panel):
 
-    def __init__(self, parent, project):
+    def __init__(self, parent, project, reference_index):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
         self.project = project
+        self.reference_index = reference_index
 
         self.synth_change_channel = channels.SYNTH_CHANGE(project)
 
@@ -26,7 +27,12 @@ class SynthPane(wx.Panel):
                                        getattr(x, "index")),
             isSpaceFilling=True)
 
-        self.synth_list.SetColumns([id_col])
+        used_by_col = ColumnDefn(
+            "Used By", "left", 80,
+            lambda x: reference_index.format_users_of("synth", x.index),
+            isSpaceFilling=True)
+
+        self.synth_list.SetColumns([id_col, used_by_col])
 
         self.synth_list.SetObjects(self.project.song.synths.as_list())
 
@@ -36,6 +42,11 @@ class SynthPane(wx.Panel):
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.handle_synth_changed,
                   self.synth_list)
 
+        channels.REFERENCES_CHANGED(project).subscribe(
+            self.handle_references_changed)
+        channels.SECTIONS_CHANGED(project).subscribe(
+            self.handle_sections_changed)
+
         sizer = wx.BoxSizer(wx.HORIZONTAL)
         sizer.Add(self.synth_list, 1, wx.ALIGN_TOP | wx.ALL | wx.EXPAND,
                   border=5)
@@ -62,5 +73,15 @@ class SynthPane(wx.Panel):
 
         self.synth_change_channel.publish(synth)
 
+    def handle_sections_changed(self, data=None):
+        if data is None:
+            return
+
+        # Show the selected synth again, as it may have just changed
+        self.handle_synth_changed(None)
+
+    def handle_references_changed(self, data=None):
+        self.synth_list.RefreshObjects(self.synth_list.GetObjects())
+
     def refresh(self):
         pass
@@ -1,53 +1,49 @@
 import wx
-from ObjectListView import ColumnDefn
+from ObjectListView import ColumnDefn, VirtualObjectListView
 
 import utils
+import channels
+import history
 
 import pylsdj.bread_spec as spec
 
 
+# Parameters of some commands read better as names than as hex
+CMD_PARAM_NAMES = {
+    "O": {1: "L", 2: "R", 3: "LR"},
+    "W": {0: "12.5%", 1: "25%", 2: "50%", 3: "75%"}
+}
+
+
+def cmd_params_format(command, params):
+    param_names = CMD_PARAM_NAMES.get(command)
+
+    if param_names is not None and params in param_names:
+        return param_names[params]
+
+    return "%02x" % (params)
+
+
 class TableRowView(object):
+    # Rows are formatted once, when they're built, and kept in TablePane's
+    # cache until their table changes; repaints just read these strings
+
+    __slots__ = ("id", "volume", "transpose", "cmd1", "cmd1_params", "cmd2",
+                 "cmd2_params")
 
     def __init__(self, index, volume, transpose, command1, command1_params,
                  command2, command2_params):
-        self.id = index
-        self.volume = volume
-        self.transpose = transpose
+        self.id = "%02x" % (index)
+        self.volume = "%02x" % (volume)
+        self.transpose = "%02x" % (transpose)
         self.cmd1 = command1
         self.cmd2 = command2
-        self.cmd1_params = command1_params
-        self.cmd2_params = command2_params
-
-    def get_cmd_view(self, field):
-        if field == "cmd1":
-            command = self.cmd1
-            params = self.cmd1_params
-        elif field == "cmd2":
-            command = self.cmd2
-            params = self.cmd2_params
-
-        view = params
-
-        if command == "O":
-            if params == 1:
-                view = "L"
-            elif params == 2:
-                view = "R"
-            elif params == 3:
-                view = "LR"
-        elif command == "W":
-            if params == 0:
-                view = "12.5%"
-            elif params == 1:
-                view = "25%"
-            elif params == 2:
-                view = "50%"
-            elif params == 3:
-                view = "75%"
-        else:
-            view = "%02x" % (params)
+        self.cmd1_params = cmd_params_format(command1, command1_params)
+        self.cmd2_params = cmd_params_format(command2, command2_params)
 
-        return view
+
+EMPTY_TABLE_ROWS = [TableRowView(i, 0, 0, 0, 0, 0, 0)
+                    for i in xrange(spec.ENTRIES_PER_TABLE)]
 
 
 def table_list_index_format(x):
@@ -63,45 +59,59 @@ def table_list_index_format(x):
 
 class TablePane(wx.Panel):
 
-    def __init__(self, parent, project):
+    def __init__(self, parent, project, reference_index):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
         self.project = project
+        self.reference_index = reference_index
 
         self.table_list = utils.new_obj_list_view(self)
         self.table_list.SetEmptyListMsg("Loading table list ...")
 
         id_col = ColumnDefn("", "left", 30, table_list_index_format,
                             isSpaceFilling=True)
+        used_by_col = ColumnDefn(
+            "Used By", "left", 100,
+            lambda x: reference_index.format_users_of("table", x[0]),
+            isSpaceFilling=True)
 
-        self.table_list.SetColumns([id_col])
+        self.table_list.SetColumns([id_col, used_by_col])
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.handle_table_changed,
                   self.table_list)
 
         self.refresh()
 
-        self.table_view = utils.new_obj_list_view(self)
+        # The table view is virtual; rows are fetched from self.current_rows
+        # as they're drawn
+        self.row_cache = {}
+        self.current_table = None
+        self.current_rows = EMPTY_TABLE_ROWS
+
+        self.table_view = utils.new_obj_list_view(
+            self, list_class=VirtualObjectListView)
         self.table_view.SetEmptyListMsg("No Table Selected")
+        self.table_view.SetObjectGetter(self.get_table_row)
 
-        row_number = ColumnDefn("", "center", 30, lambda x: "%02x" %
-                                (x.id), isSpaceFilling=True)
+        row_number = ColumnDefn("", "center", 30, "id", isSpaceFilling=True)
 
-        volume = ColumnDefn("Vol", "center", 30, lambda x: "%02x" %
-                            (x.volume))
-        transpose = ColumnDefn("Tsp", "center", 30, lambda x: "%02x" %
-                               (x.transpose))
+        volume = ColumnDefn("Vol", "center", 30, "volume")
+        transpose = ColumnDefn("Tsp", "center", 30, "transpose")
 
-        command1_fx = ColumnDefn("Cmd", "center", 40, lambda x: x.cmd1)
-        command1_params = ColumnDefn(
-            "", "center", 50, lambda x: x.get_cmd_view("cmd1"))
-        command2_fx = ColumnDefn("Cmd", "center", 40, lambda x: x.cmd2)
-        command2_params = ColumnDefn(
-            "", "center", 50, lambda x: x.get_cmd_view("cmd2"))
+        command1_fx = ColumnDefn("Cmd", "center", 40, "cmd1")
+        command1_params = ColumnDefn("", "center", 50, "cmd1_params")
+        command2_fx = ColumnDefn("Cmd", "center", 40, "cmd2")
+        command2_params = ColumnDefn("", "center", 50, "cmd2_params")
 
         self.table_view.SetColumns(
             [row_number, volume, transpose, command1_fx, command1_params,
              command2_fx, command2_params])
 
+        channels.INSTR_IMPORT(project).subscribe(self.handle_instr_imported)
+        channels.SECTIONS_CHANGED(project).subscribe(
+            self.handle_sections_changed)
+        channels.REFERENCES_CHANGED(project).subscribe(
+            self.handle_references_changed)
+
         self.sizer = wx.BoxSizer(wx.HORIZONTAL)
 
         self.sizer.Add(self.table_list, 1, wx.ALL | wx.EXPAND)
@@ -124,21 +134,61 @@ class TablePane(wx.Panel):
 
         self.show_table(table)
 
-    def show_table(self, table):
-        rows = []
+    def handle_instr_imported(self, data=None):
+        if data is None or data.table is None:
+            return
 
-        if table is None:
-            # Construct an empty table view
-            for i in xrange(spec.ENTRIES_PER_TABLE):
-                rows.append(TableRowView(i, 0, 0, 0, 0, 0, 0))
+        # Importing an instrument can allocate and overwrite a table
+        table_index = data.table.index
+        self.row_cache.pop(table_index, None)
 
-        else:
-            for i in xrange(spec.ENTRIES_PER_TABLE):
-                rows.append(TableRowView(
+        self.refresh()
+
+        if (self.current_table is not None and
+                self.current_table.index == table_index):
+            self.show_table(self.current_table)
+
+    def handle_sections_changed(self, data=None):
+        if data is None:
+            return
+
+        sections = history.changed_sections(self.project)
+
+        for (kind, index) in sections:
+            if kind == "table":
+                self.row_cache.pop(index, None)
+
+        self.refresh()
+
+        if self.current_table is not None:
+            self.show_table(self.current_table)
+
+    def handle_references_changed(self, data=None):
+        self.table_list.RefreshObjects(self.table_list.GetObjects())
+
+    def get_table_rows(self, table):
+        if table.index not in self.row_cache:
+            self.row_cache[table.index] = [
+                TableRowView(
                     i, table.envelopes[i], table.transposes[i],
                     table.fx1[i].command,
                     table.fx1[i].value,
                     table.fx2[i].command,
-                    table.fx2[i].value))
+                    table.fx2[i].value)
+                for i in xrange(spec.ENTRIES_PER_TABLE)]
+
+        return self.row_cache[table.index]
+
+    def get_table_row(self, index):
+        return self.current_rows[index]
+
+    def show_table(self, table):
+        self.current_table = table
+
+        if table is None:
+            self.current_rows = EMPTY_TABLE_ROWS
+        else:
+            self.current_rows = self.get_table_rows(table)
 
-        self.table_view.SetObjects(rows)
+        self.table_view.SetItemCount(len(self.current_rows))
+        self.table_view.RefreshItems(0, len(self.current_rows) - 1)
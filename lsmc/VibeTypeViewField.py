@@ -1,12 +1,10 @@
 from ImageSetViewField import ImageSetViewField
 
-from utils import make_image
-
 VIBE_IMAGES = {
-    "hf": make_image("vibe_hfsine"),
-    "sawtooth": make_image("vibe_saw"),
-    "sine": make_image("vibe_sine"),
-    "square": make_image("vibe_square")
+    "hf": "vibe_hfsine",
+    "sawtooth": "vibe_saw",
+    "sine": "vibe_sine",
+    "square": "vibe_square"
 }
 
 
@@ -5,7 +5,8 @@ class ViewField(object):
         self.field = field
 
     def subscribe(self, channel):
-        channel.subscribe(self.update)
+        # Released along with the control
+        channel.subscribe(self.update, owner=self.field)
 
     def update(self, data):
         self.parent.field_changed()
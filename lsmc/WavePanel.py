@@ -1,60 +1,114 @@
 import wx
 
 import pylsdj.bread_spec as spec
-import channels
+
+import perf
+
+# Each frame of a wave is a nibble, so it can take one of 16 levels
+WAVE_LEVELS = 0x10
 
 
 class WavePanel(wx.Panel):
 
-    def __init__(self, parent, index):
+    def __init__(self, parent):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
-        self.index = index
+        # Every pixel is painted by hand, so there's no need for wx to erase
+        # the background first
+        self.SetBackgroundStyle(wx.BG_STYLE_CUSTOM)
+
         self.Bind(wx.EVT_PAINT, self.on_paint)
         self.Bind(wx.EVT_SIZE, self.on_size)
-        self.wave = None
 
-        channels.SYNTH_CHANGE(parent.GetParent().project).subscribe(
-            self.handle_synth_changed)
+        self.synth = None
+        self.index = 0
+
+        # All of the synth's waves, rendered side by side into one bitmap at
+        # the current size. Painting just blits the visible wave's tile out
+        # of it, so the paint handler doesn't allocate anything.
+        self.strip = None
+        self.strip_dc = wx.MemoryDC()
+        self.square_dimension = 1
 
-    def handle_synth_changed(self, data):
-        synth = data
+        self.background_brush = wx.Brush(self.GetBackgroundColour(), wx.SOLID)
+        self.background_pen = wx.Pen(self.GetBackgroundColour())
 
-        self.wave = synth.waves[self.index]
+    def set_synth(self, synth):
+        self.synth = synth
+        self.invalidate()
 
+    def show_wave(self, index):
+        if index != self.index:
+            self.index = index
+            self.Refresh()
+
+    def invalidate(self):
+        self.strip_dc.SelectObject(wx.NullBitmap)
+        self.strip = None
         self.Refresh()
 
     def on_size(self, event):
-        frame = event.GetEventObject()
+        self.invalidate()
+        event.Skip()
 
-        width, height = frame.GetSizeTuple()
+    def get_square_dimension(self):
+        width, height = self.GetClientSizeTuple()
 
-        if width % spec.FRAMES_PER_WAVE != 0:
-            width = (width // spec.FRAMES_PER_WAVE) * spec.FRAMES_PER_WAVE
+        return max(min(width // spec.FRAMES_PER_WAVE, height // WAVE_LEVELS),
+                   1)
 
-        square_size = (width, width / 2)
+    @property
+    def wave_size(self):
+        return (self.square_dimension * spec.FRAMES_PER_WAVE,
+                self.square_dimension * WAVE_LEVELS)
 
-        frame.SetSize(square_size)
+    def build_strip(self):
+        self.square_dimension = self.get_square_dimension()
+        wave_width, wave_height = self.wave_size
 
-    def on_paint(self, event=None):
-        width, height = self.GetSizeTuple()
+        self.strip = wx.EmptyBitmap(
+            wave_width * spec.WAVES_PER_SYNTH, wave_height)
+
+        self.strip_dc.SelectObject(self.strip)
+        self.strip_dc.SetBackground(self.background_brush)
+        self.strip_dc.Clear()
+        self.strip_dc.SetBrush(wx.Brush(wx.BLACK, wx.SOLID))
 
-        assert width == height * 2
-        assert width % spec.FRAMES_PER_WAVE == 0
+        squares = []
 
-        square_dimension = width / spec.FRAMES_PER_WAVE
+        for wave_index in xrange(spec.WAVES_PER_SYNTH):
+            wave = self.synth.waves[wave_index]
+            x_offset = wave_index * wave_width
 
-        dc = wx.PaintDC(self)
-        dc.Clear()
-        dc.SetBrush(wx.Brush(wx.BLACK, wx.SOLID))
+            squares.extend([
+                (x_offset + self.square_dimension * i,
+                 self.square_dimension * (0xf - wave[i]),
+                 self.square_dimension, self.square_dimension)
+                for i in xrange(spec.FRAMES_PER_WAVE)])
 
-        if self.wave is None:
+        self.strip_dc.DrawRectangleList(squares)
+
+    @perf.timed("WavePanel.on_paint")
+    def on_paint(self, event=None):
+        dc = wx.AutoBufferedPaintDC(self)
+
+        dc.SetBrush(self.background_brush)
+        dc.SetPen(self.background_pen)
+
+        width, height = self.GetClientSizeTuple()
+
+        if self.synth is None:
+            dc.DrawRectangle(0, 0, width, height)
             return
 
-        squares = [
-            (square_dimension * i,
-             square_dimension * (0xf - self.wave[i]),
-             square_dimension, square_dimension)
-            for i in xrange(spec.FRAMES_PER_WAVE)]
+        if self.strip is None:
+            self.build_strip()
+
+        wave_width, wave_height = self.wave_size
+
+        dc.Blit(0, 0, wave_width, wave_height, self.strip_dc,
+                self.index * wave_width, 0)
 
-        dc.DrawRectangleList(squares)
+        # Fill in whatever the wave doesn't cover
+        dc.DrawRectangle(wave_width, 0, width - wave_width, height)
+        dc.DrawRectangle(0, wave_height, wave_width, height - wave_height)
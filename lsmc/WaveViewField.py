@@ -2,13 +2,11 @@ from ImageSetViewField import ImageSetViewField
 
 from viewutils import instr_attr
 
-from utils import make_image
-
 WAVE_IMAGES = {
-    "12.5%": make_image("wave12"),
-    "25%": make_image("wave25"),
-    "50%": make_image("wave50"),
-    "75%": make_image("wave75")
+    "12.5%": "wave12",
+    "25%": "wave25",
+    "50%": "wave50",
+    "75%": "wave75"
 }
 
 
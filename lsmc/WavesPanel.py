@@ -1,3 +1,5 @@
+import time
+
 import wx
 
 import pylsdj.bread_spec as spec
@@ -6,17 +8,22 @@ import channels
 
 from StaticTextViewField import StaticTextViewField
 
+# At full speed, LSDJ steps a synth through its waves once per Game Boy
+# frame (i.e. at the LCD's ~59.7Hz refresh rate)
+SYNTH_STEP_RATE = 59.73
+
+# How many playback ticks to let pass between frame time readout updates
+FRAME_TIME_READOUT_INTERVAL = 15
+
 
 class WavesPanel(wx.Panel):
 
     def __init__(self, parent):
         wx.Panel.__init__(self, parent=parent, id=wx.ID_ANY)
 
-        self.wave_panels = []
         self.active_panel = 0
 
-        for i in xrange(spec.NUM_SYNTHS):
-            self.wave_panels.append(WavePanel(self, i))
+        self.wave_panel = WavePanel(self)
 
         self.wave_slider = wx.Slider(
             self, wx.ID_ANY, 0, 0, spec.WAVES_PER_SYNTH - 1)
@@ -25,20 +32,32 @@ class WavesPanel(wx.Panel):
 
         self.Bind(wx.EVT_SCROLL, self.handle_scroll, self.wave_slider)
 
+        self.play_button = wx.ToggleButton(self, wx.ID_ANY, label="Play")
+        self.Bind(wx.EVT_TOGGLEBUTTON, self.handle_play_toggled,
+                  self.play_button)
+
+        self.play_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.handle_play_tick, self.play_timer)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.handle_destroy)
+
+        self.frame_time_label = wx.StaticText(self, label="")
+
         channels.SYNTH_CHANGE(parent.project).subscribe(
             self.handle_synth_changed)
 
         sizer = wx.BoxSizer(wx.VERTICAL)
 
-        map(lambda x: sizer.Add(x, 1, wx.ALL | wx.EXPAND), self.wave_panels)
+        sizer.Add(self.wave_panel, 1, wx.ALL | wx.EXPAND)
 
         slider_sizer = wx.BoxSizer(wx.HORIZONTAL)
 
         slider_sizer.Add(wx.StaticText(self, label="Frame Number: "))
         self.frame_number.add_to_sizer(slider_sizer, 0, wx.ALL)
         slider_sizer.Add(self.wave_slider, 1, wx.ALL | wx.ALIGN_LEFT)
+        slider_sizer.Add(self.play_button, 0, wx.ALL)
 
         sizer.Add(slider_sizer)
+        sizer.Add(self.frame_time_label, 0, wx.ALL)
 
         self.SetSizer(sizer)
 
@@ -48,27 +67,88 @@ class WavesPanel(wx.Panel):
         return "%x%x" % (self.active_panel, slider_pos)
 
     def handle_synth_changed(self, data):
+        # Playback was stepping through the previous synth's waves
+        if self.play_timer.IsRunning():
+            self.stop_playback()
+
         synth = data
         self.active_panel = synth.index
+        self.wave_panel.set_synth(synth)
         self.show_wave_panel(0)
 
     def field_changed(self):
         pass
 
     def handle_scroll(self, event):
+        if self.play_timer.IsRunning():
+            self.stop_playback()
+
         val = self.wave_slider.GetValue()
         self.show_wave_panel(val)
 
+    def handle_play_toggled(self, event):
+        if self.play_button.GetValue():
+            self.start_playback()
+        else:
+            self.stop_playback()
+
+    def start_playback(self):
+        self.play_start_time = time.time()
+        self.play_start_index = self.wave_slider.GetValue()
+
+        self.last_tick_time = None
+        self.last_step = 0
+
+        self.ticks = 0
+        self.total_frame_time = 0.0
+        self.max_frame_time = 0.0
+        self.dropped_frames = 0
+
+        self.play_button.SetLabel("Stop")
+        self.play_timer.Start(int(1000 / SYNTH_STEP_RATE))
+
+    def stop_playback(self):
+        self.play_timer.Stop()
+        self.play_button.SetValue(False)
+        self.play_button.SetLabel("Play")
+
+    def handle_play_tick(self, event):
+        now = time.time()
+
+        # Work out which wave should be showing from the time since playback
+        # started rather than by counting ticks, so that a late timer
+        # doesn't make playback drift
+        step = int((now - self.play_start_time) * SYNTH_STEP_RATE)
+
+        if self.last_tick_time is not None:
+            frame_time = now - self.last_tick_time
+
+            self.ticks += 1
+            self.total_frame_time += frame_time
+            self.max_frame_time = max(self.max_frame_time, frame_time)
+            self.dropped_frames += max(step - self.last_step - 1, 0)
+
+        self.last_tick_time = now
+        self.last_step = step
+
+        self.show_wave_panel(
+            (self.play_start_index + step) % spec.WAVES_PER_SYNTH)
+
+        if self.ticks > 0 and self.ticks % FRAME_TIME_READOUT_INTERVAL == 0:
+            self.frame_time_label.SetLabel(
+                "Frame time: %.1fms avg, %.1fms max, %d dropped" % (
+                    self.total_frame_time * 1000 / self.ticks,
+                    self.max_frame_time * 1000, self.dropped_frames))
+
+    def handle_destroy(self, event):
+        if event.GetEventObject() is self:
+            self.play_timer.Stop()
+
+        event.Skip()
+
     def show_wave_panel(self, index):
         if self.wave_slider.GetValue() != index:
             self.wave_slider.SetValue(index)
 
         self.frame_number.update(index)
-
-        for i in xrange(len(self.wave_panels)):
-            if i == index:
-                self.wave_panels[i].Show()
-            else:
-                self.wave_panels[i].Hide()
-
-        self.Layout()
+        self.wave_panel.show_wave(index)
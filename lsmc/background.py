@@ -0,0 +1,123 @@
+import threading
+import traceback
+
+import wx
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskProgressDialog(object):
+
+    def __init__(self, title, message, parent=None):
+        self.task = None
+
+        self.dlg = wx.ProgressDialog(
+            title, message, 100, parent,
+            style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_AUTO_HIDE |
+            wx.PD_ELAPSED_TIME)
+
+    def update(self, message, step, total_steps, still_working):
+        if self.dlg is None:
+            return
+
+        # Hold the gauge just short of 100% until the task actually finishes,
+        # since PD_AUTO_HIDE hides the dialog as soon as it reaches the end
+        percent = min((step * 100) / max(total_steps, 1), 99)
+
+        keep_going, _ = self.dlg.Update(percent, newmsg=message)
+
+        if not keep_going and self.task is not None:
+            self.task.cancel()
+
+    def close(self):
+        if self.dlg is not None:
+            self.dlg.Destroy()
+            self.dlg = None
+
+
+class BackgroundTask(object):
+    """
+    Runs work_fn(task) on a worker thread. Progress reports and the final
+    result are handed back to the wx main thread with wx.CallAfter, so the
+    on_* callbacks are free to touch widgets.
+    """
+
+    def __init__(self, work_fn, on_success=None, on_error=None,
+                 on_cancel=None, progress_dialog=None):
+        self.work_fn = work_fn
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+
+        self.progress_dialog = progress_dialog
+
+        if progress_dialog is not None:
+            progress_dialog.task = self
+
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+    def post(self, function, *args, **kwargs):
+        wx.CallAfter(function, *args, **kwargs)
+
+    def report_progress(self, message, step, total_steps, still_working):
+        # Same signature as pylsdj's progress callbacks, so a task can be
+        # handed straight to SAVFile and friends
+        self.check_cancelled()
+
+        if self.progress_dialog is not None:
+            self.post(self.progress_dialog.update, message, step,
+                      total_steps, still_working)
+
+    def wait(self):
+        # Keep the event loop turning while we wait, so that progress updates
+        # and the task's own callbacks still get delivered
+        while not self._finished.wait(0.05):
+            wx.YieldIfNeeded()
+
+        wx.YieldIfNeeded()
+
+    def _run(self):
+        try:
+            result = self.work_fn(self)
+        except TaskCancelled:
+            self.post(self._finish, self.on_cancel)
+        except Exception, e:
+            print(traceback.format_exc())
+            self.post(self._finish, self.on_error, e)
+        else:
+            self.post(self._finish, self.on_success, result)
+
+    def _finish(self, callback, *args):
+        try:
+            if self.progress_dialog is not None:
+                self.progress_dialog.close()
+
+            if callback is not None:
+                callback(*args)
+        finally:
+            self._finished.set()
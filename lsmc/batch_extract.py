@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Headless batch extraction of songs from directories full of .sav files.
+# Deliberately imports nothing from wx, so that it can run on machines
+# without a display.
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+
+from pylsdj.savfile import SAVFile
+from pylsdj import utils as pylsdjutils
+
+EXPORT_METHODS = {
+    "lsdsng": "save_lsdsng",
+    "srm": "save_srm"
+}
+
+
+def find_sav_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield (os.path.dirname(path), path)
+            continue
+
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+
+            for filename in sorted(filenames):
+                if filename.lower().endswith('.sav'):
+                    yield (path, os.path.join(dirpath, filename))
+
+
+def song_filename(index, project, song_format):
+    name = pylsdjutils.name_without_zeroes(project.name)
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', name)
+
+    if len(name) == 0:
+        name = "UNNAMED"
+
+    return "%02d_%s.%s" % (index + 1, name, song_format)
+
+
+def extract_sav(args):
+    (root, sav_path, output_dir, formats) = args
+
+    relative_path = os.path.relpath(sav_path, root)
+    song_dir = os.path.join(output_dir, os.path.splitext(relative_path)[0])
+
+    songs_written = 0
+
+    try:
+        sav_obj = SAVFile(sav_path)
+
+        for (index, project) in sav_obj.project_list:
+            if project is None:
+                continue
+
+            if not os.path.exists(song_dir):
+                os.makedirs(song_dir)
+
+            for song_format in formats:
+                getattr(project, EXPORT_METHODS[song_format])(os.path.join(
+                    song_dir, song_filename(index, project, song_format)))
+
+            songs_written += 1
+    except Exception:
+        return (sav_path, songs_written, traceback.format_exc())
+
+    return (sav_path, songs_written, None)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Extract every song in one or more directories of .sav "
+        "files, without starting the GUI")
+    parser.add_argument("paths", nargs="+",
+                        help=".sav files or directories to search for them")
+    parser.add_argument("-o", "--output-dir", required=True,
+                        help="directory in which to write extracted songs")
+    parser.add_argument("-f", "--format", action="append",
+                        choices=sorted(EXPORT_METHODS.keys()),
+                        help="format in which to export songs (may be given "
+                        "more than once; default: lsdsng)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: one per "
+                        "core)")
+
+    args = parser.parse_args(argv)
+
+    formats = args.format or ["lsdsng"]
+
+    work = [(root, sav_path, args.output_dir, formats)
+            for (root, sav_path) in find_sav_files(args.paths)]
+
+    if len(work) == 0:
+        print("No .sav files found")
+        return 1
+
+    start_time = time.time()
+
+    total_songs = 0
+    failures = 0
+
+    pool = multiprocessing.Pool(max(args.jobs, 1))
+
+    try:
+        for (sav_path, songs_written, error) in pool.imap_unordered(
+                extract_sav, work):
+            total_songs += songs_written
+
+            if error is not None:
+                failures += 1
+                sys.stderr.write("Failed to extract '%s':\n%s\n" % (
+                    sav_path, error))
+            else:
+                print("%s: %d song(s)" % (sav_path, songs_written))
+
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+
+    print("")
+    print("Extracted %d song(s) from %d file(s) (%d failed) in %.2fs" % (
+        total_songs, len(work), failures, elapsed))
+    print("Throughput: %.2f files/s, %.2f songs/s" % (
+        len(work) / elapsed, total_songs / elapsed))
+
+    if failures > 0:
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
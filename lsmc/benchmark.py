@@ -0,0 +1,749 @@
+#!/usr/bin/env python
+
+# Benchmarks for the operations that users wait on, run against generated
+# .sav files that range from empty to completely full. Results are written
+# as JSON so that runs from different commits can be compared (see
+# --compare).
+#
+# Benchmarks that need wx are skipped if wx can't start; run the suite under
+# a virtual display (e.g. xvfb-run) to include them.
+
+import argparse
+import collections
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import bread
+import pylsdj.bread_spec as spec
+from pylsdj import blockutils
+from pylsdj.consts import RAW_DATA_SIZE
+from pylsdj.project import Project, load_lsdsng, load_srm
+from pylsdj.savfile import SAVFile, NUM_FILES
+
+import savwriter
+import song_diff
+from LazyProject import lazy_project_list
+
+DEFAULT_REPEAT = 5
+
+Fixture = collections.namedtuple("Fixture", "name num_songs phrases_per_song")
+
+# Song data is mostly phrases, so the number of phrases filled with notes in
+# each song controls how many blocks it takes up. "full" uses every song slot
+# and most of the .sav's blocks.
+FIXTURES = [
+    Fixture("empty", 0, 0),
+    Fixture("sparse", 4, 16),
+    Fixture("half", 16, 32),
+    Fixture("full", NUM_FILES, 96)
+]
+
+PHRASE_LENGTH = 16
+CHAINS_PER_SONG_ROW = 2
+MAX_NOTE = 0x3b
+
+# Every instrument and table in a generated song is allocated
+FIXTURE_INSTRUMENTS = 8
+FIXTURE_TABLES = 4
+
+
+def _bytes_offset(bread_obj):
+    return bread_obj._offset // 8
+
+
+_song_template = None
+
+
+def _song_template_data():
+    # Parsing a song takes a while, so it's only done once; every generated
+    # song is a copy of this with its phrases filled in
+    global _song_template
+
+    if _song_template is None:
+        song_data = bread.parse(bytearray(RAW_DATA_SIZE), spec.song)
+
+        song_data.mem_init_flag_1 = 'rb'
+        song_data.mem_init_flag_2 = 'rb'
+        song_data.mem_init_flag_3 = 'rb'
+
+        for i in xrange(FIXTURE_INSTRUMENTS):
+            song_data.instr_alloc_table[i] = 1
+            song_data.instrument_names[i] = "INS%02d" % (i)
+
+        for i in xrange(FIXTURE_TABLES):
+            song_data.table_alloc_table[i] = 1
+
+        _song_template = song_data
+
+    return _song_template
+
+
+def make_song(seed, num_phrases):
+    rng = random.Random(seed)
+    song_data = _song_template_data()
+
+    for phrase in xrange(spec.NUM_PHRASES):
+        song_data.phrase_alloc_table[phrase] = int(phrase < num_phrases)
+
+    num_chains = (num_phrases + CHAINS_PER_SONG_ROW - 1) // CHAINS_PER_SONG_ROW
+
+    for chain in xrange(spec.NUM_CHAINS):
+        song_data.chain_alloc_table[chain] = int(chain < num_chains)
+
+    raw_data = bread.write(song_data, spec.song)
+
+    phrase_notes_offset = _bytes_offset(song_data.phrase_notes)
+    chain_phrases_offset = _bytes_offset(song_data.chain_phrases)
+    song_offset = _bytes_offset(song_data.song)
+
+    # Filling the bytes in directly is much faster than going through the
+    # parsed song
+    for phrase in xrange(num_phrases):
+        start = phrase_notes_offset + phrase * PHRASE_LENGTH
+
+        for i in xrange(PHRASE_LENGTH):
+            raw_data[start + i] = rng.randint(0, MAX_NOTE)
+
+    chain_length = len(song_data.chain_phrases[0])
+
+    for chain in xrange(num_chains):
+        start = chain_phrases_offset + chain * chain_length
+
+        for i in xrange(chain_length):
+            phrase = chain * CHAINS_PER_SONG_ROW + i
+
+            if i < CHAINS_PER_SONG_ROW and phrase < num_phrases:
+                raw_data[start + i] = phrase
+            else:
+                raw_data[start + i] = 0xff
+
+    # Each chain gets a row of the song on the first pulse channel
+    row_length = len(song_data.song[0]) // 8
+    num_rows = len(song_data.song)
+
+    for row in xrange(num_rows):
+        start = song_offset + row * row_length
+
+        for i in xrange(row_length):
+            if i == 0 and row < num_chains:
+                raw_data[start + i] = row
+            else:
+                raw_data[start + i] = 0xff
+
+    return raw_data
+
+
+def make_fixture(path, fixture):
+    # Songs are added to a blank .sav, and the result saved alongside it
+    blank_path = path + '.blank'
+
+    with open(blank_path, 'wb') as fp:
+        header_block = bread.parse(
+            bytearray(blockutils.BLOCK_SIZE), spec.compressed_sav_file)
+        header_block.sram_init_check = 'jk'
+
+        for i in xrange(len(header_block.block_alloc_table)):
+            header_block.block_alloc_table[i] = savwriter.EMPTY_BLOCK
+
+        fp.write(bytearray(SAVFile.START_OFFSET))
+        fp.write(bread.write(header_block, spec.compressed_sav_file))
+        fp.write(bytearray(
+            (savwriter.NUM_BLOCKS - 1) * blockutils.BLOCK_SIZE))
+
+    try:
+        sav_obj = SAVFile(blank_path)
+
+        for index in xrange(fixture.num_songs):
+            sav_obj.projects[index] = Project(
+                "SONG%02d" % (index), index, 1,
+                make_song(index, fixture.phrases_per_song))
+
+        temp_path = path + '.tmp'
+        savwriter.save_sav(sav_obj, temp_path)
+        os.rename(temp_path, path)
+    finally:
+        os.remove(blank_path)
+
+
+def fixture_path(fixtures_dir, fixture):
+    return os.path.join(fixtures_dir, "%s_%d_%d.sav" % (
+        fixture.name, fixture.num_songs, fixture.phrases_per_song))
+
+
+class Context(object):
+    # Everything a benchmark needs to know about the case it's running
+
+    def __init__(self, fixture, sav_path, work_dir):
+        self.fixture = fixture
+        self.sav_path = sav_path
+        self.work_dir = work_dir
+
+        self.app = None
+        self.main_window = None
+
+        self.teardowns = []
+
+    def on_teardown(self, function):
+        # function is called after the current repeat has been timed
+        self.teardowns.append(function)
+
+    def teardown(self):
+        while len(self.teardowns) > 0:
+            self.teardowns.pop()()
+
+    def work_path(self, filename):
+        return os.path.join(self.work_dir, filename)
+
+    def fresh_sav(self):
+        return savwriter.load_sav(self.sav_path)
+
+    def first_project(self):
+        return self.fresh_sav().projects[0]
+
+
+# Each benchmark is a function that takes a Context, does whatever setup it
+# needs and returns the (zero-argument) function to time. It's called once per
+# repeat.
+
+def bench_sav_load(context):
+    def run():
+        sav_obj = savwriter.load_sav(context.sav_path)
+        lazy_project_list(sav_obj)
+
+    return run
+
+
+def bench_sav_read_songs(context):
+    def run():
+        sav_obj = savwriter.load_sav(context.sav_path)
+
+        for index in xrange(NUM_FILES):
+            sav_obj.projects[index]
+
+    return run
+
+
+def bench_sav_save(context):
+    sav_obj = context.fresh_sav()
+    output_path = context.work_path("save.sav")
+
+    return lambda: savwriter.save_sav(sav_obj, output_path)
+
+
+def bench_sav_save_one_edit(context):
+    sav_obj = context.fresh_sav()
+    output_path = context.work_path("save.sav")
+
+    instrument = sav_obj.projects[0].song.instruments[0]
+    instrument.name = "EDIT"
+
+    return lambda: savwriter.save_sav(sav_obj, output_path)
+
+
+def bench_lsdsng_export(context):
+    project = context.first_project()
+    output_path = context.work_path("export.lsdsng")
+
+    return lambda: project.save_lsdsng(output_path)
+
+
+def bench_srm_export(context):
+    project = context.first_project()
+    output_path = context.work_path("export.srm")
+
+    return lambda: project.save_srm(output_path)
+
+
+def bench_lsdsng_import(context):
+    input_path = context.work_path("import.lsdsng")
+
+    if not os.path.exists(input_path):
+        context.first_project().save_lsdsng(input_path)
+
+    return lambda: load_lsdsng(input_path)
+
+
+def bench_srm_import(context):
+    input_path = context.work_path("import.srm")
+
+    if not os.path.exists(input_path):
+        context.first_project().save_srm(input_path)
+
+    return lambda: load_srm(input_path)
+
+
+def _sav_songs(sav_obj):
+    return [project for (index, project) in lazy_project_list(sav_obj)]
+
+
+def bench_sav_diff_same(context):
+    sav_a = context.fresh_sav()
+    sav_b = context.fresh_sav()
+
+    song_diff.load_layout()
+
+    return lambda: song_diff.diff_savs(
+        sav_a, _sav_songs(sav_a), sav_b, _sav_songs(sav_b))
+
+
+def bench_sav_diff_all_edited(context):
+    # Every song differs from its counterpart in one note, so every song is
+    # decompressed and compared section by section. The songs are edited
+    # through their raw data, since parsing every song takes far longer than
+    # the comparison.
+    sav_a = context.fresh_sav()
+    sav_b = context.fresh_sav()
+
+    songs_b = []
+
+    for project in _sav_songs(sav_b):
+        if project is not None:
+            # The first bytes of a song are the notes of its first phrase
+            raw_data = bytearray(project._raw_bytes)
+            raw_data[0] = (raw_data[0] + 1) % MAX_NOTE
+
+            project = Project(project.name, project.version,
+                              project.size_blks, raw_data)
+
+        songs_b.append(project)
+
+    song_diff.load_layout()
+
+    return lambda: song_diff.diff_savs(
+        sav_a, _sav_songs(sav_a), sav_b, songs_b)
+
+
+def bench_event_handlers_load_sav(context):
+    import event_handlers
+
+    main_window = context.main_window
+
+    return lambda: event_handlers.load_sav(
+        context.sav_path, main_window.songs_window, main_window).wait()
+
+
+def bench_event_handlers_save_sav(context):
+    import event_handlers
+
+    sav_obj = context.fresh_sav()
+    output_path = context.work_path("save.sav")
+
+    return lambda: event_handlers.save_sav_to(sav_obj, output_path).wait()
+
+
+def bench_handle_sav_loaded(context):
+    projects_window = context.main_window.songs_window
+    sav_obj = context.fresh_sav()
+
+    def run():
+        projects_window.handle_sav_loaded(sav_obj)
+
+        for (index, project) in lazy_project_list(sav_obj):
+            projects_window.handle_project_loaded(index, project)
+
+        projects_window.handle_sav_load_finished()
+
+    return run
+
+
+def bench_song_window(context):
+    from SongWindow import SongWindow
+
+    project = context.first_project()
+
+    # Parsing the song is measured by the export benchmarks
+    project.song
+
+    def run():
+        window = SongWindow(context.main_window, project, 0)
+        window.Update()
+        context.on_teardown(window.Destroy)
+
+    return run
+
+
+def bench_table_show(context):
+    from SongWindow import SongWindow
+
+    project = context.first_project()
+    project.song
+
+    window = SongWindow(context.main_window, project, 0)
+    context.on_teardown(window.Destroy)
+
+    table_page = window.notebook.GetPage(2)
+    table_page.build()
+    table_pane = table_page.pane
+
+    tables = project.song.tables.as_list()
+
+    def run():
+        for table in tables:
+            table_pane.show_table(table)
+            table_pane.table_view.Update()
+
+    return run
+
+
+Benchmark = collections.namedtuple("Benchmark", "name function needs_gui "
+                                   "needs_songs")
+
+BENCHMARKS = [
+    Benchmark("sav_load", bench_sav_load, False, False),
+    Benchmark("sav_read_songs", bench_sav_read_songs, False, False),
+    Benchmark("sav_save", bench_sav_save, False, False),
+    Benchmark("sav_save_one_edit", bench_sav_save_one_edit, False, True),
+    Benchmark("lsdsng_export", bench_lsdsng_export, False, True),
+    Benchmark("srm_export", bench_srm_export, False, True),
+    Benchmark("lsdsng_import", bench_lsdsng_import, False, True),
+    Benchmark("srm_import", bench_srm_import, False, True),
+    Benchmark("sav_diff_same", bench_sav_diff_same, False, False),
+    Benchmark("sav_diff_all_edited", bench_sav_diff_all_edited, False, True),
+    Benchmark("event_handlers_load_sav", bench_event_handlers_load_sav,
+              True, False),
+    Benchmark("event_handlers_save_sav", bench_event_handlers_save_sav,
+              True, False),
+    Benchmark("handle_sav_loaded", bench_handle_sav_loaded, True, False),
+    Benchmark("song_window", bench_song_window, True, True),
+    Benchmark("table_show", bench_table_show, True, True)
+]
+
+
+def _peak_rss_kb():
+    # resource is Unix-only; on Windows peak memory isn't reported
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # OS X reports bytes rather than kilobytes
+    if sys.platform == 'darwin':
+        peak //= 1024
+
+    return peak
+
+
+def _start_gui(context):
+    import wx
+
+    context.app = wx.App(False)
+
+    # Stands in for the main window in the LSMC script, which can't be
+    # imported without starting the app
+    import ProjectsWindow
+
+    class MainWindow(wx.Frame):
+
+        def __init__(self):
+            wx.Frame.__init__(self, None, wx.ID_ANY, "Benchmark",
+                              size=(600, 600))
+
+            self.sav_obj = None
+
+            panel = wx.Panel(self)
+            self.songs_window = ProjectsWindow.ProjectsWindow(panel)
+
+            sizer = wx.BoxSizer(wx.VERTICAL)
+            sizer.Add(self.songs_window, 1, flag=wx.ALL | wx.EXPAND)
+            panel.SetSizer(sizer)
+
+            self.Show()
+
+        def set_sav(self, sav_obj):
+            self.sav_obj = sav_obj
+            self.songs_window.handle_sav_loaded(sav_obj)
+
+        def clear_sav(self):
+            self.sav_obj = None
+            self.songs_window.handle_sav_cleared()
+
+        def get_sav(self):
+            return self.sav_obj
+
+        def update_models(self):
+            pass
+
+    context.main_window = MainWindow()
+
+
+def run_case(benchmark, fixture, sav_path, repeat, conn):
+    # Runs in its own process, so that peak memory use belongs to this case
+    # alone
+    work_dir = tempfile.mkdtemp(prefix="lsmc-bench-")
+    result = collections.OrderedDict()
+
+    try:
+        context = Context(fixture, sav_path, work_dir)
+
+        if benchmark.needs_gui:
+            _start_gui(context)
+
+        times = []
+        allocations = []
+        baseline_rss_kb = _peak_rss_kb()
+
+        for i in xrange(repeat):
+            run = benchmark.function(context)
+
+            gc.collect()
+            gc.disable()
+
+            # Python 2 has no allocation tracer, so count the objects the
+            # collector tracks that were created during the run and are
+            # still alive at the end of it
+            objects_before = len(gc.get_objects())
+            start = time.time()
+
+            try:
+                run()
+            finally:
+                elapsed = time.time() - start
+                gc.enable()
+
+            allocations.append(len(gc.get_objects()) - objects_before)
+            times.append(elapsed)
+
+            context.teardown()
+
+        peak_rss_kb = _peak_rss_kb()
+
+        result.update([
+            ("status", "ok"),
+            ("times", times),
+            ("min", min(times)),
+            ("mean", sum(times) / len(times)),
+            ("first", times[0]),
+            ("peak_rss_kb", peak_rss_kb),
+            ("peak_rss_growth_kb",
+             None if peak_rss_kb is None else peak_rss_kb - baseline_rss_kb),
+            ("allocations", max(allocations)),
+            ("allocations_method", "net_gc_objects")
+        ])
+    except Exception:
+        result.update({"status": "error", "error": traceback.format_exc()})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    conn.send(result)
+    conn.close()
+
+
+def _probe_gui(conn):
+    try:
+        import wx
+        wx.App(False)
+        conn.send(None)
+    except Exception, e:
+        conn.send(str(e) or e.__class__.__name__)
+
+
+def gui_available():
+    # Returns the reason wx can't start, or None if it can. Tried in a
+    # throwaway process, since a failed start can take the whole interpreter
+    # with it.
+    (parent_conn, child_conn) = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=_probe_gui, args=(child_conn,))
+    process.start()
+    process.join()
+
+    if process.exitcode != 0:
+        return "wx exited with status %s" % (process.exitcode)
+
+    return parent_conn.recv() if parent_conn.poll() else "wx didn't start"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    baseline_times = dict(
+        ((result["benchmark"], result["fixture"]), result["min"])
+        for result in baseline["results"] if result["status"] == "ok")
+
+    lines = []
+
+    for result in results["results"]:
+        key = (result["benchmark"], result["fixture"])
+
+        if result["status"] != "ok" or key not in baseline_times:
+            continue
+
+        lines.append("%-26s %-7s %9.4fs -> %9.4fs  x%.2f" % (
+            key[0], key[1], baseline_times[key], result["min"],
+            result["min"] / max(baseline_times[key], 1e-9)))
+
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Time lsmc's slow operations against generated .sav "
+        "files")
+    parser.add_argument("-o", "--output",
+                        help="file to write JSON results to (default: "
+                        "standard output)")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="number of times to run each benchmark "
+                        "(default: %(default)s)")
+    parser.add_argument("-b", "--benchmark", action="append",
+                        choices=[b.name for b in BENCHMARKS],
+                        help="only run the given benchmark (may be given "
+                        "more than once)")
+    parser.add_argument("-x", "--fixture", action="append",
+                        choices=[f.name for f in FIXTURES],
+                        help="only use the given fixture (may be given more "
+                        "than once)")
+    parser.add_argument("--fixtures-dir",
+                        help="keep generated fixtures in this directory and "
+                        "reuse them between runs")
+    parser.add_argument("--no-gui", action="store_true",
+                        help="skip benchmarks that need wx")
+    parser.add_argument("--compare",
+                        help="JSON results of an earlier run to compare "
+                        "against")
+
+    args = parser.parse_args(argv)
+
+    benchmarks = [b for b in BENCHMARKS
+                  if args.benchmark is None or b.name in args.benchmark]
+    fixtures = [f for f in FIXTURES
+                if args.fixture is None or f.name in args.fixture]
+
+    gui_skip_reason = None
+
+    if args.no_gui:
+        gui_skip_reason = "--no-gui"
+    elif any(b.needs_gui for b in benchmarks):
+        gui_skip_reason = gui_available()
+
+    if args.fixtures_dir is not None:
+        fixtures_dir = args.fixtures_dir
+
+        if not os.path.exists(fixtures_dir):
+            os.makedirs(fixtures_dir)
+    else:
+        fixtures_dir = tempfile.mkdtemp(prefix="lsmc-fixtures-")
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "results": []
+    }
+
+    try:
+        for fixture in fixtures:
+            sav_path = fixture_path(fixtures_dir, fixture)
+
+            if not os.path.exists(sav_path):
+                sys.stderr.write("Generating fixture '%s'\n" % (fixture.name))
+
+                # Generating songs leaves a parsed song behind, which would
+                # otherwise count towards every case's memory use
+                process = multiprocessing.Process(
+                    target=make_fixture, args=(sav_path, fixture))
+                process.start()
+                process.join()
+
+                if process.exitcode != 0:
+                    sys.stderr.write("Failed to generate fixture '%s'\n" % (
+                        fixture.name))
+                    return 1
+
+            for benchmark in benchmarks:
+                result = collections.OrderedDict([
+                    ("benchmark", benchmark.name),
+                    ("fixture", fixture.name),
+                    ("songs", fixture.num_songs),
+                    ("file_size", os.path.getsize(sav_path))])
+
+                if benchmark.needs_gui and gui_skip_reason is not None:
+                    result.update({"status": "skipped",
+                                   "reason": gui_skip_reason})
+                elif benchmark.needs_songs and fixture.num_songs == 0:
+                    result.update({"status": "skipped",
+                                   "reason": "fixture has no songs"})
+                else:
+                    (parent_conn, child_conn) = multiprocessing.Pipe(False)
+                    process = multiprocessing.Process(
+                        target=run_case, args=(
+                            benchmark, fixture, sav_path, max(args.repeat, 1),
+                            child_conn))
+                    process.start()
+
+                    # Receive before joining, so a large result can't fill
+                    # the pipe and deadlock the child
+                    try:
+                        result.update(parent_conn.recv())
+                    except EOFError:
+                        result.update({
+                            "status": "error",
+                            "error": "process exited with status %s" % (
+                                process.exitcode)})
+
+                    process.join()
+
+                results["results"].append(result)
+
+                if result["status"] == "ok":
+                    summary = "min %.4fs, mean %.4fs" % (
+                        result["min"], result["mean"])
+
+                    if result["peak_rss_kb"] is not None:
+                        summary += ", peak %dKB" % (result["peak_rss_kb"])
+                elif result["status"] == "skipped":
+                    summary = "skipped (%s)" % (result["reason"])
+                else:
+                    summary = "FAILED\n" + result["error"]
+
+                sys.stderr.write("%-26s %-7s %s\n" % (
+                    benchmark.name, fixture.name, summary))
+    finally:
+        if args.fixtures_dir is None:
+            shutil.rmtree(fixtures_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+
+        sys.stderr.write("\nCompared to %s:\n%s\n" % (
+            baseline.get("revision") or args.compare,
+            compare(results, baseline)))
+
+    if any(result["status"] == "error" for result in results["results"]):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,343 @@
+import collections
+import threading
+import weakref
+
+import wx
 from wx.lib.pubsub import pub
+from wx.lib.pubsub.utils.notification import IgnoreNotificationsMixin
+
+import perf
+
+
+class TopicCounts(object):
+
+    def __init__(self, topic):
+        self.topic = topic
+
+        # Number of times publish() was called on the topic
+        self.published = 0
+
+        # Number of publishes that were folded into a later one before
+        # they were delivered
+        self.coalesced = 0
+
+        # Number of times the topic's listeners were actually called
+        self.delivered = 0
+
+
+_counts = {}
+
+
+def _counts_for(topic):
+    if topic not in _counts:
+        _counts[topic] = TopicCounts(topic)
+
+    return _counts[topic]
+
+
+def get_counts():
+    return dict(_counts)
+
+
+def reset_counts():
+    # Counts are zeroed rather than thrown away, since channels hold on to
+    # theirs
+    for counts in _counts.values():
+        counts.published = 0
+        counts.coalesced = 0
+        counts.delivered = 0
+
+
+def format_counts():
+    lines = []
+
+    for topic in sorted(_counts.keys()):
+        counts = _counts[topic]
+
+        if counts.published == 0 and counts.delivered == 0:
+            continue
+
+        lines.append("%s: %d published, %d coalesced, %d delivered" % (
+            topic, counts.published, counts.coalesced, counts.delivered))
+
+    return '\n'.join(lines)
+
+
+def _channel_name(topic):
+    # Topics for a channel's different domains share one set of timings
+    return topic.split('+', 1)[0]
+
+
+class _HandlerTimer(IgnoreNotificationsMixin):
+    # pubsub tells us just before each listener of a message is called, and
+    # once more after the last one, which is enough to time every listener
+
+    def __init__(self):
+        self._current = None
+
+    def reset(self):
+        self._current = None
+
+    def notifySend(self, stage, topicObj, pubListener=None):
+        now = perf.clock()
+
+        if self._current is not None:
+            (topic, handler_name, start) = self._current
+            perf.histogram("channels.%s.%s" % (
+                _channel_name(topic), handler_name)).record(now - start)
+            self._current = None
+
+        if stage == 'in':
+            self._current = (topicObj.getName(), pubListener.name(), now)
+
+
+_handler_timer = None
+_handler_timing = False
+
+
+def set_handler_timing(enabled):
+    # Off by default, since pubsub's notifications cost something on every
+    # listener call
+    global _handler_timer, _handler_timing
+
+    if _handler_timer is None:
+        _handler_timer = _HandlerTimer()
+        pub.addNotificationHandler(_handler_timer)
+
+    # A listener that was being timed when this changed isn't recorded
+    _handler_timer.reset()
+    pub.setNotificationFlags(sendMessage=enabled)
+
+    _handler_timing = enabled
+
+
+def handler_timing():
+    return _handler_timing
+
+
+class _CoalescingDispatcher(object):
+    # Publishes are queued up and delivered together on the next turn of the
+    # event loop; if the same channel is published to more than once in the
+    # meantime, only the most recent data is delivered
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+        self._flush_scheduled = False
+
+    def enqueue(self, channel, data):
+        with self._lock:
+            if channel in self._pending:
+                channel.counts.coalesced += 1
+
+            self._pending[channel] = data
+
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                wx.CallAfter(self.flush)
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+            self._flush_scheduled = False
+
+        for (channel, data) in pending.items():
+            channel.deliver(data)
+
+
+_dispatcher = _CoalescingDispatcher()
+_coalescing = True
+
+
+def set_coalescing(enabled):
+    global _coalescing
+
+    if not enabled:
+        # Don't strand anything that was published under the old mode
+        _dispatcher.flush()
+
+    _coalescing = enabled
+
+
+def coalescing():
+    return _coalescing
+
+
+def _weak_callable(function):
+    # Returns something that gives back the function while it's still alive
+    # and None afterwards, without keeping it (or its object) alive itself
+    if getattr(function, 'im_self', None) is not None:
+        obj_ref = weakref.ref(function.im_self)
+        im_func = function.im_func
+
+        def resolve():
+            obj = obj_ref()
+
+            if obj is None:
+                return None
+
+            return im_func.__get__(obj, type(obj))
+
+        return resolve
+
+    return weakref.ref(function)
+
+
+def _describe(obj):
+    if obj is None:
+        return "(module)"
+
+    return "%s at 0x%x" % (type(obj).__name__, id(obj))
+
+
+class Subscription(object):
+
+    def __init__(self, scope, topic, function):
+        self.scope = scope
+        self.topic = topic
+        self.listener_name = getattr(function, '__name__', repr(function))
+
+        self._function = _weak_callable(function)
+
+    @property
+    def alive(self):
+        return self._function() is not None
+
+    def unsubscribe(self):
+        function = self._function()
+
+        if function is not None:
+            pub.unsubscribe(function, self.topic)
+
+        self.scope._forget(self)
+
+        topic_subscriptions = _subscriptions.get(self.topic)
+
+        if topic_subscriptions is not None:
+            topic_subscriptions.discard(self)
+
+            if len(topic_subscriptions) == 0:
+                del _subscriptions[self.topic]
+
+
+class SubscriptionScope(object):
+    """
+    The subscriptions made on behalf of one owner. They're all released
+    together when the owner is: a wx window when it's destroyed, anything
+    else when release() is called on it or it's garbage collected.
+    """
+
+    def __init__(self, owner):
+        self.owner_description = _describe(owner)
+
+        self._key = id(owner)
+        self._subscriptions = set()
+
+        if owner is None:
+            self._owner_ref = None
+            return
+
+        self._owner_ref = weakref.ref(owner, lambda r: self.release())
+
+        if isinstance(owner, wx.Window):
+            owner.Bind(wx.EVT_WINDOW_DESTROY, self._handle_destroy)
+
+    def _handle_destroy(self, event):
+        # Destroy events are passed up to parents as well, so this is also
+        # called as each of the owner's children goes
+        if event.GetEventObject() is self._owner_ref():
+            self.release()
+
+        event.Skip()
+
+    def subscribe(self, channel, function):
+        topic = channel._pubsub_channel
+
+        for subscription in self._subscriptions:
+            if (subscription.topic == topic and
+                    subscription._function() == function):
+                return subscription
+
+        pub.subscribe(function, topic)
+
+        subscription = Subscription(self, topic, function)
+        self._subscriptions.add(subscription)
+
+        _subscriptions.setdefault(topic, set()).add(subscription)
+
+        return subscription
+
+    def _forget(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def release(self):
+        for subscription in list(self._subscriptions):
+            subscription.unsubscribe()
+
+        if _scopes.get(self._key) is self:
+            del _scopes[self._key]
+
+
+# id(owner) -> SubscriptionScope, and topic -> set of Subscriptions
+_scopes = {}
+_subscriptions = {}
+
+
+def scope_for(owner):
+    key = id(owner)
+    scope = _scopes.get(key)
+
+    # An id can be reused once its object has gone
+    if scope is not None and (
+            owner is None or scope._owner_ref() is owner):
+        return scope
+
+    scope = SubscriptionScope(owner)
+    _scopes[key] = scope
+
+    return scope
+
+
+def release(owner):
+    """
+    Unsubscribes everything that was subscribed on behalf of owner, e.g.
+    when a model is replaced
+    """
+    scope = _scopes.get(id(owner))
+
+    if scope is not None and scope._owner_ref is not None and \
+            scope._owner_ref() is owner:
+        scope.release()
+
+
+def live_subscriptions():
+    # topic -> [(owner, listener name)] for every subscription that hasn't
+    # been released
+    report = {}
+
+    for (topic, subscriptions) in _subscriptions.items():
+        report[topic] = sorted(
+            (s.scope.owner_description, s.listener_name)
+            for s in subscriptions if s.alive)
+
+    return report
+
+
+def format_subscriptions():
+    report = live_subscriptions()
+
+    lines = ["%d live subscription(s) on %d topic(s), %d owner(s)" % (
+        sum(len(entries) for entries in report.values()), len(report),
+        len(_scopes))]
+
+    for topic in sorted(report.keys()):
+        lines.append("%s: %d" % (topic, len(report[topic])))
+
+        for (owner_description, listener_name) in report[topic]:
+            lines.append("    %s.%s" % (owner_description, listener_name))
+
+    return '\n'.join(lines)
 
 
 class Channel(object):
@@ -9,19 +348,81 @@ class Channel(object):
         else:
             self._pubsub_channel = name
 
-    def subscribe(self, function):
-        pub.subscribe(function, self._pubsub_channel)
+        self.counts = _counts_for(self._pubsub_channel)
+
+        self._deliver_histogram = perf.histogram(
+            "channels.%s.deliver" % (name))
 
+    def subscribe(self, function, owner=None):
+        """
+        Subscribes function to the channel until owner goes away (see
+        SubscriptionScope). The owner defaults to the object that function is
+        a method of.
+        """
+        if owner is None:
+            owner = getattr(function, 'im_self', None)
+
+        return scope_for(owner).subscribe(self, function)
+
+    @perf.timed("channels.Channel.publish")
     def publish(self, data):
-        pub.sendMessage(self._pubsub_channel, data=data)
+        self.counts.published += 1
+
+        if _coalescing:
+            _dispatcher.enqueue(self, data)
+        else:
+            self.deliver(data)
+
+    def deliver(self, data):
+        # Timed per channel rather than with perf.timed, so that the
+        # Performance window shows which messages are expensive to handle
+        start = perf.clock()
+
+        try:
+            pub.sendMessage(self._pubsub_channel, data=data)
+        finally:
+            self._deliver_histogram.record(perf.clock() - start)
+
+        self.counts.delivered += 1
 
 # This is essentially a poor man's functools.partial to allow channel
-# declaration to look a little cleaner
+# declaration to look a little cleaner. Channels are interned, so asking for
+# the same channel twice hands back the same object without rebuilding its
+# topic name.
 
 
 def new_channel(name):
+    channels = {}
+
+    # Channels for objects (i.e. projects) are keyed on the object's identity
+    # and only held as long as the object itself is alive
+    object_channels = {}
+
+    def forget(key, ref):
+        if key in object_channels and object_channels[key][0] is ref:
+            del object_channels[key]
+
     def inner(domain):
-        return Channel(name, domain)
+        if domain is None or isinstance(domain, (int, long, basestring)):
+            if domain not in channels:
+                channels[domain] = Channel(name, domain)
+
+            return channels[domain]
+
+        key = id(domain)
+
+        if key in object_channels:
+            (ref, channel) = object_channels[key]
+
+            if ref() is domain:
+                return channel
+
+        channel = Channel(name, domain)
+
+        ref = weakref.ref(domain, lambda r: forget(key, r))
+        object_channels[key] = (ref, channel)
+
+        return channel
 
     return inner
 
@@ -35,3 +436,17 @@ INSTR_IMPORT = new_channel("INSTR_IMPORT")
 SYNTH_CHANGE = new_channel("SYNTH_CHANGE")
 
 SONG_MODIFIED = new_channel("SONG_MODIFIED")
+
+# Published with the project when undo or redo puts parts of its song back;
+# history.changed_sections(project) says which
+SECTIONS_CHANGED = new_channel("SECTIONS_CHANGED")
+
+# Published with a list of (index, project) pairs when several songs are
+# added at once, in place of a SONG_MODIFIED for each
+SONGS_ADDED = new_channel("SONGS_ADDED")
+
+REFERENCES_CHANGED = new_channel("REFERENCES_CHANGED")
+
+# Published with the SAVFile once it has been saved and switched over to the
+# file it was saved to
+SAV_SAVED = new_channel("SAV_SAVED")
@@ -0,0 +1,176 @@
+import collections
+import hashlib
+
+import bread
+import pylsdj.bread_spec as spec
+from pylsdj.savfile import NUM_FILES
+from pylsdj import filepack
+from pylsdj import utils as pylsdjutils
+
+import savwriter
+
+
+def _struct_bytes(song_data, struct):
+    # Every part of a parsed song is a window onto the same bit array, so an
+    # element's raw bytes can be sliced straight out of it
+    return song_data._data_bits[
+        struct._offset:struct._offset + struct._length].bytes
+
+
+def _digest(*chunks):
+    hasher = hashlib.sha1()
+
+    for chunk in chunks:
+        hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def instrument_digest(song_data, index):
+    return _digest(_struct_bytes(song_data, song_data.instruments[index]))
+
+
+def table_digest(song_data, index):
+    return _digest(*[
+        _struct_bytes(song_data, struct) for struct in [
+            song_data.table_envelopes[index],
+            song_data.table_transposes[index],
+            song_data.table_cmd1.fx[index],
+            song_data.table_cmd1.val[index],
+            song_data.table_cmd2.fx[index],
+            song_data.table_cmd2.val[index]]])
+
+
+def synth_digest(song_data, index):
+    return _digest(
+        _struct_bytes(song_data, song_data.softsynth_params[index]),
+        _struct_bytes(song_data, song_data.wave_frames[index]))
+
+
+def song_data_for_scan(project):
+    # If the song has already been parsed (because it's open, or has been
+    # edited) use that; otherwise parse a throwaway copy rather than leaving
+    # every song in the .sav parsed and in memory once the scan is done
+    if project._song is not None:
+        return project.song.song_data
+
+    return bread.parse(project._raw_bytes, spec.song)
+
+
+def digests_for_song(song_data):
+    """
+    Yields (kind, index, digest) for every allocated instrument and table in
+    the song, and for every synth. Synths have no allocation table, so all of
+    them are hashed, whether or not a wave instrument uses them.
+    """
+    for index in xrange(spec.NUM_INSTRUMENTS):
+        if song_data.instr_alloc_table[index]:
+            yield ("instrument", index, instrument_digest(song_data, index))
+
+    for index in xrange(spec.NUM_TABLES):
+        if song_data.table_alloc_table[index]:
+            yield ("table", index, table_digest(song_data, index))
+
+    for index in xrange(spec.NUM_SYNTHS):
+        yield ("synth", index, synth_digest(song_data, index))
+
+
+class ContentIndex(object):
+    """
+    Groups the instruments, tables and synths of every song in a .sav by the
+    hash of their raw bytes. Locations are (song slot, index) pairs, kept in
+    the order in which they were found.
+    """
+
+    def __init__(self):
+        # (kind, digest) -> list of locations
+        self.groups = collections.OrderedDict()
+
+        # song slot -> song name at the time of the scan
+        self.song_names = {}
+
+    def add(self, kind, digest, location):
+        self.groups.setdefault((kind, digest), []).append(location)
+
+    def locations(self, kind, digest):
+        return self.groups.get((kind, digest), [])
+
+    def first_occurrence(self, kind, digest):
+        locations = self.locations(kind, digest)
+
+        if len(locations) == 0:
+            return None
+
+        return locations[0]
+
+    def count(self, kind, digest):
+        return len(self.locations(kind, digest))
+
+    def duplicate_groups(self, kind=None):
+        return [(group_kind, digest, locations)
+                for ((group_kind, digest), locations) in self.groups.items()
+                if len(locations) > 1 and (kind is None or
+                                           group_kind == kind)]
+
+    def format_location(self, location):
+        (song_index, index) = location
+
+        return "song %02d (%s) #%02x" % (
+            song_index + 1, self.song_names.get(song_index, "?"), index)
+
+
+def build_content_index(sav_obj, task=None):
+    content_index = ContentIndex()
+
+    # Songs that haven't been read are decompressed into throwaway copies
+    # here rather than through sav_obj.projects, which would keep them all in
+    # memory and which the UI thread may be using at the same time
+    loaded_projects = dict(sav_obj.projects._projects)
+
+    with savwriter.open_sav_data(sav_obj) as fp:
+        for song_index in xrange(NUM_FILES):
+            if task is not None:
+                task.report_progress(
+                    "Scanning song %d of %d" % (song_index + 1, NUM_FILES),
+                    song_index, NUM_FILES, True)
+
+            if song_index in loaded_projects:
+                project = loaded_projects[song_index]
+
+                if project is None:
+                    continue
+
+                name = project.name
+                song_data = song_data_for_scan(project)
+            else:
+                compressed_data = savwriter.read_compressed_project(
+                    sav_obj, fp, song_index)
+
+                if compressed_data is None:
+                    continue
+
+                name = sav_obj.header_block.filenames[song_index]
+                song_data = bread.parse(
+                    bytearray(filepack.decompress(compressed_data)),
+                    spec.song)
+
+            content_index.song_names[song_index] = \
+                pylsdjutils.name_without_zeroes(name)
+
+            for (kind, index, digest) in digests_for_song(song_data):
+                content_index.add(kind, digest, (song_index, index))
+
+    return content_index
+
+
+# The index for the currently loaded .sav, if it has been scanned
+_current_index = None
+
+
+def current_index():
+    return _current_index
+
+
+def set_current_index(content_index):
+    global _current_index
+    _current_index = content_index
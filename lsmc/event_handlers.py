@@ -1,57 +1,156 @@
+import os
+
 import wx
 
-from pylsdj.savfile import SAVFile
 from pylsdj.project import load_lsdsng, load_srm
 from pylsdj import utils as pylsdjutils
 
 import utils
 import channels
-
+import background
+import dedup
+import history
+import savwriter
+import sav_watch
+import song_diff
+import song_export
+import song_import
+import perf
+from LazyProject import lazy_project_list
+
+@perf.timed("event_handlers.open_sav")
 def open_sav(event, projects_window, main_window):
     def ok_handler(dlg, path):
-        sav_obj = None
+        load_sav(path, projects_window, main_window)
 
-        def progress_update_function(message, step, total_steps, still_working):
-            pass
+    # Display an open dialog box so the user can select a .sav file
+    utils.file_dialog("Choose a .sav file", '*.sav', wx.OPEN, ok_handler)
 
-        try:
-            sav_obj = SAVFile(path, callback=progress_update_function)
 
-            if sav_obj is not None:
-                main_window.set_sav(sav_obj)
-                main_window.update_models()
-        except Exception, e:
-            utils.show_error_dialog(
-                "Failed to load '%s'" % (dlg.GetFilename()),
-                e, projects_window)
+@perf.timed("event_handlers.load_sav")
+def load_sav(path, projects_window, main_window):
+    filename = os.path.basename(path)
 
-    # Display an open dialog box so the user can select a .sav file
-    utils.file_dialog("Choose a .sav file", '*.sav', wx.OPEN, ok_handler)
+    progress_dlg = background.TaskProgressDialog(
+        "Loading %s" % (filename), "Reading .sav header")
+
+    # Only the header is read up front; each song is decompressed the
+    # first time it's opened or exported
+    def load(task):
+        sav_obj = savwriter.load_sav(path, callback=task.report_progress)
+        task.post(main_window.set_sav, sav_obj)
+
+        for (index, project) in lazy_project_list(sav_obj):
+            task.post(projects_window.handle_project_loaded, index,
+                      project)
+
+        return sav_obj
+
+    def on_success(sav_obj):
+        projects_window.handle_sav_load_finished()
+        main_window.update_models()
+
+    def on_error(e):
+        main_window.clear_sav()
+        utils.show_error_dialog(
+            "Failed to load '%s'" % (filename), str(e), projects_window)
 
+    return background.BackgroundTask(
+        load, on_success=on_success, on_error=on_error,
+        on_cancel=main_window.clear_sav,
+        progress_dialog=progress_dlg).start()
 
+
+@perf.timed("event_handlers.save_sav")
 def save_sav(event, projects_window, main_window):
     save_sav_dialog(main_window.sav_obj)
 
 
+@perf.timed("event_handlers.save_sav_dialog")
 def save_sav_dialog(sav_obj):
+    # Returns the running save task (or None if the user backed out of the
+    # file dialog) so that callers can wait for the save to finish
+    tasks = []
+
     def ok_handler(dlg, path):
-        progress_dlg = wx.ProgressDialog(
-            "Saving %s" % (path), "Reticulating splines", 100)
+        tasks.append(save_sav_to(sav_obj, path))
 
-        def progress_update_function(
-                message, step, total_steps, still_working):
-            progress_dlg.Update((step * 100) / total_steps, newmsg=message)
+    utils.file_dialog("Save .sav as ...", "*.sav", wx.SAVE, ok_handler)
 
-        sav_obj.save(path, callback=progress_update_function)
+    if len(tasks) > 0:
+        return tasks[0]
 
-    utils.file_dialog("Save .sav as ...", "*.sav", wx.SAVE, ok_handler)
+    return None
+
+
+@perf.timed("event_handlers.save_sav_to")
+def save_sav_to(sav_obj, path):
+    progress_dlg = background.TaskProgressDialog(
+        "Saving %s" % (path), "Reticulating splines")
+
+    # Write to a temporary file next to the target and rename it into place
+    # once it's complete, so that a crash or a cancelled save never leaves a
+    # truncated .sav behind
+    def save(task):
+        temp_path = path + '.tmp'
+
+        try:
+            header_block = savwriter.save_sav(
+                sav_obj, temp_path, callback=task.report_progress)
+            task.check_cancelled()
+            utils.replace_file(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with open(path, 'rb') as fp:
+            return (header_block, fp.read())
+
+    def on_success(result):
+        (header_block, data) = result
+
+        # sav_obj is shared with the UI, so it's only switched over to the
+        # new file here on the UI thread, as sav_watch does with reloads
+        savwriter.adopt_saved_file(sav_obj, path, header_block, data)
+        sav_watch.resume()
+
+        channels.SAV_SAVED(None).publish(sav_obj)
+
+    def on_error(e):
+        sav_watch.resume()
+        utils.show_error_dialog(
+            "Failed to save '%s'" % (os.path.basename(path)), str(e), None)
 
+    # Our own save isn't a change to reload
+    sav_watch.suspend()
 
+    return background.BackgroundTask(
+        save, on_success=on_success, on_error=on_error,
+        on_cancel=sav_watch.resume, progress_dialog=progress_dlg).start()
+
+
+def selected_songs(projects_window):
+    return [model for model in
+            projects_window.sav_project_list.GetSelectedObjects()
+            if model.project is not None]
+
+
+def all_songs(projects_window):
+    return [model for model in projects_window.sav_project_list.GetObjects()
+            if model.project is not None]
+
+
+@perf.timed("event_handlers.save_song")
 def save_song(event, projects_window, main_window):
-    song_to_save = projects_window.sav_project_list.GetSelectedObject().project
-    save_song_dialog(song_to_save, "save_lsdsng", "lsdsng")
+    songs = selected_songs(projects_window)
 
+    if len(songs) == 1:
+        save_song_dialog(songs[0].project, "save_lsdsng", "lsdsng")
+    else:
+        export_songs(songs, "lsdsng", projects_window, main_window)
 
+
+@perf.timed("event_handlers.save_song_dialog")
 def save_song_dialog(song_to_save, method_name, song_format):
     def ok_handler(dlg, path):
         getattr(song_to_save, method_name)(path)
@@ -63,9 +162,78 @@ def save_song_dialog(song_to_save, method_name, song_format):
         ok_handler, default_file=readable_song_name + "." + song_format)
 
 
+@perf.timed("event_handlers.save_song_srm")
 def save_song_srm(event, projects_window, main_window):
-    song_to_save = projects_window.sav_project_list.GetSelectedObject().project
-    save_song_dialog(song_to_save, "save_srm", "srm")
+    songs = selected_songs(projects_window)
+
+    if len(songs) == 1:
+        save_song_dialog(songs[0].project, "save_srm", "srm")
+    else:
+        export_songs(songs, "srm", projects_window, main_window)
+
+
+@perf.timed("event_handlers.export_all_songs")
+def export_all_songs(event, projects_window, main_window):
+    export_songs(all_songs(projects_window), "lsdsng", projects_window,
+                 main_window)
+
+
+@perf.timed("event_handlers.export_all_songs_srm")
+def export_all_songs_srm(event, projects_window, main_window):
+    export_songs(all_songs(projects_window), "srm", projects_window,
+                 main_window)
+
+
+@perf.timed("event_handlers.export_songs")
+def export_songs(song_models, song_format, projects_window, main_window):
+    # Asks for a folder and writes every song in song_models into it.
+    # Returns the running export task, or None if the user backed out.
+    if len(song_models) == 0:
+        return None
+
+    dlg = wx.DirDialog(
+        projects_window,
+        "Choose a folder to export %d song(s) to" % (len(song_models)),
+        style=wx.DD_DEFAULT_STYLE)
+
+    try:
+        if dlg.ShowModal() != wx.ID_OK:
+            return None
+
+        directory = dlg.GetPath()
+    finally:
+        dlg.Destroy()
+
+    return export_songs_to(song_models, song_format, directory,
+                           main_window.get_sav(), projects_window)
+
+
+@perf.timed("event_handlers.export_songs_to")
+def export_songs_to(song_models, song_format, directory, sav_obj,
+                    projects_window):
+    songs = [(model.index, model.project) for model in song_models]
+
+    progress_dlg = background.TaskProgressDialog(
+        "Exporting %d song(s)" % (len(songs)), "Packing songs")
+
+    # Songs are packed up here, where they can be read safely, and
+    # compressed and written in worker processes
+    def export(task):
+        with savwriter.open_sav_data(sav_obj) as fp:
+            export_jobs = [
+                song_export.make_export_job(sav_obj, fp, index, project)
+                for (index, project) in songs]
+
+        return song_export.export_songs(
+            export_jobs, song_format, directory,
+            callback=task.report_progress)
+
+    def on_error(e):
+        utils.show_error_dialog(
+            "Export failed", str(e), projects_window)
+
+    return background.BackgroundTask(
+        export, on_error=on_error, progress_dialog=progress_dlg).start()
 
 
 def get_song_from_windows(projects_window, main_window, ignore_existing=False):
@@ -85,6 +253,7 @@ def get_song_from_windows(projects_window, main_window, ignore_existing=False):
     return (index, sav_obj)
 
 
+@perf.timed("event_handlers.add_song")
 def add_song(event, projects_window, main_window):
     index, sav_obj = get_song_from_windows(
         projects_window, main_window)
@@ -93,6 +262,8 @@ def add_song(event, projects_window, main_window):
         try:
             proj = load_lsdsng(path)
             sav_obj.projects[index] = proj
+            history.record(history.SlotEdit(
+                sav_obj, "Add Song", [(index, None, proj)]))
             channels.SONG_MODIFIED(index).publish(proj)
         except Exception, e:
             utils.show_error_dialog(
@@ -101,13 +272,34 @@ def add_song(event, projects_window, main_window):
 
     utils.file_dialog("Open .lsdsng", "*.lsdsng", wx.OPEN, ok_handler)
 
+@perf.timed("event_handlers.delete_song")
 def delete_song(event, projects_window, main_window):
-    index, sav_obj = get_song_from_windows(projects_window, main_window, ignore_existing=True)
+    songs = selected_songs(projects_window)
+    sav_obj = main_window.get_sav()
+
+    if len(songs) > 1:
+        confirm = wx.MessageDialog(
+            projects_window, "Delete %d songs?" % (len(songs)),
+            "Delete songs", wx.YES_NO | wx.ICON_QUESTION)
+
+        try:
+            if confirm.ShowModal() != wx.ID_YES:
+                return
+        finally:
+            confirm.Destroy()
 
-    sav_obj.projects[index] = None
-    channels.SONG_MODIFIED(index).publish(False)
+    # Recorded first, since songs that haven't been read from the .sav yet
+    # are read now so that they can be put back
+    history.record(history.SlotEdit(
+        sav_obj, "Delete %d Song(s)" % (len(songs)),
+        [(model.index, model.project, None) for model in songs]))
 
+    for model in songs:
+        sav_obj.projects[model.index] = None
+        channels.SONG_MODIFIED(model.index).publish(False)
 
+
+@perf.timed("event_handlers.add_srm")
 def add_srm(event, projects_window, main_window):
     index, sav_obj = get_song_from_windows(
         projects_window, main_window)
@@ -116,9 +308,186 @@ def add_srm(event, projects_window, main_window):
         try:
             proj = load_srm(path)
             sav_obj.projects[index] = proj
+            history.record(history.SlotEdit(
+                sav_obj, "Add Song", [(index, None, proj)]))
             channels.SONG_MODIFIED(index).publish(proj)
         except Exception, e:
             utils.show_error_dialog(
                 "can't load file", 'Error loading file: %s' % (e), None, e)
 
     utils.file_dialog("Open .srm", "*.srm", wx.OPEN, ok_handler)
+
+
+@perf.timed("event_handlers.import_songs")
+def import_songs(event, projects_window, main_window):
+    def ok_handler(dlg, path):
+        import_song_files(dlg.GetPaths(), projects_window, main_window)
+
+    utils.file_dialog(
+        "Import songs", "LSDj songs (*.lsdsng;*.srm)|*.lsdsng;*.srm",
+        wx.OPEN | wx.MULTIPLE, ok_handler)
+
+
+@perf.timed("event_handlers.import_song_files")
+def import_song_files(paths, projects_window, main_window):
+    # Fills the empty slots, in order, with the songs in paths (which may
+    # include folders of songs). Returns the running import task, or None if
+    # the songs can't be imported.
+    sav_obj = main_window.get_sav()
+
+    slot_projects = [model.project for model in
+                     projects_window.sav_project_list.GetObjects()]
+
+    # Don't bother reading anything if there obviously isn't room for it
+    try:
+        song_paths = song_import.find_song_files(paths)
+
+        if len(song_paths) == 0:
+            raise song_import.SongImportError("No .lsdsng or .srm files found")
+
+        song_import.check_slots(slot_projects, len(song_paths))
+    except song_import.SongImportError, e:
+        utils.show_error_dialog(
+            "Can't import songs", str(e), projects_window)
+        return None
+
+    progress_dlg = background.TaskProgressDialog(
+        "Importing songs", "Reading %d file(s)" % (len(song_paths)))
+
+    def read(task):
+        new_projects = song_import.read_song_files(
+            song_paths, callback=task.report_progress)
+
+        return song_import.plan_import(slot_projects, new_projects)
+
+    def on_success(assignments):
+        for (index, project) in assignments:
+            sav_obj.projects[index] = project
+
+        history.record(history.SlotEdit(
+            sav_obj, "Import %d Song(s)" % (len(assignments)),
+            [(index, None, project) for (index, project) in assignments]))
+
+        channels.SONGS_ADDED(None).publish(assignments)
+
+    def on_error(e):
+        utils.show_error_dialog(
+            "Can't import songs", str(e), projects_window)
+
+    return background.BackgroundTask(
+        read, on_success=on_success, on_error=on_error,
+        progress_dialog=progress_dlg).start()
+
+
+@perf.timed("event_handlers.find_duplicates")
+def find_duplicates(event, projects_window, main_window):
+    sav_obj = main_window.get_sav()
+
+    progress_dlg = background.TaskProgressDialog(
+        "Finding duplicates", "Scanning songs")
+
+    def on_success(content_index):
+        from DuplicatesWindow import DuplicatesWindow
+
+        dedup.set_current_index(content_index)
+        DuplicatesWindow(projects_window, content_index)
+
+    def on_error(e):
+        utils.show_error_dialog("Failed to find duplicates", str(e),
+                                projects_window)
+
+    background.BackgroundTask(
+        lambda task: dedup.build_content_index(sav_obj, task),
+        on_success=on_success, on_error=on_error,
+        progress_dialog=progress_dlg).start()
+
+
+def _show_diff(projects_window, title, song_diffs):
+    from DiffWindow import DiffWindow
+
+    DiffWindow(projects_window, title, song_diffs)
+
+
+def _on_compare_error(projects_window):
+    def on_error(e):
+        utils.show_error_dialog("Failed to compare songs", str(e),
+                                projects_window)
+
+    return on_error
+
+
+@perf.timed("event_handlers.compare_songs")
+def compare_songs(event, projects_window, main_window):
+    # Two selected songs are compared with each other; otherwise the whole
+    # .sav is compared with another one
+    songs = selected_songs(projects_window)
+
+    if len(songs) == 2:
+        compare_two_songs(songs[0], songs[1], main_window.get_sav(),
+                          projects_window)
+        return
+
+    def ok_handler(dlg, path):
+        compare_sav_with(path, projects_window, main_window)
+
+    utils.file_dialog("Choose a .sav file to compare with", '*.sav',
+                      wx.OPEN, ok_handler)
+
+
+@perf.timed("event_handlers.compare_two_songs")
+def compare_two_songs(model_a, model_b, sav_obj, projects_window):
+    title = "%s vs. %s" % (
+        pylsdjutils.name_without_zeroes(model_a.project.name),
+        pylsdjutils.name_without_zeroes(model_b.project.name))
+
+    def compare(task):
+        with savwriter.open_sav_data(sav_obj) as fp:
+            job_a = song_export.make_export_job(
+                sav_obj, fp, model_a.index, model_a.project)
+            job_b = song_export.make_export_job(
+                sav_obj, fp, model_b.index, model_b.project)
+
+        diff = song_diff.diff_jobs(job_a, job_b)
+
+        if diff is None:
+            return []
+
+        return [diff]
+
+    progress_dlg = background.TaskProgressDialog(
+        "Comparing songs", "Comparing %s" % (title))
+
+    return background.BackgroundTask(
+        compare,
+        on_success=lambda song_diffs: _show_diff(
+            projects_window, title, song_diffs),
+        on_error=_on_compare_error(projects_window),
+        progress_dialog=progress_dlg).start()
+
+
+@perf.timed("event_handlers.compare_sav_with")
+def compare_sav_with(path, projects_window, main_window):
+    sav_obj = main_window.get_sav()
+    songs = [model.project for model in
+             projects_window.sav_project_list.GetObjects()]
+
+    title = "%s vs. %s" % (os.path.basename(sav_obj.projects.filename),
+                           os.path.basename(path))
+
+    def compare(task):
+        other_sav_obj = savwriter.load_sav(path)
+        other_songs = [project for (index, project) in
+                       lazy_project_list(other_sav_obj)]
+
+        return song_diff.diff_savs(sav_obj, songs, other_sav_obj,
+                                   other_songs, task)
+
+    progress_dlg = background.TaskProgressDialog(
+        "Comparing .sav files", "Reading %s" % (os.path.basename(path)))
+
+    return background.BackgroundTask(
+        compare,
+        on_success=lambda song_diffs: _show_diff(
+            projects_window, title, song_diffs),
+        on_error=_on_compare_error(projects_window),
+        progress_dialog=progress_dlg).start()
@@ -0,0 +1,389 @@
+import collections
+import sys
+
+import bread
+import wx
+import pylsdj.bread_spec as spec
+from pylsdj.consts import RAW_DATA_SIZE
+from pylsdj.project import Project
+
+import channels
+from LazyProject import LazyProject
+
+# Oldest edits are forgotten beyond this many, so that the history's memory
+# use stays bounded however long the session runs
+MAX_HISTORY = 1000
+
+
+def _section_parts(song_data, kind, index):
+    # The parsed parts of a song that make up each kind of section, as
+    # (part, item) pairs. item is None if the whole part belongs to the
+    # section, and otherwise the index of the section's item in an array of
+    # strings, whose items aren't parsed objects of their own.
+    if kind == "instrument":
+        return [(song_data.instruments[index], None),
+                (song_data.instrument_names, index)]
+    elif kind == "table":
+        parts = [song_data.table_envelopes[index],
+                 song_data.table_transposes[index],
+                 song_data.table_cmd1.fx[index],
+                 song_data.table_cmd1.val[index],
+                 song_data.table_cmd2.fx[index],
+                 song_data.table_cmd2.val[index]]
+    elif kind == "synth":
+        parts = [song_data.softsynth_params[index],
+                 song_data.wave_frames[index]]
+    elif kind == "alloc":
+        parts = [song_data.instr_alloc_table, song_data.table_alloc_table,
+                 song_data.wave_synth_overwrite_locks]
+    else:
+        raise ValueError("Unknown section kind '%s'" % (kind))
+
+    return [(part, None) for part in parts]
+
+
+def _section_ranges(song_data, kind, index):
+    # The (bit offset, bit length) of each part of a section
+    ranges = []
+
+    for (part, item) in _section_parts(song_data, kind, index):
+        if item is None:
+            ranges.append((part._offset, part._length))
+        else:
+            item_length = part._length // len(part)
+            ranges.append((part._offset + item * item_length, item_length))
+
+    return ranges
+
+
+def _flush_section(song_data, kind, index):
+    # Bread caches every value it has decoded, so after a section's bits are
+    # overwritten its parts would go on returning the old values. Setting a
+    # part's offset (even to what it already is) throws its cache away.
+    for (part, item) in _section_parts(song_data, kind, index):
+        part._offset = part._offset
+
+
+def instrument_sections(index):
+    return [("instrument", index)]
+
+
+def instrument_import_sections(index):
+    # Importing an instrument can allocate it, and allocate and fill a table
+    # and overwrite a synth
+    return ([("instrument", index), ("alloc", None)] +
+            [("table", i) for i in xrange(spec.NUM_TABLES)] +
+            [("synth", i) for i in xrange(spec.NUM_SYNTHS)])
+
+
+class SongEdit(object):
+    """
+    An edit to one song. Created just before the edit with the sections it
+    might touch, which are snapshotted; finish() is called just after it,
+    and keeps before-and-after copies of only the sections that changed.
+    """
+
+    def __init__(self, project, slot, description, sections):
+        self.project = project
+        self.slot = slot
+        self.description = description
+
+        song_data = project.song.song_data
+        bits = song_data._data_bits
+
+        self._before = []
+
+        for (kind, index) in sections:
+            for (offset, length) in _section_ranges(song_data, kind, index):
+                self._before.append(
+                    (kind, index, offset, bits[offset:offset + length]))
+
+        # (kind, index, bit offset, bits before, bits after)
+        self.deltas = []
+
+    def finish(self):
+        bits = self.project.song.song_data._data_bits
+
+        for (kind, index, offset, before) in self._before:
+            after = bits[offset:offset + len(before)]
+
+            if after != before:
+                self.deltas.append((kind, index, offset, before, after))
+
+        self._before = None
+
+        return len(self.deltas) > 0
+
+    def _apply(self, use_after):
+        song = self.project.song
+        bits = song.song_data._data_bits
+
+        sections = set((kind, index) for (kind, index, offset, before, after)
+                       in self.deltas)
+
+        for (kind, index, offset, before, after) in self.deltas:
+            bits.overwrite(after if use_after else before, offset)
+
+        for (kind, index) in sections:
+            _flush_section(song.song_data, kind, index)
+
+        # The song keeps an accessor object for each instrument that's
+        # specific to the instrument's type, which may have just changed
+        instruments = song.instruments
+
+        for index in set(index for (kind, index, offset, before, after)
+                         in self.deltas if kind == "instrument"):
+            instr_type = song.song_data.instruments[index].instrument_type
+            instruments._set_instrument_type(index, instr_type)
+
+        _sections_changed(self.project, sections)
+
+        channels.SONG_MODIFIED(self.slot).publish(self.project)
+
+    def undo(self):
+        self._apply(False)
+
+    def redo(self):
+        self._apply(True)
+
+    def touches(self, slots):
+        return self.slot in slots
+
+
+class SlotEdit(object):
+    """
+    Replaces the song in one or more slots of a .sav. The songs on either
+    side are kept by reference rather than copied.
+    """
+
+    def __init__(self, sav_obj, description, changes):
+        # changes is a list of (slot, project before, project after)
+        self.sav_obj = sav_obj
+        self.description = description
+        self.changes = [(slot, _resolve(before), _resolve(after))
+                        for (slot, before, after) in changes]
+
+    def finish(self):
+        return len(self.changes) > 0
+
+    def _apply(self, use_after):
+        for (slot, before, after) in self.changes:
+            project = after if use_after else before
+
+            self.sav_obj.projects[slot] = project
+
+            if project is None:
+                channels.SONG_MODIFIED(slot).publish(False)
+            else:
+                channels.SONG_MODIFIED(slot).publish(project)
+
+    def undo(self):
+        self._apply(False)
+
+    def redo(self):
+        self._apply(True)
+
+    def touches(self, slots):
+        return any(slot in slots for (slot, before, after) in self.changes)
+
+
+def _resolve(project):
+    # A song that hasn't been read from the .sav yet has to be read now,
+    # while its blocks are still where the header says they are
+    if isinstance(project, LazyProject):
+        return project.project
+
+    return project
+
+
+_undo_stack = collections.deque(maxlen=MAX_HISTORY)
+_redo_stack = []
+
+# id(project) -> sections changed by undo/redo since listeners last ran
+_changed_sections = {}
+
+
+def _sections_changed(project, sections):
+    # Publishes are coalesced, so several undos in one turn of the event
+    # loop reach listeners as one message; the sections they changed are
+    # collected here for listeners to pick up with changed_sections()
+    key = id(project)
+
+    if key in _changed_sections:
+        _changed_sections[key].update(sections)
+    else:
+        _changed_sections[key] = set(sections)
+
+    channels.SECTIONS_CHANGED(project).publish(project)
+
+    wx.CallAfter(_changed_sections.pop, key, None)
+
+
+def changed_sections(project):
+    return _changed_sections.get(id(project), set())
+
+
+def record(edit):
+    """
+    Adds a finished edit to the history, if it changed anything, and
+    forgets anything that was undone
+    """
+    if not edit.finish():
+        return False
+
+    _undo_stack.append(edit)
+    del _redo_stack[:]
+
+    return True
+
+
+def undo(event=None):
+    if len(_undo_stack) == 0:
+        return None
+
+    edit = _undo_stack.pop()
+    edit.undo()
+    _redo_stack.append(edit)
+
+    return edit.description
+
+
+def redo(event=None):
+    if len(_redo_stack) == 0:
+        return None
+
+    edit = _redo_stack.pop()
+    edit.redo()
+    _undo_stack.append(edit)
+
+    return edit.description
+
+
+def undo_description():
+    if len(_undo_stack) == 0:
+        return None
+
+    return _undo_stack[-1].description
+
+
+def redo_description():
+    if len(_redo_stack) == 0:
+        return None
+
+    return _redo_stack[-1].description
+
+
+def clear():
+    _undo_stack.clear()
+    del _redo_stack[:]
+    _changed_sections.clear()
+
+
+def forget_slots(slots):
+    """
+    Drops every edit to the given slots, for when the songs in them have
+    been replaced by something other than an edit (e.g. reloaded from disk)
+    and undoing or redoing would bring back the songs they replaced
+    """
+    slots = set(slots)
+
+    kept = [edit for edit in _undo_stack if not edit.touches(slots)]
+    _undo_stack.clear()
+    _undo_stack.extend(kept)
+
+    _redo_stack[:] = [edit for edit in _redo_stack
+                      if not edit.touches(slots)]
+
+
+def _check_project():
+    # A blank song with one instrument allocated
+    song_data = bread.parse(bytearray(RAW_DATA_SIZE), spec.song)
+
+    song_data.mem_init_flag_1 = 'rb'
+    song_data.mem_init_flag_2 = 'rb'
+    song_data.mem_init_flag_3 = 'rb'
+    song_data.instr_alloc_table[0] = 1
+    song_data.instrument_names[0] = "OLD"
+
+    return Project("CHECK", 0, 1, bread.write(song_data, spec.song))
+
+
+def check():
+    """
+    Checks that renaming an instrument and changing a table step can be
+    recorded, undone and redone, and that the song reads back the right
+    values afterwards. Returns a description of everything that's wrong.
+    """
+    project = _check_project()
+    instrument = project.song.instruments[0]
+    original_bits = project.song.song_data._data_bits[:]
+
+    problems = []
+
+    edit = SongEdit(project, 0, "Rename Instrument 00",
+                    instrument_sections(0))
+    instrument.name = "NEW"
+
+    if not record(edit):
+        problems.append("rename: no change recorded")
+
+    renamed_bits = project.song.song_data._data_bits[:]
+
+    undo()
+
+    if not instrument.name.startswith("OLD"):
+        problems.append("undo: expected name OLD, found %r" % (
+            instrument.name))
+
+    if project.song.song_data._data_bits != original_bits:
+        problems.append("undo: song doesn't match the original")
+
+    redo()
+
+    if not instrument.name.startswith("NEW"):
+        problems.append("redo: expected name NEW, found %r" % (
+            instrument.name))
+
+    if project.song.song_data._data_bits != renamed_bits:
+        problems.append("redo: song doesn't match the renamed one")
+
+    song_data = project.song.song_data
+
+    edit = SongEdit(project, 0, "Edit Table 00", [("table", 0)])
+    song_data.table_transposes[0][0] = 5
+    record(edit)
+
+    undo()
+
+    if song_data.table_transposes[0][0] != 0:
+        problems.append("undo: expected table step 0, found %r" % (
+            song_data.table_transposes[0][0]))
+
+    redo()
+
+    if song_data.table_transposes[0][0] != 5:
+        problems.append("redo: expected table step 5, found %r" % (
+            song_data.table_transposes[0][0]))
+
+    clear()
+
+    return problems
+
+
+def main(argv):
+    # Undo and redo publish their changes, which needs an app
+    app = wx.App(False)
+
+    problems = check()
+
+    for problem in problems:
+        sys.stderr.write("FAIL: %s\n" % (problem))
+
+    if len(problems) == 0:
+        print("history: all checks passed")
+
+    return 1 if len(problems) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+# A persistent index of the songs in every .sav and .lsdsng file under a set
+# of directories, kept in SQLite so that it survives between runs. Like
+# batch_extract, this imports nothing from wx so that it can be used from the
+# command line.
+
+import argparse
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+import traceback
+
+from pylsdj.savfile import SAVFile
+from pylsdj.project import load_lsdsng
+from pylsdj import utils as pylsdjutils
+
+import dirs
+from LazyProject import lazy_project_list
+
+DEFAULT_DB_PATH = os.path.join(dirs.DATA_DIR, "library.db")
+
+LIBRARY_EXTENSIONS = ['.sav', '.lsdsng']
+
+# Commit scan results every so often, so that an interrupted rescan doesn't
+# lose everything it's done
+COMMIT_INTERVAL = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS songs (
+    file_path TEXT NOT NULL REFERENCES files(path),
+    slot INTEGER,
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    size_blks INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS songs_by_file ON songs (file_path);
+CREATE INDEX IF NOT EXISTS songs_by_name ON songs (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS songs_by_hash ON songs (content_hash);
+"""
+
+SONG_COLUMNS = "file_path, slot, name, version, size_blks, content_hash"
+
+# slot is None for songs that came from a .lsdsng file
+LibrarySong = collections.namedtuple("LibrarySong", SONG_COLUMNS)
+
+RescanResult = collections.namedtuple(
+    "RescanResult", "scanned unchanged removed failed songs")
+
+
+def find_library_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield os.path.abspath(path)
+            continue
+
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in LIBRARY_EXTENSIONS:
+                    yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def content_hash(project):
+    # Hash the decompressed song rather than the compressed blocks, so that
+    # the same song hashes the same whether it came from a .sav or a .lsdsng
+    return hashlib.sha1(bytearray(project._raw_bytes)).hexdigest()
+
+
+def scan_file(path):
+    # Runs in a worker process. Returns the file's songs as tuples ready to
+    # be inserted into the songs table.
+    songs = []
+
+    try:
+        if path.lower().endswith('.lsdsng'):
+            project = load_lsdsng(path)
+
+            songs.append((
+                path, None, pylsdjutils.name_without_zeroes(project.name),
+                project.version, project.size_blks, content_hash(project)))
+        else:
+            sav_obj = SAVFile(path)
+
+            for (index, project) in lazy_project_list(sav_obj):
+                if project is None:
+                    continue
+
+                songs.append((
+                    path, index, pylsdjutils.name_without_zeroes(project.name),
+                    project.version, project.size_blks,
+                    content_hash(project.project)))
+    except Exception:
+        return (path, [], traceback.format_exc())
+
+    return (path, songs, None)
+
+
+class Library(object):
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        db_dir = os.path.dirname(db_path)
+
+        if len(db_dir) > 0 and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def roots(self):
+        return [row[0] for row in
+                self.db.execute("SELECT path FROM roots ORDER BY path")]
+
+    def add_root(self, path):
+        self.db.execute("INSERT OR IGNORE INTO roots (path) VALUES (?)",
+                        (os.path.abspath(path),))
+        self.db.commit()
+
+    def remove_root(self, path):
+        self.db.execute("DELETE FROM roots WHERE path = ?",
+                        (os.path.abspath(path),))
+        self.db.commit()
+
+    def _file_signatures(self):
+        return dict((path, (mtime, size)) for (path, mtime, size) in
+                    self.db.execute("SELECT path, mtime, size FROM files"))
+
+    def _forget_file(self, path):
+        self.db.execute("DELETE FROM songs WHERE file_path = ?", (path,))
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def rescan(self, paths=None, jobs=None, callback=None):
+        """
+        Re-reads every file under paths (by default, every root) whose mtime
+        or size has changed since it was last scanned, and forgets files that
+        have disappeared. callback is called as callback(message, step,
+        total_steps, still_working), the same as pylsdj's progress callbacks.
+        """
+        if paths is None:
+            paths = self.roots()
+
+        if callback is None:
+            callback = lambda message, step, total_steps, still_working: None
+
+        callback("Looking for files", 0, 1, True)
+
+        signatures = self._file_signatures()
+
+        found = set()
+        stale = []
+
+        for path in find_library_files(paths):
+            found.add(path)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            if signatures.get(path) != (stat.st_mtime, stat.st_size):
+                stale.append((path, stat.st_mtime, stat.st_size))
+
+        # Only forget files that were under the paths being scanned, so that
+        # rescanning one root doesn't throw away another
+        scanned_roots = [os.path.abspath(path) for path in paths]
+        removed = 0
+
+        for path in signatures:
+            under_scanned_root = any(
+                path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+                for root in scanned_roots)
+
+            if under_scanned_root and path not in found:
+                self._forget_file(path)
+                removed += 1
+
+        file_stats = dict((path, (mtime, size))
+                          for (path, mtime, size) in stale)
+
+        failed = 0
+        songs_found = 0
+
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+
+        pool = None
+
+        if jobs > 1 and len(stale) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(stale)))
+            results = pool.imap_unordered(
+                scan_file, [path for (path, mtime, size) in stale])
+        else:
+            results = itertools.imap(
+                scan_file, [path for (path, mtime, size) in stale])
+
+        try:
+            for (step, (path, songs, error)) in enumerate(results):
+                callback("Scanned %s" % (os.path.basename(path)), step,
+                         len(stale), True)
+
+                (mtime, size) = file_stats[path]
+
+                self._forget_file(path)
+                self.db.execute(
+                    "INSERT INTO files (path, mtime, size, error) "
+                    "VALUES (?, ?, ?, ?)", (path, mtime, size, error))
+                self.db.executemany(
+                    "INSERT INTO songs (%s) VALUES (?, ?, ?, ?, ?, ?)" % (
+                        SONG_COLUMNS), songs)
+
+                if error is not None:
+                    failed += 1
+
+                songs_found += len(songs)
+
+                if (step + 1) % COMMIT_INTERVAL == 0:
+                    self.db.commit()
+
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+
+            self.db.commit()
+
+        return RescanResult(scanned=len(stale),
+                            unchanged=len(found) - len(stale),
+                            removed=removed, failed=failed,
+                            songs=songs_found)
+
+    def _songs(self, query, args=()):
+        return [LibrarySong(*row) for row in self.db.execute(query, args)]
+
+    def all_songs(self):
+        return self._songs(
+            "SELECT %s FROM songs ORDER BY name COLLATE NOCASE, file_path, "
+            "slot" % (SONG_COLUMNS))
+
+    def find_songs(self, name):
+        # Case-insensitive substring match on the song's name
+        pattern = "%" + name.replace("\\", "\\\\").replace(
+            "%", "\\%").replace("_", "\\_") + "%"
+
+        return self._songs(
+            "SELECT %s FROM songs WHERE name LIKE ? ESCAPE '\\' "
+            "ORDER BY name COLLATE NOCASE, file_path, slot" % (SONG_COLUMNS),
+            (pattern,))
+
+    def find_by_hash(self, digest):
+        return self._songs(
+            "SELECT %s FROM songs WHERE content_hash = ? "
+            "ORDER BY file_path, slot" % (SONG_COLUMNS), (digest,))
+
+    def duplicates(self):
+        # Songs whose contents appear more than once, grouped by contents
+        return self._songs(
+            "SELECT %s FROM songs WHERE content_hash IN "
+            "(SELECT content_hash FROM songs GROUP BY content_hash "
+            "HAVING COUNT(*) > 1) "
+            "ORDER BY content_hash, file_path, slot" % (SONG_COLUMNS))
+
+    def failed_files(self):
+        return list(self.db.execute(
+            "SELECT path, error FROM files WHERE error IS NOT NULL "
+            "ORDER BY path"))
+
+
+def format_song(song):
+    if song.slot is None:
+        location = song.file_path
+    else:
+        location = "%s (song %02d)" % (song.file_path, song.slot + 1)
+
+    return "%-8s v%02x %3d blk  %s" % (
+        song.name, song.version, song.size_blks, location)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Maintain an index of the songs in every .sav and "
+        ".lsdsng file under a set of directories")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH,
+                        help="library database (default: %(default)s)")
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    scan_parser = subparsers.add_parser(
+        "scan", help="add directories to the library and rescan it")
+    scan_parser.add_argument("paths", nargs="*",
+                             help="directories to add to the library")
+    scan_parser.add_argument("-j", "--jobs", type=int,
+                             default=multiprocessing.cpu_count(),
+                             help="number of worker processes (default: one "
+                             "per core)")
+
+    find_parser = subparsers.add_parser(
+        "find", help="list songs whose names contain NAME")
+    find_parser.add_argument("name")
+
+    subparsers.add_parser("dupes",
+                          help="list songs that appear more than once")
+
+    args = parser.parse_args(argv)
+
+    library = Library(args.db)
+
+    try:
+        if args.command == "scan":
+            for path in args.paths:
+                library.add_root(path)
+
+            if len(library.roots()) == 0:
+                print("No directories in the library; give one to scan")
+                return 1
+
+            start_time = time.time()
+            result = library.rescan(jobs=max(args.jobs, 1))
+
+            for (path, error) in library.failed_files():
+                sys.stderr.write("Failed to scan '%s':\n%s\n" % (path, error))
+
+            print("Scanned %d file(s) (%d unchanged, %d removed, %d failed), "
+                  "found %d song(s) in %.2fs" % (
+                      result.scanned, result.unchanged, result.removed,
+                      result.failed, result.songs, time.time() - start_time))
+        elif args.command == "find":
+            for song in library.find_songs(args.name):
+                print(format_song(song))
+        elif args.command == "dupes":
+            last_hash = None
+
+            for song in library.duplicates():
+                if last_hash is not None and song.content_hash != last_hash:
+                    print("")
+
+                print(format_song(song))
+                last_hash = song.content_hash
+    finally:
+        library.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+import bisect
+import collections
+import functools
+import json
+import os
+import time
+import timeit
+
+import dirs
+
+# Upper bounds (in seconds) of the buckets that latencies are sorted into.
+# Anything slower than the last bound goes into one final overflow bucket.
+BUCKET_BOUNDS = [
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0
+]
+
+# Best available clock for measuring short intervals on each platform
+clock = timeit.default_timer
+
+
+class Histogram(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def record(self, elapsed):
+        # Called on every hot-path call, so it does as little as it can. It
+        # isn't locked; the occasional lost count from a worker thread
+        # doesn't matter.
+        self.count += 1
+        self.total += elapsed
+
+        if elapsed > self.max:
+            self.max = elapsed
+
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, elapsed)] += 1
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+
+        return self.total / self.count
+
+    def percentile(self, fraction):
+        # The upper bound of the bucket the given fraction of calls fall
+        # within, so it's an overestimate by at most one bucket
+        if self.count == 0:
+            return 0.0
+
+        threshold = fraction * self.count
+        seen = 0
+
+        for (i, bucket_count) in enumerate(self.buckets):
+            seen += bucket_count
+
+            if seen >= threshold:
+                if i < len(BUCKET_BOUNDS):
+                    return min(BUCKET_BOUNDS[i], self.max)
+
+                return self.max
+
+        return self.max
+
+    def as_dict(self):
+        return collections.OrderedDict([
+            ("count", self.count),
+            ("total", self.total),
+            ("mean", self.mean),
+            ("max", self.max),
+            ("p50", self.percentile(0.5)),
+            ("p95", self.percentile(0.95)),
+            ("buckets", self.buckets)
+        ])
+
+
+_histograms = {}
+
+
+def histogram(name):
+    if name not in _histograms:
+        _histograms[name] = Histogram(name)
+
+    return _histograms[name]
+
+
+def get_histograms():
+    return [_histograms[name] for name in sorted(_histograms.keys())]
+
+
+def reset():
+    # Histograms are cleared rather than thrown away, since the hot paths
+    # hold on to theirs
+    for h in _histograms.values():
+        h.clear()
+
+
+def timed(name):
+    """
+    Decorator that records how long each call to the decorated function
+    takes under the given name
+    """
+    def decorator(function):
+        function_histogram = histogram(name)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                function_histogram.record(clock() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def as_dict():
+    return collections.OrderedDict([
+        ("created", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("bucket_bounds", BUCKET_BOUNDS),
+        ("timings", collections.OrderedDict(
+            (h.name, h.as_dict()) for h in get_histograms()))
+    ])
+
+
+def export_json(directory=dirs.LOG_DIR):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, "performance-%s.json" % (
+        time.strftime("%Y%m%d-%H%M%S")))
+
+    with open(path, 'w') as fp:
+        json.dump(as_dict(), fp, indent=2)
+
+    return path
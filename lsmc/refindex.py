@@ -0,0 +1,222 @@
+import collections
+
+import pylsdj.bread_spec as spec
+
+import channels
+import history
+
+# Marks an unused chain, phrase or instrument slot in a reference list
+NO_REFERENCE = 0xff
+
+# Channels in a row of the song's sequence
+SEQUENCE_CHANNELS = ["pu1", "pu2", "wav", "noi"]
+
+# Phrase and table command that runs a table
+TABLE_COMMAND = "A"
+
+KIND_ABBREVIATIONS = {
+    "row": "S",
+    "chain": "C",
+    "phrase": "P",
+    "instrument": "I",
+    "table": "T"
+}
+
+# Show at most this many users of a thing before summarizing the rest
+MAX_FORMATTED_USERS = 4
+
+
+def format_users(users):
+    if len(users) == 0:
+        return "--"
+
+    by_kind = collections.OrderedDict()
+
+    for (kind, index) in users:
+        by_kind.setdefault(kind, []).append(index)
+
+    parts = []
+
+    for (kind, indices) in by_kind.items():
+        indices_str = ",".join("%02x" % (i) for i in
+                               indices[:MAX_FORMATTED_USERS])
+
+        if len(indices) > MAX_FORMATTED_USERS:
+            indices_str += "...(+%d)" % (len(indices) - MAX_FORMATTED_USERS)
+
+        parts.append("%s:%s" % (KIND_ABBREVIATIONS[kind], indices_str))
+
+    return " ".join(parts)
+
+
+class ReferenceIndex(object):
+    """
+    Tracks what refers to what within a song (song rows -> chains -> phrases
+    -> instruments -> tables and synths), in both directions, so that "what
+    uses table 0a?" is a lookup instead of a scan. Everything is keyed on
+    (kind, index) pairs. The index is built the first time it's queried and
+    updated piecemeal as instruments are imported.
+    """
+
+    def __init__(self, project):
+        self.project = project
+
+        self._built = False
+
+        # (kind, index) -> set of (kind, index) it refers to, and back again
+        self._refs = {}
+        self._users = collections.defaultdict(set)
+
+        self.references_changed_channel = channels.REFERENCES_CHANGED(project)
+
+        channels.INSTR_IMPORT(project).subscribe(self.handle_instr_imported)
+        channels.SECTIONS_CHANGED(project).subscribe(
+            self.handle_sections_changed)
+
+    def _set_refs(self, source, targets):
+        for target in self._refs.get(source, ()):
+            self._users[target].discard(source)
+
+        self._refs[source] = targets
+
+        for target in targets:
+            self._users[target].add(source)
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def rebuild(self):
+        song_data = self.project.song.song_data
+
+        self._refs = {}
+        self._users = collections.defaultdict(set)
+
+        for (row_index, row) in enumerate(song_data.song):
+            targets = set()
+
+            for channel in SEQUENCE_CHANNELS:
+                chain_index = getattr(row, channel)
+
+                # NO_REFERENCE, and anything else past the last chain, refers
+                # to nothing
+                if (chain_index < spec.NUM_CHAINS and
+                        song_data.chain_alloc_table[chain_index]):
+                    targets.add(("chain", chain_index))
+
+            if len(targets) > 0:
+                self._set_refs(("row", row_index), targets)
+
+        for chain_index in xrange(spec.NUM_CHAINS):
+            self.update_chain(chain_index)
+
+        for phrase_index in xrange(spec.NUM_PHRASES):
+            self.update_phrase(phrase_index)
+
+        for instrument_index in xrange(spec.NUM_INSTRUMENTS):
+            self.update_instrument(instrument_index)
+
+        for table_index in xrange(spec.NUM_TABLES):
+            self.update_table(table_index)
+
+        self._built = True
+
+    def update_chain(self, index):
+        song_data = self.project.song.song_data
+        targets = set()
+
+        if song_data.chain_alloc_table[index]:
+            for phrase_index in song_data.chain_phrases[index]:
+                if (phrase_index < spec.NUM_PHRASES and
+                        song_data.phrase_alloc_table[phrase_index]):
+                    targets.add(("phrase", phrase_index))
+
+        self._set_refs(("chain", index), targets)
+
+    def update_phrase(self, index):
+        song_data = self.project.song.song_data
+        targets = set()
+
+        if song_data.phrase_alloc_table[index]:
+            for instrument_index in song_data.phrase_instruments[index]:
+                if (instrument_index < spec.NUM_INSTRUMENTS and
+                        song_data.instr_alloc_table[instrument_index]):
+                    targets.add(("instrument", instrument_index))
+
+            for (fx, value) in zip(song_data.phrase_fx[index],
+                                   song_data.phrase_fx_val[index]):
+                if fx == TABLE_COMMAND and value < spec.NUM_TABLES:
+                    targets.add(("table", value))
+
+        self._set_refs(("phrase", index), targets)
+
+    def update_instrument(self, index):
+        song_data = self.project.song.song_data
+        targets = set()
+
+        if song_data.instr_alloc_table[index]:
+            instrument_data = song_data.instruments[index]
+
+            if (getattr(instrument_data, "table_on", False) and
+                    instrument_data.table < spec.NUM_TABLES):
+                targets.add(("table", instrument_data.table))
+
+            if (instrument_data.instrument_type == "wave" and
+                    instrument_data.synth < spec.NUM_SYNTHS):
+                targets.add(("synth", instrument_data.synth))
+
+        self._set_refs(("instrument", index), targets)
+
+    def update_table(self, index):
+        song_data = self.project.song.song_data
+        targets = set()
+
+        if song_data.table_alloc_table[index]:
+            for table_command in (song_data.table_cmd1, song_data.table_cmd2):
+                for (fx, value) in zip(table_command.fx[index],
+                                       table_command.val[index]):
+                    if fx == TABLE_COMMAND and value < spec.NUM_TABLES:
+                        targets.add(("table", value))
+
+        self._set_refs(("table", index), targets)
+
+    def users_of(self, kind, index):
+        self._ensure_built()
+
+        return sorted(self._users.get((kind, index), ()))
+
+    def format_users_of(self, kind, index):
+        return format_users(self.users_of(kind, index))
+
+    def handle_instr_imported(self, data=None):
+        if data is None or not self._built:
+            return
+
+        instrument = data
+
+        self.update_instrument(instrument.index)
+
+        if instrument.table is not None:
+            self.update_table(instrument.table.index)
+
+        self.references_changed_channel.publish(instrument)
+
+    def handle_sections_changed(self, data=None):
+        if data is None or not self._built:
+            return
+
+        sections = history.changed_sections(self.project)
+
+        # Allocating or freeing anything can change what refers to what
+        if ("alloc", None) in sections:
+            sections = set(
+                [("instrument", i) for i in xrange(spec.NUM_INSTRUMENTS)] +
+                [("table", i) for i in xrange(spec.NUM_TABLES)])
+
+        for (kind, index) in sections:
+            if kind == "instrument":
+                self.update_instrument(index)
+            elif kind == "table":
+                self.update_table(index)
+
+        self.references_changed_channel.publish(self.project)
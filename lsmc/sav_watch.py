@@ -0,0 +1,437 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+import bread
+import wx
+from pylsdj import bread_spec
+from pylsdj import blockutils
+from pylsdj import filepack
+from pylsdj.blockutils import BlockReader
+from pylsdj.project import Project
+from pylsdj.savfile import SAVFile, NUM_FILES, BLOCKS_START_OFFSET
+
+import background
+import channels
+import history
+import savwriter
+
+# How often (in ms) the watched file's modification time and size are checked
+POLL_INTERVAL_MS = 1000
+
+
+class ReloadError(Exception):
+    pass
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_mtime, stat.st_size)
+
+
+def block_hashes(data):
+    # One digest for each block, starting with the header block
+    return [hashlib.sha1(data[offset:offset + blockutils.BLOCK_SIZE]).digest()
+            for offset in xrange(BLOCKS_START_OFFSET, len(data),
+                                 blockutils.BLOCK_SIZE)]
+
+
+def blocks_by_file(header_block):
+    # Block 0 is the header, so block numbers are off by one from positions
+    # in the block allocation table
+    file_blocks = [[] for i in xrange(NUM_FILES)]
+
+    for (block_number, file_number) in enumerate(
+            header_block.block_alloc_table):
+        if file_number < NUM_FILES:
+            file_blocks[file_number].append(block_number + 1)
+
+    return file_blocks
+
+
+def changed_slots(old_header, old_hashes, new_header, new_hashes):
+    """
+    Returns the indices of the songs that differ between two versions of a
+    .sav, judging by which blocks each song is in and what's in them
+    """
+    old_blocks = blocks_by_file(old_header)
+    new_blocks = blocks_by_file(new_header)
+
+    def block_changed(block_number):
+        return (block_number >= len(old_hashes) or
+                block_number >= len(new_hashes) or
+                old_hashes[block_number] != new_hashes[block_number])
+
+    changed = []
+
+    for index in xrange(NUM_FILES):
+        if (old_blocks[index] != new_blocks[index] or
+                old_header.filenames[index] != new_header.filenames[index] or
+                old_header.file_versions[index] !=
+                new_header.file_versions[index] or
+                any(block_changed(b) for b in new_blocks[index])):
+            changed.append(index)
+
+    return changed
+
+
+def read_header_block(data):
+    header_block = bread.parse(
+        bytearray(data[SAVFile.START_OFFSET:
+                       SAVFile.START_OFFSET + blockutils.BLOCK_SIZE]),
+        bread_spec.compressed_sav_file)
+
+    # The emulator may be part way through writing the file
+    if header_block.sram_init_check != 'jk':
+        raise ReloadError("SRAM init check bits incorrect")
+
+    return header_block
+
+
+def read_project(data, header_block, file_blocks, index):
+    if len(file_blocks) == 0:
+        return None
+
+    block_map = {}
+
+    for block_number in file_blocks:
+        offset = BLOCKS_START_OFFSET + block_number * blockutils.BLOCK_SIZE
+
+        block_map[block_number] = blockutils.Block(
+            block_number,
+            bytearray(data[offset:offset + blockutils.BLOCK_SIZE]))
+
+    raw_data = filepack.decompress(BlockReader().read(block_map))
+
+    return Project(header_block.filenames[index],
+                   header_block.file_versions[index], len(file_blocks),
+                   raw_data)
+
+
+class SavWatcher(object):
+    """
+    Polls the file a SAVFile was read from and, when something else writes
+    to it, reads only the songs whose blocks changed. Each changed song is
+    published on its SONG_MODIFIED channel.
+    """
+
+    def __init__(self, sav_obj, projects_window):
+        self.sav_obj = sav_obj
+        self.projects_window = projects_window
+
+        self.signature = None
+        self.hashes = None
+        self.header_block = None
+
+        # A change is only read once the file has stopped changing
+        self._pending_signature = None
+
+        self._suspended = 0
+        self._task = None
+
+        self.timer = wx.Timer(projects_window)
+        projects_window.Bind(wx.EVT_TIMER, self.poll, self.timer)
+
+    @property
+    def path(self):
+        return self.sav_obj.projects.filename
+
+    def start(self):
+        self.rebaseline()
+        self.timer.Start(POLL_INTERVAL_MS)
+
+        return self
+
+    def stop(self):
+        self.timer.Stop()
+
+        if self._task is not None:
+            self._task.cancel()
+
+    def rebaseline(self):
+        # Takes the file as it is now as the version the .sav matches
+        self._pending_signature = None
+
+        try:
+            with open(self.path, 'rb') as fp:
+                data = fp.read()
+
+            self.header_block = read_header_block(data)
+        except (IOError, OSError, ReloadError):
+            self.signature = None
+            self.hashes = None
+            self.header_block = None
+            return
+
+        self.signature = file_signature(self.path)
+        self.hashes = block_hashes(data)
+
+    def suspend(self):
+        self._suspended += 1
+
+    def resume(self):
+        self._suspended = max(self._suspended - 1, 0)
+
+        if self._suspended == 0:
+            self.rebaseline()
+
+    def poll(self, event=None):
+        if self._suspended > 0 or self._task is not None:
+            return
+
+        signature = file_signature(self.path)
+
+        if signature is None or signature == self.signature:
+            self._pending_signature = None
+            return
+
+        if signature != self._pending_signature:
+            self._pending_signature = signature
+            return
+
+        self.reload(signature)
+
+    def reload(self, signature):
+        path = self.path
+        old_header = self.header_block
+        old_hashes = self.hashes
+
+        def read(task):
+            with open(path, 'rb') as fp:
+                data = fp.read()
+
+            header_block = read_header_block(data)
+            hashes = block_hashes(data)
+
+            if old_header is None:
+                changed = range(NUM_FILES)
+            else:
+                changed = changed_slots(
+                    old_header, old_hashes, header_block, hashes)
+
+            file_blocks = blocks_by_file(header_block)
+
+            projects = []
+
+            for index in changed:
+                task.check_cancelled()
+                projects.append((index, read_project(
+                    data, header_block, file_blocks[index], index)))
+
+            return (data, header_block, hashes, projects)
+
+        def on_success(result):
+            self._task = None
+            (data, header_block, hashes, projects) = result
+
+            self.signature = signature
+            self.hashes = hashes
+            self.header_block = header_block
+            self._pending_signature = None
+
+            self.apply(data, header_block, projects)
+
+        def on_error(e):
+            # Most likely caught the file mid-write; try again once it
+            # settles
+            self._task = None
+            self._pending_signature = None
+
+        def on_cancel():
+            self._task = None
+
+        self._task = background.BackgroundTask(
+            read, on_success=on_success, on_error=on_error,
+            on_cancel=on_cancel).start()
+
+    def apply(self, data, header_block, projects):
+        sav_obj = self.sav_obj
+
+        # Songs with unsaved edits are kept as they are, rather than losing
+        # the edits to the file's version. Each song carries its own name
+        # and version, so it's still saved correctly into the new layout.
+        edited = self.projects_window.edited_songs()
+        projects = [(index, project) for (index, project) in projects
+                    if index not in edited]
+
+        # Songs that haven't been read yet are now read from the new layout
+        savwriter.adopt_saved_file(sav_obj, self.path, header_block, data)
+        sav_obj.active_project_number = header_block.active_file
+
+        # Undoing an edit to a reloaded song would put back the song it
+        # replaced, which is no longer the one in the .sav
+        history.forget_slots(index for (index, project) in projects)
+
+        for (index, project) in projects:
+            sav_obj.projects[index] = project
+
+            if project is None:
+                channels.SONG_MODIFIED(index).publish(False)
+            else:
+                channels.SONG_MODIFIED(index).publish(project)
+
+        if len(projects) > 0:
+            # Publishes are delivered on the next turn of the event loop, so
+            # flash the rows once they've been refreshed
+            wx.CallAfter(self.projects_window.flash_songs,
+                         [index for (index, project) in projects])
+
+
+_watcher = None
+
+
+def watch(sav_obj, projects_window):
+    global _watcher
+
+    stop()
+    _watcher = SavWatcher(sav_obj, projects_window).start()
+
+
+def stop():
+    global _watcher
+
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
+
+
+def suspend():
+    # Called around our own saves, so that they aren't mistaken for someone
+    # else changing the file
+    if _watcher is not None:
+        _watcher.suspend()
+
+
+def resume():
+    if _watcher is not None:
+        _watcher.resume()
+
+
+class _CheckWindow(wx.Frame):
+    # Stands in for the main window in the LSMC script, which can't be
+    # imported without starting the app
+
+    def __init__(self):
+        from ProjectsWindow import ProjectsWindow
+
+        wx.Frame.__init__(self, None, wx.ID_ANY, "Watch Check")
+
+        self.sav_obj = None
+
+        panel = wx.Panel(self)
+        self.songs_window = ProjectsWindow(panel)
+
+    def set_sav(self, sav_obj):
+        self.sav_obj = sav_obj
+        self.songs_window.handle_sav_loaded(sav_obj)
+
+    def clear_sav(self):
+        self.sav_obj = None
+        self.songs_window.handle_sav_cleared()
+
+    def get_sav(self):
+        return self.sav_obj
+
+    def update_models(self):
+        pass
+
+
+def _deliver_published():
+    # Publishes are delivered on the next turn of the event loop
+    wx.YieldIfNeeded()
+
+
+def check():
+    """
+    Checks that a song that's edited and then saved is reloaded when
+    something else writes to it afterwards. Returns a description of
+    everything that's wrong.
+    """
+    import benchmark
+    import event_handlers
+
+    work_dir = tempfile.mkdtemp()
+    path = os.path.join(work_dir, "check.sav")
+    main_window = _CheckWindow()
+    songs_window = main_window.songs_window
+
+    problems = []
+
+    try:
+        benchmark.make_fixture(path, benchmark.Fixture("check", 2, 1))
+        event_handlers.load_sav(path, songs_window, main_window).wait()
+
+        sav_obj = main_window.get_sav()
+        watch(sav_obj, songs_window)
+
+        # Edit, through the project the song list shows, as a song window
+        # would
+        project = songs_window.sav_project_list.GetObjects()[0].project
+        project.song.song_data.instrument_names[0] = "EDIT"
+        channels.SONG_MODIFIED(0).publish(project)
+        _deliver_published()
+
+        if songs_window.edited_songs() != set([0]):
+            problems.append("edit: expected song 0 edited, found %s" % (
+                sorted(songs_window.edited_songs())))
+
+        # Save
+        event_handlers.save_sav_to(sav_obj, path).wait()
+        _deliver_published()
+
+        if len(songs_window.edited_songs()) > 0:
+            problems.append("save: songs still marked edited: %s" % (
+                sorted(songs_window.edited_songs())))
+
+        # External write
+        other_sav_obj = savwriter.load_sav(path)
+        other_sav_obj.projects[0] = Project(
+            "EXTERNAL", 0, 1, benchmark.make_song(1000, 1))
+        savwriter.save_sav(other_sav_obj, path + '.tmp')
+        os.rename(path + '.tmp', path)
+
+        # Reload, without waiting for the file to be polled
+        _watcher.reload(file_signature(path))
+        _watcher._task.wait()
+        _deliver_published()
+
+        name = sav_obj.projects[0].name
+
+        if not name.startswith("EXTERNAL"):
+            problems.append("reload: expected song 0 EXTERNAL, found %r" % (
+                name))
+
+        if songs_window.sav_project_list.GetObjects()[0].project is not \
+                sav_obj.projects[0]:
+            problems.append("reload: song list doesn't show the reloaded "
+                            "song")
+    finally:
+        stop()
+        main_window.Destroy()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return problems
+
+
+def main(argv):
+    app = wx.App(False)
+
+    problems = check()
+
+    for problem in problems:
+        sys.stderr.write("FAIL: %s\n" % (problem))
+
+    if len(problems) == 0:
+        print("sav_watch: all checks passed")
+
+    return 1 if len(problems) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,343 @@
+import io
+import os
+
+import bread
+from pylsdj import bread_spec
+from pylsdj import blockutils
+from pylsdj import filepack
+from pylsdj.blockutils import BlockFactory, BlockReader, BlockWriter
+from pylsdj.savfile import (SAVFile, ProjectList, NUM_FILES,
+                            BLOCKS_START_OFFSET)
+
+# Value of an unused entry in the block allocation table
+EMPTY_BLOCK = 0xff
+
+# The block allocation table doesn't include the header block, which is
+# always in use
+NUM_BLOCKS = SAVFile.BAT_END_OFFSET - SAVFile.BAT_START_OFFSET + 2
+
+EMPTY_PROJECT_NAME = '\0' * SAVFile.FILENAME_LENGTH
+
+
+def _noop_callback(message, step, total_steps, still_working):
+    pass
+
+
+class SaveError(Exception):
+    pass
+
+
+class SnapshotProjectList(ProjectList):
+    """
+    A ProjectList that reads songs from a copy of the .sav's contents taken
+    when it was loaded (or last saved) rather than from the file itself,
+    which an emulator may have rewritten since. The copy always matches the
+    block allocation table that songs are looked up in.
+    """
+
+    def __init__(self, filename, header_block, data):
+        ProjectList.__init__(self, filename, header_block)
+        self.data = data
+
+    def open(self):
+        return io.BytesIO(self.data)
+
+    def __getitem__(self, file_number):
+        if file_number not in self._projects:
+            self._projects[file_number] = self._read_project(
+                self.open(), file_number)
+
+        return self._projects[file_number]
+
+
+def load_sav(filename, callback=_noop_callback):
+    """
+    Reads a .sav's header like SAVFile(filename) does, but keeps the file's
+    contents in memory so that songs read later come from the file as it was
+    when it was loaded
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+
+    sav_obj = SAVFile.__new__(SAVFile)
+    sav_obj.filename = filename
+    sav_obj._load(io.BytesIO(data), callback)
+    sav_obj.projects = SnapshotProjectList(
+        filename, sav_obj.header_block, data)
+
+    return sav_obj
+
+
+def open_sav_data(sav_obj):
+    """
+    Opens the data that sav_obj's unread songs are read from; pass the result
+    to read_compressed_project and friends
+    """
+    if isinstance(sav_obj.projects, SnapshotProjectList):
+        return sav_obj.projects.open()
+
+    return open(sav_obj.projects.filename, 'rb')
+
+
+def read_compressed_project(sav_obj, fp, index):
+    """
+    Returns the compressed byte stream for a song exactly as it's stored in
+    the .sav that sav_obj was read from (fp, as opened by open_sav_data), or
+    None if the slot is empty there
+    """
+    # Block 0 is the header, so block numbers are off by one from positions
+    # in the block allocation table
+    block_numbers = [
+        block_number + 1 for (block_number, file_number) in
+        enumerate(sav_obj.header_block.block_alloc_table)
+        if file_number == index]
+
+    if len(block_numbers) == 0:
+        return None
+
+    block_map = {}
+
+    for block_number in block_numbers:
+        fp.seek(BLOCKS_START_OFFSET + block_number * blockutils.BLOCK_SIZE,
+                os.SEEK_SET)
+
+        block_map[block_number] = blockutils.Block(
+            block_number, bytearray(fp.read(blockutils.BLOCK_SIZE)))
+
+    return BlockReader().read(block_map)
+
+
+def _compressed_project(sav_obj, fp, index):
+    # Returns (project name, version, compressed data, reused?) for the given
+    # slot, or None if the slot is empty
+    loaded_projects = sav_obj.projects._projects
+
+    if index not in loaded_projects:
+        # Nothing has ever looked at the song, so it can't have changed
+        compressed_data = read_compressed_project(sav_obj, fp, index)
+
+        if compressed_data is None:
+            return None
+
+        return (sav_obj.header_block.filenames[index],
+                sav_obj.header_block.file_versions[index],
+                compressed_data, True)
+
+    project = loaded_projects[index]
+
+    if project is None:
+        return None
+
+    # Songs are only ever edited through their parsed form, so one that's
+    # never been parsed is still exactly what was read
+    if project._song is None:
+        raw_data = project._raw_bytes
+    else:
+        raw_data = project.get_raw_data()
+
+    # The slot may hold a different song than the one on disk (e.g. one
+    # that's been imported from a .lsdsng) so compare contents rather than
+    # trusting that a song is the one that was read
+    compressed_data = read_compressed_project(sav_obj, fp, index)
+
+    if (compressed_data is not None and
+            list(filepack.decompress(compressed_data)) == list(raw_data)):
+        return (project.name, project.version, compressed_data, True)
+
+    return (project.name, project.version, filepack.compress(raw_data),
+            False)
+
+
+def verify_block_alloc_table(block_table, block_map):
+    """
+    Checks that every song's blocks form exactly one chain of block switches
+    that starts at the song's first block and ends in an EOF
+    """
+    blocks_by_file = {}
+
+    for (block_number, file_number) in enumerate(block_table):
+        if block_number == 0 or file_number is None:
+            continue
+
+        if file_number >= NUM_FILES:
+            raise SaveError("Block %d belongs to nonexistent song %d" % (
+                block_number, file_number))
+
+        blocks_by_file.setdefault(file_number, set()).add(block_number)
+
+    for (file_number, block_numbers) in blocks_by_file.items():
+        block_number = min(block_numbers)
+        visited = set()
+
+        while block_number is not None:
+            if block_number not in block_numbers:
+                raise SaveError(
+                    "Song %d's block switch points to block %d, which "
+                    "belongs to another song" % (file_number, block_number))
+
+            if block_number in visited:
+                raise SaveError("Song %d's blocks contain a loop" % (
+                    file_number))
+
+            visited.add(block_number)
+
+            block_number = _next_block(block_map[block_number].data)
+
+        if visited != block_numbers:
+            raise SaveError(
+                "Song %d has %d block(s) that aren't reachable" % (
+                    file_number, len(block_numbers - visited)))
+
+
+def _next_block(data):
+    # Returns the block a block switches to at its end, or None if it ends in
+    # an EOF
+    i = 0
+
+    while i < len(data) - 1:
+        current_byte = data[i]
+        next_byte = data[i + 1]
+
+        if current_byte == filepack.RLE_BYTE:
+            if next_byte == filepack.RLE_BYTE:
+                i += 2
+            else:
+                i += 3
+        elif current_byte == filepack.SPECIAL_BYTE:
+            if next_byte in filepack.SPECIAL_DEFAULTS:
+                i += 3
+            elif next_byte == filepack.SPECIAL_BYTE:
+                i += 2
+            elif next_byte == filepack.EOF_BYTE:
+                return None
+            else:
+                return next_byte
+        else:
+            i += 1
+
+    raise SaveError("Block ends without a block switch or EOF")
+
+
+def save_sav(sav_obj, filename, callback=_noop_callback):
+    """
+    Writes sav_obj to filename. Unlike SAVFile.save, songs whose contents
+    haven't changed since the .sav was read keep their compressed data from
+    the file on disk; only changed songs are recompressed.
+
+    sav_obj itself isn't changed. Returns the header block that was
+    written, which should be passed to adopt_saved_file once the saved file
+    is in place.
+    """
+    # Marshal 32 songs + verify + write
+    total_steps = NUM_FILES + 2
+
+    factory = BlockFactory()
+    writer = BlockWriter()
+
+    # The header block is always block 0
+    header = factory.new_block()
+
+    block_table = [None] * NUM_BLOCKS
+    block_table[0] = -1
+
+    # Work on a copy of the header, so that sav_obj still matches the file
+    # it was read from if the save fails part way through
+    header_block = bread.parse(
+        bread.write(sav_obj.header_block, bread_spec.compressed_sav_file),
+        bread_spec.compressed_sav_file)
+
+    reused = 0
+    recompressed = 0
+
+    with open_sav_data(sav_obj) as fp:
+        for index in xrange(NUM_FILES):
+            callback("Marshaling song %d of %d" % (index + 1, NUM_FILES),
+                     index, total_steps, True)
+
+            compressed_project = _compressed_project(sav_obj, fp, index)
+
+            if compressed_project is None:
+                header_block.filenames[index] = EMPTY_PROJECT_NAME
+                header_block.file_versions[index] = 0
+                continue
+
+            (name, version, compressed_data, was_reused) = compressed_project
+
+            if was_reused:
+                reused += 1
+            else:
+                recompressed += 1
+
+            header_block.filenames[index] = name
+            header_block.file_versions[index] = version
+
+            # Block switches hold absolute block numbers, so even a reused
+            # stream is re-split to point at the blocks it's moving to
+            try:
+                block_ids = writer.write(compressed_data, factory)
+            except AssertionError, e:
+                raise SaveError("Can't split song %d into blocks: %s" % (
+                    index + 1, e))
+
+            if factory.max_id > NUM_BLOCKS:
+                raise SaveError(
+                    "Songs don't fit in the .sav (%d blocks needed, %d "
+                    "available)" % (factory.max_id - 1, NUM_BLOCKS - 1))
+
+            for block_id in block_ids:
+                block_table[block_id] = index
+
+    callback("Verifying block allocation table", NUM_FILES, total_steps, True)
+
+    verify_block_alloc_table(block_table, factory.blocks)
+
+    header_block.active_file = sav_obj.active_project_number
+
+    for (i, file_number) in enumerate(block_table[1:]):
+        if file_number is None:
+            header_block.block_alloc_table[i] = EMPTY_BLOCK
+        else:
+            header_block.block_alloc_table[i] = file_number
+
+    header.data = bread.write(header_block, bread_spec.compressed_sav_file)
+
+    if len(header.data) != blockutils.BLOCK_SIZE:
+        raise SaveError(
+            "Header block isn't the expected length; expected 0x%x, got "
+            "0x%x" % (blockutils.BLOCK_SIZE, len(header.data)))
+
+    callback("Writing data to file (%d song(s) unchanged, %d recompressed)" % (
+        reused, recompressed), NUM_FILES + 1, total_steps, True)
+
+    empty_block_data = bytearray(blockutils.BLOCK_SIZE)
+
+    with open(filename, 'wb') as fp:
+        fp.write(sav_obj.preamble)
+
+        for block_number in xrange(NUM_BLOCKS):
+            if block_number in factory.blocks:
+                fp.write(bytearray(factory.blocks[block_number].data))
+            else:
+                fp.write(empty_block_data)
+
+    callback("Save complete!", total_steps, total_steps, True)
+
+    return header_block
+
+
+def adopt_saved_file(sav_obj, filename, header_block, data=None):
+    # Songs that haven't been read yet are read lazily from sav_obj's copy of
+    # its file using its block allocation table; once the save is in place,
+    # both need to refer to the file that was just written. data is that
+    # file's contents, if the caller already has them.
+    if isinstance(sav_obj.projects, SnapshotProjectList):
+        if data is None:
+            with open(filename, 'rb') as fp:
+                data = fp.read()
+
+        sav_obj.projects.data = data
+
+    sav_obj.filename = filename
+    sav_obj.header_block = header_block
+    sav_obj.projects.filename = filename
+    sav_obj.projects.header_block = header_block
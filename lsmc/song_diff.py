@@ -0,0 +1,675 @@
+import collections
+import hashlib
+import sys
+
+import bread
+import pylsdj.bread_spec as spec
+from bread.errors import BadConditionalCaseError
+from pylsdj import filepack
+from pylsdj import utils as pylsdjutils
+from pylsdj.consts import RAW_DATA_SIZE
+from pylsdj.savfile import NUM_FILES
+
+import perf
+import savwriter
+from song_export import ExportJob, make_export_job
+
+# As in refindex, which can't be imported without wx
+NO_REFERENCE = 0xff
+SEQUENCE_CHANNELS = ["pu1", "pu2", "wav", "noi"]
+
+# The sections of a song, in the order they're compared and reported.
+# "settings" is a single section holding every byte that isn't part of any
+# other section (tempo, clocks, words, bookmarks, unused bytes and so on), so
+# that no difference between two songs goes unreported.
+SECTION_KINDS = ["row", "chain", "phrase", "instrument", "table", "synth",
+                 "groove", "settings"]
+
+SECTION_COUNTS = {
+    "row": spec.NUM_SONG_CHAINS,
+    "chain": spec.NUM_CHAINS,
+    "phrase": spec.NUM_PHRASES,
+    "instrument": spec.NUM_INSTRUMENTS,
+    "table": spec.NUM_TABLES,
+    "synth": spec.NUM_SYNTHS,
+    "groove": spec.NUM_GROOVES,
+    "settings": 1
+}
+
+# Reported when two songs' data differs only in sections that neither song
+# uses
+UNUSED_KIND = "unused"
+
+# Kinds of which there's only one, and so aren't numbered when formatted
+SINGLE_SECTION_KINDS = ["settings", UNUSED_KIND]
+
+# Settings at most this many bytes long have their values shown
+MAX_SHOWN_SETTING_BYTES = 4
+
+# A section of one song that differs from the other song's. change is
+# "added", "removed" or "changed"; details says what changed in a changed
+# section, one line per difference.
+SectionDiff = collections.namedtuple(
+    "SectionDiff", "kind index change details")
+
+# Two songs that differ. index is the songs' slot when comparing .savs and
+# None otherwise; change is "added", "removed" or "changed"; details covers
+# the songs' names and versions.
+SongDiff = collections.namedtuple(
+    "SongDiff", "index name_a name_b change details sections")
+
+
+def _section_arrays(song_data, kind):
+    # The arrays in a parsed song that hold each kind of section, with one
+    # item of each array per section
+    if kind == "row":
+        return [("channels", song_data.song)]
+    elif kind == "chain":
+        return [("phrases", song_data.chain_phrases),
+                ("transposes", song_data.chain_transposes)]
+    elif kind == "phrase":
+        return [("notes", song_data.phrase_notes),
+                ("instruments", song_data.phrase_instruments),
+                ("fx", song_data.phrase_fx),
+                ("fx_vals", song_data.phrase_fx_val)]
+    elif kind == "instrument":
+        return [("name", song_data.instrument_names),
+                ("params", song_data.instruments)]
+    elif kind == "table":
+        return [("envelopes", song_data.table_envelopes),
+                ("transposes", song_data.table_transposes),
+                ("cmd1_fx", song_data.table_cmd1.fx),
+                ("cmd1_vals", song_data.table_cmd1.val),
+                ("cmd2_fx", song_data.table_cmd2.fx),
+                ("cmd2_vals", song_data.table_cmd2.val)]
+    elif kind == "synth":
+        return [("params", song_data.softsynth_params),
+                ("waves", song_data.wave_frames)]
+    elif kind == "groove":
+        return [("steps", song_data.grooves)]
+
+    raise ValueError("Unknown section kind '%s'" % (kind))
+
+
+def _alloc_table(song_data, kind):
+    if kind == "chain":
+        return song_data.chain_alloc_table
+    elif kind == "phrase":
+        return song_data.phrase_alloc_table
+    elif kind == "instrument":
+        return song_data.instr_alloc_table
+    elif kind == "table":
+        return song_data.table_alloc_table
+
+    # Every row and synth is always there
+    return None
+
+
+def _item_bits(array):
+    return array._length // len(array)
+
+
+class _Layout(object):
+    # Where each section lives in a song's raw data. Worked out once from a
+    # parsed blank song, so that songs being compared never have to be
+    # parsed themselves.
+
+    def __init__(self):
+        song_data = bread.parse(bytearray(RAW_DATA_SIZE), spec.song)
+
+        # kind -> [(field name, byte offset of item 0, bytes per item)]
+        self.fields = {}
+
+        # kind -> (bit offset, bits per item) of its allocation table
+        self.alloc = {}
+
+        # Marks the bytes that belong to some section
+        covered = bytearray(RAW_DATA_SIZE)
+
+        for kind in SECTION_KINDS:
+            if kind == "settings":
+                continue
+
+            fields = []
+
+            for (name, array) in _section_arrays(song_data, kind):
+                # Everything but the allocation tables is whole bytes
+                assert array._offset % 8 == 0 and _item_bits(array) % 8 == 0
+
+                fields.append(
+                    (name, array._offset // 8, _item_bits(array) // 8))
+
+            self.fields[kind] = fields
+
+            alloc_table = _alloc_table(song_data, kind)
+
+            if alloc_table is not None:
+                self.alloc[kind] = (alloc_table._offset,
+                                    _item_bits(alloc_table))
+
+            for (start, end) in self._kind_ranges(kind):
+                covered[start:end] = '\1' * (end - start)
+
+        # Everything else is a field of the settings section. Fields that
+        # share a byte with a section (e.g. padding bits next to an
+        # allocation table) are already covered by it.
+        settings_fields = []
+
+        for field in song_data._field_list:
+            start = field._offset // 8
+            end = (field._offset + field._length + 7) // 8
+
+            if all(covered[start:end]):
+                continue
+
+            if field._name.startswith('_'):
+                name = "unused %04x-%04x" % (start, end - 1)
+            else:
+                name = field._name
+
+            settings_fields.append((name, start, end - start))
+
+        self.fields["settings"] = settings_fields
+
+    def _kind_ranges(self, kind):
+        # (start, end) byte ranges of everything that belongs to the kind
+        count = SECTION_COUNTS[kind]
+
+        ranges = [(start, start + count * length)
+                  for (name, start, length) in self.fields[kind]]
+
+        if kind in self.alloc:
+            (offset, item_bits) = self.alloc[kind]
+            ranges.append((offset // 8,
+                           (offset + count * item_bits + 7) // 8))
+
+        return ranges
+
+    def item_fields(self, raw_data, kind, index):
+        # The raw bytes of each of the item's fields, in order
+        return [raw_data[start + index * length:
+                         start + (index + 1) * length]
+                for (name, start, length) in self.fields[kind]]
+
+    def allocated(self, raw_data, kind, index):
+        if kind not in self.alloc:
+            return True
+
+        (offset, item_bits) = self.alloc[kind]
+
+        if item_bits == 8:
+            return raw_data[offset // 8 + index] != '\0'
+
+        bit = offset + index
+        return (ord(raw_data[bit // 8]) >> (7 - bit % 8)) & 1 == 1
+
+    def kind_chunks(self, raw_data, kind):
+        # Every byte that belongs to any item of the kind
+        return [raw_data[start:end]
+                for (start, end) in self._kind_ranges(kind)]
+
+
+_layout = None
+
+
+def _get_layout():
+    global _layout
+
+    if _layout is None:
+        _layout = _Layout()
+
+    return _layout
+
+
+def load_layout():
+    # Parsing the blank song that the layout comes from takes about as long
+    # as comparing two full .savs, so callers that care about the first
+    # comparison can get it out of the way beforehand
+    _get_layout()
+
+
+def _digest(*chunks):
+    hasher = hashlib.sha1()
+
+    for chunk in chunks:
+        hasher.update(chunk)
+
+    return hasher.digest()
+
+
+class SongDigests(object):
+    """
+    Digests of a song's raw data, worked out as they're asked for: the whole
+    song, then each kind of section, then each item of a kind. Unallocated
+    items have a digest of None, since whatever's left in them doesn't
+    count.
+    """
+
+    def __init__(self, raw_data):
+        self.raw_data = raw_data
+        self.digest = _digest(raw_data)
+
+        self._kind_digests = {}
+        self._item_digests = {}
+
+    def kind_digest(self, kind):
+        if kind not in self._kind_digests:
+            self._kind_digests[kind] = _digest(
+                *_get_layout().kind_chunks(self.raw_data, kind))
+
+        return self._kind_digests[kind]
+
+    def item_digests(self, kind):
+        if kind not in self._item_digests:
+            layout = _get_layout()
+            raw_data = self.raw_data
+
+            self._item_digests[kind] = [
+                _digest(*layout.item_fields(raw_data, kind, index))
+                if layout.allocated(raw_data, kind, index) else None
+                for index in xrange(SECTION_COUNTS[kind])]
+
+        return self._item_digests[kind]
+
+
+def _reference(value):
+    if value == NO_REFERENCE:
+        return "--"
+
+    return "%02x" % (value)
+
+
+def _fx(code, value):
+    return "%s%02x" % (spec.FX_COMMANDS.get(code, "?"), value)
+
+
+def _format_chain_step(phrase, transpose):
+    return "%s %02x" % (_reference(ord(phrase)), ord(transpose))
+
+
+def _format_phrase_step(note, instrument, fx, fx_val):
+    return "%s %s %s" % (spec.NOTES_DICT.get(ord(note), "?"),
+                         _reference(ord(instrument)),
+                         _fx(ord(fx), ord(fx_val)))
+
+
+def _format_table_step(envelope, transpose, cmd1_fx, cmd1_val, cmd2_fx,
+                       cmd2_val):
+    return "%02x %02x %s %s" % (
+        ord(envelope), ord(transpose), _fx(ord(cmd1_fx), ord(cmd1_val)),
+        _fx(ord(cmd2_fx), ord(cmd2_val)))
+
+
+def _format_groove_step(ticks):
+    return "%02x" % (ord(ticks))
+
+
+_STEP_FORMATS = {
+    "chain": _format_chain_step,
+    "phrase": _format_phrase_step,
+    "table": _format_table_step,
+    "groove": _format_groove_step
+}
+
+
+def _flatten(native, prefix=""):
+    flat = {}
+
+    for (key, value) in native.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+
+    return flat
+
+
+def _describe_params(params_a, params_b, struct_spec):
+    # Only the handful of sections that actually changed get parsed
+    try:
+        native_a = _flatten(bread.parse(bytearray(params_a), struct_spec)
+                            .as_native())
+        native_b = _flatten(bread.parse(bytearray(params_b), struct_spec)
+                            .as_native())
+    except (ValueError, BadConditionalCaseError):
+        # Not something LSDj would have written; all that can be said is
+        # which bytes changed
+        return ["bytes: %s -> %s" % (params_a.encode('hex'),
+                                     params_b.encode('hex'))]
+
+    details = []
+
+    for key in sorted(set(native_a.keys()) | set(native_b.keys())):
+        value_a = native_a.get(key, "(none)")
+        value_b = native_b.get(key, "(none)")
+
+        if value_a != value_b:
+            details.append("%s: %s -> %s" % (key, value_a, value_b))
+
+    return details
+
+
+def _describe_steps(kind, fields_a, fields_b):
+    format_step = _STEP_FORMATS[kind]
+    details = []
+
+    for (step, (step_a, step_b)) in enumerate(zip(zip(*fields_a),
+                                                  zip(*fields_b))):
+        if step_a != step_b:
+            details.append("step %x: %s -> %s" % (
+                step, format_step(*step_a), format_step(*step_b)))
+
+    return details
+
+
+def describe_section(kind, raw_a, raw_b, index):
+    """
+    Says what's different about a section that's in both songs, one line per
+    difference
+    """
+    layout = _get_layout()
+
+    fields_a = layout.item_fields(raw_a, kind, index)
+    fields_b = layout.item_fields(raw_b, kind, index)
+
+    if kind == "row":
+        return ["%s: %s -> %s" % (channel, _reference(ord(a)),
+                                  _reference(ord(b)))
+                for (channel, a, b) in zip(SEQUENCE_CHANNELS, fields_a[0],
+                                           fields_b[0]) if a != b]
+    elif kind == "instrument":
+        (name_a, params_a) = fields_a
+        (name_b, params_b) = fields_b
+
+        details = []
+
+        if name_a != name_b:
+            details.append("name: '%s' -> '%s'" % (
+                pylsdjutils.name_without_zeroes(name_a),
+                pylsdjutils.name_without_zeroes(name_b)))
+
+        if params_a != params_b:
+            details.extend(
+                _describe_params(params_a, params_b, spec.instrument))
+
+        return details
+    elif kind == "synth":
+        (params_a, waves_a) = fields_a
+        (params_b, waves_b) = fields_b
+
+        details = []
+
+        if params_a != params_b:
+            details.extend(
+                _describe_params(params_a, params_b, spec.softsynth))
+
+        wave_length = len(waves_a) // spec.WAVES_PER_SYNTH
+        changed_waves = [
+            "%x" % (wave) for wave in xrange(spec.WAVES_PER_SYNTH)
+            if waves_a[wave * wave_length:(wave + 1) * wave_length] !=
+            waves_b[wave * wave_length:(wave + 1) * wave_length]]
+
+        if len(changed_waves) > 0:
+            details.append("waves changed: %s" % (', '.join(changed_waves)))
+
+        return details
+    elif kind == "settings":
+        details = []
+
+        for ((name, start, length), value_a, value_b) in zip(
+                layout.fields["settings"], fields_a, fields_b):
+            if value_a == value_b:
+                continue
+
+            if length <= MAX_SHOWN_SETTING_BYTES:
+                details.append("%s: %s -> %s" % (
+                    name, value_a.encode('hex'), value_b.encode('hex')))
+            else:
+                details.append("%s changed" % (name))
+
+        return details
+
+    return _describe_steps(kind, fields_a, fields_b)
+
+
+def diff_song_data(raw_a, raw_b, digests_a=None, digests_b=None):
+    """
+    Compares two songs' raw data and returns a SectionDiff for each section
+    that differs. Sections are only looked at in detail if their digests
+    differ, and kinds of section only if the digests of all of that kind
+    differ.
+    """
+    if digests_a is None:
+        digests_a = SongDigests(raw_a)
+
+    if digests_b is None:
+        digests_b = SongDigests(raw_b)
+
+    if digests_a.digest == digests_b.digest:
+        return []
+
+    section_diffs = []
+
+    for kind in SECTION_KINDS:
+        if digests_a.kind_digest(kind) == digests_b.kind_digest(kind):
+            continue
+
+        for (index, (item_a, item_b)) in enumerate(
+                zip(digests_a.item_digests(kind),
+                    digests_b.item_digests(kind))):
+            if item_a == item_b:
+                continue
+
+            if item_a is None:
+                section_diffs.append(SectionDiff(kind, index, "added", []))
+            elif item_b is None:
+                section_diffs.append(SectionDiff(kind, index, "removed", []))
+            else:
+                section_diffs.append(SectionDiff(
+                    kind, index, "changed",
+                    describe_section(kind, raw_a, raw_b, index)))
+
+    # Every byte is in some section, so the only way for the songs to differ
+    # without any section differing is in sections that neither song uses
+    if len(section_diffs) == 0:
+        section_diffs.append(SectionDiff(
+            UNUSED_KIND, 0, "changed",
+            ["only data in unallocated sections differs"]))
+
+    return section_diffs
+
+
+def _job_raw_data(job):
+    if job.raw_data is not None:
+        return job.raw_data
+
+    return str(bytearray(filepack.decompress(list(bytearray(
+        job.compressed_data)))))
+
+
+@perf.timed("song_diff.diff_jobs")
+def diff_jobs(job_a, job_b, index=None):
+    """
+    Compares two songs packed up by song_export.make_export_job (either of
+    which may be None, for an empty slot). Returns a SongDiff, or None if
+    the songs are the same.
+    """
+    if job_a is None and job_b is None:
+        return None
+
+    name_a = None if job_a is None else \
+        pylsdjutils.name_without_zeroes(job_a.name)
+    name_b = None if job_b is None else \
+        pylsdjutils.name_without_zeroes(job_b.name)
+
+    if job_a is None:
+        return SongDiff(index, name_a, name_b, "added", [], [])
+    elif job_b is None:
+        return SongDiff(index, name_a, name_b, "removed", [], [])
+
+    details = []
+
+    if job_a.name != job_b.name:
+        details.append("name: '%s' -> '%s'" % (name_a, name_b))
+
+    if job_a.version != job_b.version:
+        details.append("version: %02x -> %02x" % (
+            job_a.version, job_b.version))
+
+    # Songs that are still compressed exactly as they were on disk are the
+    # same if their compressed data is, without decompressing either
+    if (job_a.compressed_data is None or
+            job_a.compressed_data != job_b.compressed_data):
+        sections = diff_song_data(_job_raw_data(job_a), _job_raw_data(job_b))
+    else:
+        sections = []
+
+    if len(details) == 0 and len(sections) == 0:
+        return None
+
+    return SongDiff(index, name_a, name_b, "changed", details, sections)
+
+
+@perf.timed("song_diff.diff_savs")
+def diff_savs(sav_a, projects_a, sav_b, projects_b, task=None):
+    """
+    Compares every slot of two .savs, each given as its SAVFile and the song
+    (or None) in each of its slots, and returns a SongDiff for every slot
+    that differs
+    """
+    song_diffs = []
+
+    with savwriter.open_sav_data(sav_a) as fp_a:
+        with savwriter.open_sav_data(sav_b) as fp_b:
+            for index in xrange(NUM_FILES):
+                if task is not None:
+                    task.report_progress(
+                        "Comparing song %d of %d" % (index + 1, NUM_FILES),
+                        index, NUM_FILES, True)
+
+                jobs = []
+
+                for (sav_obj, fp, projects) in [(sav_a, fp_a, projects_a),
+                                                (sav_b, fp_b, projects_b)]:
+                    if projects[index] is None:
+                        jobs.append(None)
+                    else:
+                        jobs.append(make_export_job(
+                            sav_obj, fp, index, projects[index]))
+
+                song_diff = diff_jobs(jobs[0], jobs[1], index)
+
+                if song_diff is not None:
+                    song_diffs.append(song_diff)
+
+    return song_diffs
+
+
+def format_section(kind, index):
+    if kind in SINGLE_SECTION_KINDS:
+        return kind
+
+    return "%s %02x" % (kind, index)
+
+
+def format_song(song_diff):
+    if song_diff.name_a == song_diff.name_b or song_diff.name_b is None:
+        name = song_diff.name_a
+    elif song_diff.name_a is None:
+        name = song_diff.name_b
+    else:
+        name = "%s -> %s" % (song_diff.name_a, song_diff.name_b)
+
+    if song_diff.index is None:
+        return name
+
+    return "song %02d (%s)" % (song_diff.index + 1, name)
+
+
+def format_diff(song_diffs):
+    if len(song_diffs) == 0:
+        return "No differences"
+
+    lines = []
+
+    for song_diff in song_diffs:
+        lines.append("%s: %s" % (format_song(song_diff), song_diff.change))
+
+        for detail in song_diff.details:
+            lines.append("    %s" % (detail))
+
+        for section_diff in song_diff.sections:
+            lines.append("    %s: %s" % (
+                format_section(section_diff.kind, section_diff.index),
+                section_diff.change))
+
+            for detail in section_diff.details:
+                lines.append("        %s" % (detail))
+
+    return '\n'.join(lines)
+
+
+def _edited(raw_data, offset, value):
+    edited = bytearray(raw_data)
+    edited[offset] = value
+
+    return str(edited)
+
+
+def check():
+    """
+    Checks that changes outside of the songs' rows, chains, phrases,
+    instruments, tables and synths are still reported. Returns a description
+    of everything that's wrong.
+    """
+    layout = _get_layout()
+    blank = str(bytearray(RAW_DATA_SIZE))
+
+    settings_offsets = dict((name, start) for (name, start, length)
+                            in layout.fields["settings"])
+    (groove_name, groove_start, groove_length) = layout.fields["groove"][0]
+    (notes_name, notes_start, notes_length) = layout.fields["phrase"][0]
+
+    cases = [
+        ("tempo", _edited(blank, settings_offsets["tempo"], 0x90),
+         [("settings", 0)]),
+        ("groove 00 step 1", _edited(blank, groove_start + 1, 0x06),
+         [("groove", 0)]),
+        ("unallocated phrase", _edited(blank, notes_start, 0x10),
+         [(UNUSED_KIND, 0)])
+    ]
+
+    problems = []
+
+    for (description, raw_data, expected) in cases:
+        song_diff = diff_jobs(ExportJob(0, "A", 0, blank, None),
+                              ExportJob(0, "A", 0, raw_data, None))
+
+        if song_diff is None:
+            problems.append("%s: no differences reported" % (description))
+            continue
+
+        found = [(section_diff.kind, section_diff.index)
+                 for section_diff in song_diff.sections]
+
+        if found != expected:
+            problems.append("%s: expected %s, found %s" % (
+                description, expected, found))
+
+    return problems
+
+
+def main(argv):
+    problems = check()
+
+    for problem in problems:
+        sys.stderr.write("FAIL: %s\n" % (problem))
+
+    if len(problems) == 0:
+        print("song_diff: all checks passed")
+
+    return 1 if len(problems) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
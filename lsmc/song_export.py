@@ -0,0 +1,155 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import traceback
+
+import bread
+from pylsdj import bread_spec as spec
+from pylsdj import filepack
+from pylsdj.blockutils import BlockFactory, BlockWriter
+
+import savwriter
+from batch_extract import song_filename
+from LazyProject import LazyProject
+
+# Only one of raw_data and compressed_data is set, depending on which form
+# the song was in when it was handed over. Both are plain strings, so that
+# jobs are cheap to send to worker processes.
+ExportJob = collections.namedtuple(
+    "ExportJob", "index name version raw_data compressed_data")
+
+
+class ExportError(Exception):
+    pass
+
+
+def make_export_job(sav_obj, fp, index, project):
+    """
+    Packs up the song in the given slot for write_song. fp is the .sav file
+    the songs were read from, opened for reading.
+    """
+    # A song that's never been read is exported from its compressed data on
+    # disk, so it never has to be decompressed here at all
+    if isinstance(project, LazyProject):
+        if not project.loaded:
+            compressed_data = savwriter.read_compressed_project(
+                sav_obj, fp, index)
+
+            return ExportJob(index, project.name, project.version, None,
+                             str(bytearray(compressed_data)))
+
+        project = project.project
+
+    # Songs are only ever edited through their parsed form, so one that's
+    # never been parsed is still exactly what was read
+    if project._song is None:
+        raw_data = project._raw_bytes
+    else:
+        raw_data = project.get_raw_data()
+
+    return ExportJob(index, project.name, project.version,
+                     str(bytearray(raw_data)), None)
+
+
+def _write_lsdsng(path, name, version, compressed_data):
+    # The same layout as Project.save_lsdsng, without parsing the song
+    preamble = bread.parse(bytearray(9), spec.lsdsng_preamble)
+    preamble.name = name
+    preamble.version = version
+
+    factory = BlockFactory()
+    BlockWriter().write(compressed_data, factory)
+
+    with open(path, 'wb') as fp:
+        fp.write(bread.write(preamble))
+
+        for key in sorted(factory.blocks.keys()):
+            fp.write(bytearray(factory.blocks[key].data))
+
+
+def write_song(args):
+    # Runs in a worker process
+    (job, song_format, path) = args
+
+    try:
+        if song_format == "srm":
+            if job.raw_data is not None:
+                raw_data = bytearray(job.raw_data)
+            else:
+                raw_data = bytearray(filepack.decompress(
+                    bytearray(job.compressed_data)))
+
+            with open(path, 'wb') as fp:
+                fp.write(raw_data)
+        else:
+            if job.compressed_data is not None:
+                compressed_data = list(bytearray(job.compressed_data))
+            else:
+                compressed_data = filepack.compress(bytearray(job.raw_data))
+
+            _write_lsdsng(path, job.name, job.version, compressed_data)
+    except Exception:
+        return (path, traceback.format_exc())
+
+    return (path, None)
+
+
+def export_songs(export_jobs, song_format, directory, jobs=None,
+                 callback=None):
+    """
+    Writes every song in export_jobs into directory in the given format
+    ("lsdsng" or "srm"), in a pool of worker processes if there's more than
+    one. Returns the paths written. Raises ExportError once every song has
+    been tried if any of them couldn't be written.
+    """
+    if callback is None:
+        callback = lambda message, step, total_steps, still_working: None
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    tasks = [(job, song_format, os.path.join(
+        directory, song_filename(job.index, job, song_format)))
+        for job in export_jobs]
+
+    pool = None
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(write_song, tasks)
+    else:
+        results = itertools.imap(write_song, tasks)
+
+    written = []
+    errors = []
+
+    try:
+        for (step, (path, error)) in enumerate(results):
+            callback("Wrote %s" % (os.path.basename(path)), step, len(tasks),
+                     True)
+
+            if error is not None:
+                errors.append("%s: %s" % (
+                    os.path.basename(path), error.strip().splitlines()[-1]))
+            else:
+                written.append(path)
+
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+    if len(errors) > 0:
+        raise ExportError(
+            "Couldn't write %d song(s):\n%s" % (len(errors), '\n'.join(errors)))
+
+    return written
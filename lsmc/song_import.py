@@ -0,0 +1,143 @@
+import itertools
+import multiprocessing
+import os
+import traceback
+
+from pylsdj.project import Project, load_lsdsng, load_srm
+
+import savwriter
+
+IMPORT_EXTENSIONS = ['.lsdsng', '.srm']
+
+# Every block but the header block can hold song data
+AVAILABLE_BLOCKS = savwriter.NUM_BLOCKS - 1
+
+
+class SongImportError(Exception):
+    pass
+
+
+def find_song_files(paths):
+    # Folders are searched for songs; files are taken as they are, so that
+    # anything the user picked by hand is tried
+    song_files = []
+
+    for path in paths:
+        if os.path.isfile(path):
+            song_files.append(os.path.abspath(path))
+            continue
+
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in IMPORT_EXTENSIONS:
+                    song_files.append(
+                        os.path.abspath(os.path.join(dirpath, filename)))
+
+    return song_files
+
+
+def read_song_file(path):
+    # Runs in a worker process. The song goes back to the parent as its raw
+    # data rather than as a Project, since that's all a Project is until
+    # it's parsed and it's much cheaper to pickle.
+    try:
+        if path.lower().endswith('.srm'):
+            project = load_srm(path)
+        else:
+            project = load_lsdsng(path)
+    except Exception:
+        return (path, None, traceback.format_exc())
+
+    return (path, (project.name, project.version, project.size_blks,
+                   str(bytearray(project._raw_bytes))), None)
+
+
+def read_song_files(paths, jobs=None, callback=None):
+    """
+    Reads every song file in paths, in a pool of worker processes if there's
+    more than one. Returns a Project for each path, in the same order.
+    Raises SongImportError if any of the files can't be read.
+    """
+    if callback is None:
+        callback = lambda message, step, total_steps, still_working: None
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    pool = None
+
+    if jobs > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(paths)))
+        results = pool.imap(read_song_file, paths)
+    else:
+        results = itertools.imap(read_song_file, paths)
+
+    projects = []
+    errors = []
+
+    try:
+        for (step, (path, song, error)) in enumerate(results):
+            callback("Read %s" % (os.path.basename(path)), step, len(paths),
+                     True)
+
+            if error is not None:
+                errors.append("%s: %s" % (
+                    os.path.basename(path), error.strip().splitlines()[-1]))
+                continue
+
+            (name, version, size_blks, raw_data) = song
+            projects.append(
+                Project(name, version, size_blks, bytearray(raw_data)))
+
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+    if len(errors) > 0:
+        raise SongImportError(
+            "Couldn't read %d file(s):\n%s" % (len(errors), '\n'.join(errors)))
+
+    return projects
+
+
+def free_slots(projects):
+    return [index for (index, project) in enumerate(projects)
+            if project is None]
+
+
+def check_slots(projects, song_count):
+    available = len(free_slots(projects))
+
+    if song_count > available:
+        raise SongImportError(
+            "%d song(s) selected, but only %d slot(s) are empty" % (
+                song_count, available))
+
+
+def plan_import(projects, new_projects):
+    """
+    Assigns each of new_projects to the next empty slot in projects (a list
+    of the project or None in every slot) and returns the assignments as
+    (index, project) pairs. Raises SongImportError without assigning
+    anything if they don't all fit.
+    """
+    check_slots(projects, len(new_projects))
+
+    used_blocks = sum(project.size_blks for project in projects
+                      if project is not None)
+    needed_blocks = sum(project.size_blks for project in new_projects)
+
+    if used_blocks + needed_blocks > AVAILABLE_BLOCKS:
+        raise SongImportError(
+            "The songs need %d blocks, but only %d are free" % (
+                needed_blocks, AVAILABLE_BLOCKS - used_blocks))
+
+    return zip(free_slots(projects), new_projects)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+# Measures how long LSMC takes to start. Run as a script, it starts LSMC in
+# a child process with the LSMC_STARTUP_REPORT environment variable set,
+# prints a breakdown of where import time went (in the style of python3's
+# -X importtime) and the time until the main window appeared, and exits with
+# a non-zero status if startup is over budget or imported a module that
+# should have been deferred.
+#
+# Nothing here may import wx or any of LSMC's modules at the top level,
+# since LSMC imports this module first so that it can time everything else.
+
+import __builtin__
+import argparse
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+REPORT_ENV_VAR = "LSMC_STARTUP_REPORT"
+
+clock = timeit.default_timer
+
+_start_time = clock()
+
+# Seconds from the start of the process until the main window is up
+DEFAULT_FIRST_WINDOW_BUDGET = 2.0
+
+# Modules that are only needed once the user does something, and so must not
+# be imported before the main window appears
+DEFERRED_MODULES = [
+    "SongWindow",
+    "InstrumentPane",
+    "SynthPane",
+    "TablePane",
+    "LibraryWindow",
+    "DuplicatesWindow",
+    "DiffWindow",
+    "images.images"
+]
+
+
+class ImportTimer(object):
+
+    def __init__(self):
+        # (depth, name, self time, cumulative time) for every import that
+        # loaded at least one new module, children before their parents
+        self.records = []
+
+        self._original_import = None
+        self._depth = 0
+
+        # Time spent in recorded child imports of each import in progress
+        self._child_times = []
+
+    def install(self):
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, *args, **kwargs):
+        module_count = len(sys.modules)
+
+        self._depth += 1
+        self._child_times.append(0.0)
+        start = clock()
+
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            child_time = self._child_times.pop()
+            self._depth -= 1
+
+            # Imports of modules that were already loaded are just lookups
+            if len(sys.modules) != module_count:
+                self.records.append(
+                    (self._depth, name, elapsed - child_time, elapsed))
+
+                if len(self._child_times) > 0:
+                    self._child_times[-1] += elapsed
+
+
+_import_timer = None
+
+
+def begin():
+    # Called by LSMC before it imports anything else. Does nothing unless a
+    # startup report was asked for, so normal starts pay nothing for it.
+    global _import_timer
+
+    if os.environ.get(REPORT_ENV_VAR) and _import_timer is None:
+        _import_timer = ImportTimer()
+        _import_timer.install()
+
+
+def main_window_created(main_window):
+    if _import_timer is None:
+        return
+
+    import wx
+
+    # The window is on screen once the event loop gets its first turn
+    wx.CallAfter(_write_report, main_window)
+
+
+def _write_report(main_window):
+    first_window = clock() - _start_time
+
+    _import_timer.uninstall()
+
+    report = {
+        "first_window": first_window,
+        "imports": _import_timer.records,
+        "modules": sorted(
+            name for (name, module) in sys.modules.items()
+            if module is not None)
+    }
+
+    with open(os.environ[REPORT_ENV_VAR], 'w') as fp:
+        json.dump(report, fp)
+
+    main_window.Close()
+
+
+def format_imports(records):
+    lines = ["import time: self [us] | cumulative | imported package"]
+
+    for (depth, name, self_time, cumulative) in records:
+        lines.append("import time: %9d | %10d | %s%s" % (
+            self_time * 1000000, cumulative * 1000000, "  " * depth, name))
+
+    return '\n'.join(lines)
+
+
+def check_report(report, first_window_budget=DEFAULT_FIRST_WINDOW_BUDGET):
+    # Returns a description of everything that's wrong with the report
+    problems = []
+
+    if report["first_window"] > first_window_budget:
+        problems.append(
+            "main window took %.3fs to appear (budget %.3fs)" % (
+                report["first_window"], first_window_budget))
+
+    loaded = set(report["modules"])
+
+    for module_name in DEFERRED_MODULES:
+        if module_name in loaded:
+            problems.append(
+                "%s was imported before the main window appeared" % (
+                    module_name))
+
+    return problems
+
+
+def run_lsmc(report_path):
+    env = dict(os.environ)
+    env[REPORT_ENV_VAR] = report_path
+
+    lsmc_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "LSMC")
+
+    subprocess.check_call([sys.executable, lsmc_path], env=env)
+
+    with open(report_path, 'r') as fp:
+        return json.load(fp)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Time LSMC's startup and check it against a budget")
+    parser.add_argument("--budget", type=float,
+                        default=DEFAULT_FIRST_WINDOW_BUDGET,
+                        help="seconds the main window may take to appear "
+                        "(default: %(default)s)")
+    parser.add_argument("-o", "--output",
+                        help="keep the JSON report in this file")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="don't print the import breakdown")
+
+    args = parser.parse_args(argv)
+
+    if args.output is not None:
+        report_path = args.output
+    else:
+        import tempfile
+        (fd, report_path) = tempfile.mkstemp(
+            prefix="lsmc-startup-", suffix=".json")
+        os.close(fd)
+
+    try:
+        report = run_lsmc(report_path)
+    finally:
+        if args.output is None and os.path.exists(report_path):
+            os.remove(report_path)
+
+    if not args.quiet:
+        print(format_imports(report["imports"]))
+        print("")
+
+    print("Time to first window: %.3fs (budget %.3fs)" % (
+        report["first_window"], args.budget))
+
+    problems = check_report(report, args.budget)
+
+    for problem in problems:
+        sys.stderr.write("FAIL: %s\n" % (problem))
+
+    return 1 if len(problems) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
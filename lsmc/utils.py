@@ -1,10 +1,10 @@
 import wx
 import random
 import os
+import collections
 from ObjectListView import ObjectListView
 import traceback
 
-import images.images as compiled_images
 import dirs
 
 
@@ -37,10 +37,14 @@ def show_error_dialog(caption, msg, parent, exception=None):
     errorWindow.ShowModal()
 
 
-def new_obj_list_view(parent, edit_mode=ObjectListView.CELLEDIT_NONE):
-    view = ObjectListView(
+def new_obj_list_view(parent, edit_mode=ObjectListView.CELLEDIT_NONE,
+                      list_class=ObjectListView, single_selection=True):
+    view = list_class(
         parent, wx.ID_ANY, style=wx.LC_REPORT, cellEditMode=edit_mode)
-    enable_single_selection(view, parent)
+
+    if single_selection:
+        enable_single_selection(view, parent)
+
     view.oddRowsBackColor = wx.LIGHT_GREY
 
     return view
@@ -92,12 +96,47 @@ def file_dialog(message, wildcard, style, ok_handler, default_file=''):
         fp.write(last_opened_dir)
 
 
+def replace_file(src, dst):
+    # os.rename won't overwrite an existing file on Windows, so we have to
+    # clear the way first there; everywhere else the rename is atomic
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+
+    os.rename(src, dst)
+
+
 def make_image(image_name):
+    # The embedded image catalog is large, so it isn't imported until the
+    # first image is needed
+    import images.images as compiled_images
+
     assert image_name in compiled_images.catalog
 
     return compiled_images.catalog[image_name].GetImage()
 
 
+BITMAP_CACHE_SIZE = 64
+
+_bitmap_cache = collections.OrderedDict()
+
+
+def make_bitmap(image_name):
+    # Decoding an embedded image and converting it to a bitmap is expensive,
+    # so every bitmap we hand out is kept in a small least-recently-used
+    # cache shared by the whole process
+    if image_name in _bitmap_cache:
+        bitmap = _bitmap_cache.pop(image_name)
+    else:
+        bitmap = wx.BitmapFromImage(make_image(image_name))
+
+        while len(_bitmap_cache) >= BITMAP_CACHE_SIZE:
+            _bitmap_cache.popitem(last=False)
+
+    _bitmap_cache[image_name] = bitmap
+
+    return bitmap
+
+
 def name_empty(name):
     return map(ord, name) == [0] * len(name)
 